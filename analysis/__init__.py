@@ -0,0 +1,5 @@
+from .adaptive import AdaptiveScheduler
+from .ebpf import attribute_gaps, concatenate_traces, kind_name, sweep
+from .evaluate import evaluate_split, evaluate_splits
+from .features import dataset_fingerprint, load_features, transform
+from .timers import clamp_time_resolution, simulate_counter, simulate_grid
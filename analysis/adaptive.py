@@ -0,0 +1,206 @@
+import numpy as np
+
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from .features import bin_average, normalize
+
+# Logistic loss is "log" in the scikit-learn we pin, and "log_loss" from 1.1
+LOG_LOSS = "log_loss" if "log_loss" in SGDClassifier.loss_functions else "log"
+
+
+class AdaptiveScheduler:
+    """Decides how many traces of each site to record next.
+
+    Every site first gets min_runs traces. Collection then goes in rounds.
+    Each round's traces are classified by the model trained on everything
+    before them and only then used to update it with partial_fit, so the
+    model is never retrained from scratch and every prediction is made on
+    traces it hasn't seen. Those predictions go into a confusion matrix whose
+    older rounds count for less and less.
+
+    A site has converged once at least `window` of its traces have been
+    predicted, with recall of at least target and few other traces mistaken
+    for it. Sites that haven't converged share the remaining budget, the most
+    confused first, up to round_size traces per round and max_runs in total.
+    As with TraceScheduler, a site whose runs fail max_attempts times in a row
+    is given up on. Collection stops when the budget runs out or no site that's
+    left needs more traces.
+    """
+
+    def __init__(
+        self,
+        domains,
+        min_runs,
+        max_runs,
+        budget,
+        round_size=5,
+        target=0.95,
+        window=10,
+        bin_size=100,
+        decay=0.7,
+        max_attempts=3,
+        seed=None,
+    ):
+        self.domains = list(domains)
+        self.index = {x: i for i, x in enumerate(self.domains)}
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.budget = budget
+        self.round_size = round_size
+        self.target = target
+        self.window = window
+        self.bin_size = bin_size
+        self.decay = decay
+        self.max_attempts = max_attempts
+
+        n = len(self.domains)
+        self.runs = np.zeros(n, dtype=np.int64)
+        self.evaluated = np.zeros(n, dtype=np.int64)
+        self.failures = np.zeros(n, dtype=np.int64)
+
+        # confusion[i, j] counts traces of site i predicted as site j
+        self.confusion = np.zeros((n, n))
+        self.rounds = 0
+
+        self.scaler = StandardScaler()
+        self.clf = SGDClassifier(loss=LOG_LOSS, random_state=seed)
+        self.rng = np.random.RandomState(seed)
+        self.fitted = False
+
+        self._X = []
+        self._y = []
+
+    def features(self, trace):
+        trace = np.asarray(trace, dtype=np.float32).reshape(1, -1)
+        return normalize(bin_average(trace, self.bin_size), "zscore")[0]
+
+    def add_traces(self, domain, traces):
+        for trace in traces:
+            self._X.append(self.features(trace))
+            self._y.append(self.index[domain])
+
+        self.runs[self.index[domain]] += len(traces)
+
+        if len(traces) > 0:
+            self.failures[self.index[domain]] = 0
+
+    def fail(self, domain):
+        """Count a failed attempt at domain's runs.
+
+        Returns True if the site has now been given up on.
+        """
+        self.failures[self.index[domain]] += 1
+        return self.failures[self.index[domain]] >= self.max_attempts
+
+    def given_up(self):
+        return self.failures >= self.max_attempts
+
+    def remaining(self):
+        return max(0, self.budget - int(self.runs.sum()))
+
+    def recall(self):
+        totals = self.confusion.sum(axis=1)
+        return np.divide(
+            np.diag(self.confusion),
+            totals,
+            out=np.zeros(len(totals)),
+            where=totals > 0,
+        )
+
+    def false_positive_rate(self):
+        predicted = self.confusion.sum(axis=0) - np.diag(self.confusion)
+        totals = self.confusion.sum(axis=1)
+        return np.divide(predicted, totals, out=np.ones(len(totals)), where=totals > 0)
+
+    def converged(self):
+        return (
+            (self.runs >= self.min_runs)
+            & (self.evaluated >= self.window)
+            & (self.recall() >= self.target)
+            & (self.false_positive_rate() <= 1 - self.target)
+        )
+
+    def next_round(self):
+        """Return a {domain: runs} plan for the next round, empty when done."""
+        remaining = self.remaining()
+        plan = {}
+
+        if remaining == 0:
+            return plan
+
+        left = ~self.given_up()
+
+        if (left & (self.runs < self.min_runs)).any() or not self.fitted:
+            for i in np.nonzero(left & (self.runs < self.min_runs))[0]:
+                plan[self.domains[i]] = int(self.min_runs - self.runs[i])
+
+            return plan
+
+        candidates = np.nonzero(left & ~self.converged() & (self.runs < self.max_runs))[
+            0
+        ]
+        weight = (1 - self.recall()) + self.false_positive_rate()
+
+        # Most confused first, with ties broken at random so that no site is
+        # always last in line
+        order = candidates[
+            np.lexsort((self.rng.random_sample(len(candidates)), -weight[candidates]))
+        ]
+
+        for i in order:
+            n = min(self.round_size, self.max_runs - self.runs[i], remaining)
+
+            if n <= 0:
+                break
+
+            plan[self.domains[i]] = int(n)
+            remaining -= n
+
+        return plan
+
+    def end_round(self, passes=5):
+        """Score the round's traces against the model, then learn from them."""
+        if len(self._X) == 0:
+            return
+
+        X = np.array(self._X)
+        y = np.array(self._y)
+        self._X, self._y = [], []
+
+        if self.fitted:
+            predicted = self.clf.predict(self.scaler.transform(X))
+
+            self.confusion *= self.decay
+            np.add.at(self.confusion, (y, predicted), 1)
+            np.add.at(self.evaluated, y, 1)
+
+        self.scaler.partial_fit(X)
+        X = self.scaler.transform(X)
+
+        for _ in range(passes):
+            order = self.rng.permutation(len(X))
+            self.clf.partial_fit(
+                X[order], y[order], classes=np.arange(len(self.domains))
+            )
+
+        self.fitted = True
+        self.rounds += 1
+
+    def summary(self, num_runs):
+        converged = self.converged()
+        total = int(self.runs.sum())
+        baseline = num_runs * len(self.domains)
+
+        summary = (
+            f"Adaptive collection recorded {total} traces in {self.rounds} rounds, "
+            f"{(1 - total / baseline) * 100:.0f}% fewer than {num_runs} per site. "
+            f"{converged.sum()} of {len(self.domains)} sites converged, with a recent "
+            f"recall of {self.recall().mean() * 100:.1f}% on average."
+        )
+        given_up = [x for x, y in zip(self.domains, self.given_up()) if y]
+
+        if len(given_up) > 0:
+            summary += f" Gave up on {len(given_up)} sites: {', '.join(given_up)}."
+
+        return summary
@@ -0,0 +1,134 @@
+import numpy as np
+
+# Event codes passed to record_event() in ebpf/src/main.rs
+IRQ_KIND_NAMES = {
+    1: "softirq",
+    2: "nmi",
+    3: "tlb_flush",
+    4: "reschedule",
+    5: "clock_gettime",
+    6: "page_fault_user",
+    7: "page_fault_kernel",
+    100: "generic_handle_irq",
+    101: "apic_timer_interrupt",
+    102: "spurious_apic_interrupt",
+    103: "call_function",
+    104: "call_function_single",
+    105: "x86_platform_ipi",
+    106: "thermal",
+    107: "irq_work",
+    108: "deferred_error",
+    109: "threshold",
+    110: "irq_move_cleanup",
+    111: "error_interrupt",
+    200: "do_softirq",
+    300: "irqtime_account_irq",
+}
+
+
+def kind_name(kind):
+    if kind >= 10000:
+        return f"irq_{kind - 10000}"
+
+    return IRQ_KIND_NAMES.get(kind, str(kind))
+
+
+def concatenate_traces(traces):
+    """Lay out a list of binary eBPF traces end to end on one timeline.
+
+    Each trace is shifted by the end of the one before it (plus padding), so
+    that a single sorted search over the result never matches a gap in one
+    trace with an IRQ from another. Returns (gap_starts, gap_lengths,
+    irq_times, irq_kinds) as int64 arrays.
+    """
+    gap_starts, gap_lengths, irq_times, irq_kinds = [], [], [], []
+    offset = 0
+
+    for trace in traces:
+        starts = trace["gap_starts"].astype(np.int64)
+        lengths = trace["gap_lengths"].astype(np.int64)
+        times = trace["irq_times"].astype(np.int64)
+
+        gap_starts.append(starts + offset)
+        gap_lengths.append(lengths)
+        irq_times.append(times + offset)
+        irq_kinds.append(trace["irq_kinds"].astype(np.int64))
+
+        end = max(
+            (starts + lengths).max() if len(starts) > 0 else 0,
+            times.max() if len(times) > 0 else 0,
+        )
+        # Leave more room than any sensible attribution window
+        offset += int(end) + 1_000_000_000
+
+    def concat(arrays):
+        return np.concatenate(arrays) if len(arrays) > 0 else np.zeros(0, np.int64)
+
+    return (
+        concat(gap_starts),
+        concat(gap_lengths),
+        concat(irq_times),
+        concat(irq_kinds),
+    )
+
+
+def attribute_gaps(gap_starts, gap_lengths, irq_times, irq_kinds, window=150):
+    """Attribute each gap to an IRQ within window ns of either end of it.
+
+    This is the attribution done in ebpf/src/main.rs, but vectorized. Where
+    several IRQs fall in the window, the earliest one is used (the Rust binary
+    search picks any of them). Returns the kind of each gap's IRQ, or -1 for
+    gaps that can't be explained.
+    """
+    idx = np.searchsorted(irq_times, gap_starts - window, side="left")
+    in_bounds = idx < len(irq_times)
+
+    explained = np.zeros(len(gap_starts), dtype=bool)
+    explained[in_bounds] = (
+        irq_times[idx[in_bounds]] <= (gap_starts + gap_lengths + window)[in_bounds]
+    )
+
+    kinds = np.full(len(gap_starts), -1, dtype=np.int64)
+    kinds[explained] = irq_kinds[idx[explained]]
+    return kinds
+
+
+def sweep(traces, windows, thresholds):
+    """Redo the gap attribution for every (window, threshold) pair.
+
+    Gaps no longer than threshold ns are ignored, as with --ns-threshold when
+    recording, so only thresholds at or above the one used for recording are
+    meaningful. Returns a list of dicts with the explained fraction overall and
+    per IRQ kind.
+    """
+    gap_starts, gap_lengths, irq_times, irq_kinds = concatenate_traces(traces)
+    results = []
+
+    for window in windows:
+        kinds = attribute_gaps(gap_starts, gap_lengths, irq_times, irq_kinds, window)
+        unique_kinds, kind_idx = np.unique(kinds, return_inverse=True)
+
+        for threshold in thresholds:
+            mask = gap_lengths > threshold
+            total = int(mask.sum())
+            counts = np.bincount(kind_idx[mask], minlength=len(unique_kinds))
+
+            by_kind = {
+                kind_name(int(kind)): count / total
+                for kind, count in zip(unique_kinds, counts)
+                if kind != -1 and count > 0
+            }
+
+            results.append(
+                {
+                    "window": window,
+                    "threshold": threshold,
+                    "gaps": total,
+                    "explained": sum(by_kind.values()) if total > 0 else 0.0,
+                    "by_kind": dict(
+                        sorted(by_kind.items(), key=lambda x: x[1], reverse=True)
+                    ),
+                }
+            )
+
+    return results
@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from multiprocessing import shared_memory
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import top_k_accuracy_score
+from sklearn.model_selection import train_test_split
+
+# Set in each pool worker by _init_worker
+_X = None
+_y = None
+_shm = None
+
+
+def evaluate_split(X, y, seed, test_size=0.25, n_jobs=1):
+    """Fit a random forest on one stratified split and return (top1, top5, seconds)."""
+    start_time = time.time()
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=test_size, stratify=y, random_state=seed
+    )
+
+    clf = RandomForestClassifier(n_jobs=n_jobs, random_state=seed)
+    clf = clf.fit(X_train, y_train)
+
+    y_probs = clf.predict_proba(X_test)
+    top1 = top_k_accuracy_score(y_test, y_probs, k=1, labels=clf.classes_)
+    top5 = top_k_accuracy_score(y_test, y_probs, k=5, labels=clf.classes_)
+
+    return top1, top5, time.time() - start_time
+
+
+def _init_worker(shm_name, shape, dtype, y):
+    global _X, _y, _shm
+
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    _X = np.ndarray(shape, dtype=dtype, buffer=_shm.buf)
+    _y = y
+
+
+def _evaluate_shared_split(args):
+    seed, test_size, n_jobs = args
+    return evaluate_split(_X, _y, seed, test_size, n_jobs)
+
+
+def get_split_seeds(n, seed=None):
+    return np.random.RandomState(seed).randint(0, 2**31 - 1, size=n)
+
+
+def evaluate_splits(X, y, n=10, test_size=0.25, seed=None, processes=1, progress=None):
+    """Evaluate n random splits, optionally across a pool of processes.
+
+    Each split gets its own seed drawn from `seed`, which is used for both the
+    split and the forest, so the results are the same however many processes
+    are used. With processes > 1, X is copied into shared memory once and
+    every worker reads it from there; each forest then gets an equal share of
+    the cores so that the machine isn't oversubscribed.
+
+    Returns an (n, 3) array of top1 accuracy, top5 accuracy and seconds taken.
+    """
+    seeds = get_split_seeds(n, seed)
+
+    if processes <= 1:
+        iterator = seeds if progress is None else progress(seeds)
+        return np.array([evaluate_split(X, y, s, test_size) for s in iterator])
+
+    processes = min(processes, n)
+    n_jobs = max(1, (os.cpu_count() or 1) // processes)
+
+    X = np.ascontiguousarray(X)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, X.nbytes))
+
+    try:
+        np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[:] = X
+
+        # Fork, so that scripts without a __main__ guard can call us
+        with multiprocessing.get_context("fork").Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(shm.name, X.shape, X.dtype, y),
+        ) as pool:
+            results = pool.imap(
+                _evaluate_shared_split, [(s, test_size, n_jobs) for s in seeds]
+            )
+
+            if progress is not None:
+                results = progress(results, total=n)
+
+            return np.array(list(results))
+    finally:
+        shm.close()
+        shm.unlink()
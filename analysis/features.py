@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from sklearn.decomposition import PCA
+
+
+def bin_average(X, bin_size):
+    """Average each run of bin_size samples, dropping any incomplete last bin."""
+    if bin_size <= 1:
+        return X
+
+    n_bins = X.shape[1] // bin_size
+    X = np.asarray(X[:, : n_bins * bin_size], dtype=np.float32)
+    return X.reshape(len(X), n_bins, bin_size).mean(axis=2)
+
+
+def normalize(X, method):
+    if method == "zscore":
+        std = X.std(axis=1, keepdims=True)
+        return (X - X.mean(axis=1, keepdims=True)) / np.where(std == 0, 1, std)
+    elif method == "minmax":
+        low = X.min(axis=1, keepdims=True)
+        span = X.max(axis=1, keepdims=True) - low
+        return (X - low) / np.where(span == 0, 1, span)
+
+    return X
+
+
+def summary_stats(X):
+    """Per-trace mean, std, min, max, quartiles and mean absolute difference."""
+    return np.column_stack(
+        [
+            X.mean(axis=1),
+            X.std(axis=1),
+            X.min(axis=1),
+            X.max(axis=1),
+            np.percentile(X, [25, 50, 75], axis=1).T,
+            (
+                np.abs(np.diff(X, axis=1)).mean(axis=1)
+                if X.shape[1] > 1
+                else np.zeros(len(X))
+            ),
+        ]
+    )
+
+
+def transform(
+    X,
+    bin_size=1,
+    normalization=None,
+    include_summary=False,
+    pca_components=None,
+    seed=None,
+):
+    """Reduce raw traces to a smaller float32 feature matrix.
+
+    Traces are bin-averaged to bin_size samples per feature, then optionally
+    normalized per trace, extended with summary statistics, and projected onto
+    pca_components principal components. PCA is fitted on the whole dataset,
+    which is fine for a sanity check but leaks a little information from the
+    test set.
+    """
+    features = bin_average(X, bin_size)
+    features = np.asarray(features, dtype=np.float32)
+    features = normalize(features, normalization)
+
+    if include_summary:
+        features = np.hstack([features, summary_stats(features)])
+
+    if pca_components is not None:
+        features = PCA(n_components=pca_components, random_state=seed).fit_transform(
+            features
+        )
+
+    return np.ascontiguousarray(features, dtype=np.float32)
+
+
+def dataset_fingerprint(path):
+    """Hash the names, sizes and modification times of a dataset's files.
+
+    This is enough to notice new or changed traces without reading them.
+    """
+    if os.path.isdir(path):
+        filepaths = sorted(
+            os.path.join(path, x)
+            for x in os.listdir(path)
+            if os.path.isfile(os.path.join(path, x))
+        )
+    else:
+        filepaths = [path]
+
+    h = hashlib.sha256()
+
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        h.update(
+            f"{os.path.basename(filepath)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+        )
+
+    return h.hexdigest()
+
+
+def load_features(path, load_fn, cache_dir=None, loader_params=None, **params):
+    """Return transformed (X, y, domains) for path, using the cache if possible.
+
+    load_fn(path) should return (X, y, domains) for the raw traces. params are
+    passed to transform. The cache key is made up of the dataset fingerprint,
+    params and loader_params, which should describe any options load_fn was
+    built with. Cached matrices are memory-mapped rather than read into RAM.
+    """
+    if cache_dir is None:
+        X, y, domains = load_fn(path)
+        return transform(X, **params), y, domains
+
+    key = hashlib.sha256(
+        json.dumps(
+            {
+                "dataset": dataset_fingerprint(path),
+                "loader": loader_params,
+                "params": params,
+            },
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()[:16]
+    entry_dir = os.path.join(cache_dir, key)
+
+    if os.path.exists(os.path.join(entry_dir, "domains.json")):
+        X = np.load(os.path.join(entry_dir, "X.npy"), mmap_mode="r")
+        y = np.load(os.path.join(entry_dir, "y.npy"))
+
+        with open(os.path.join(entry_dir, "domains.json")) as f:
+            domains = json.load(f)
+
+        return X, y, domains
+
+    X, y, domains = load_fn(path)
+    X = transform(X, **params)
+
+    os.makedirs(entry_dir, exist_ok=True)
+    np.save(os.path.join(entry_dir, "X.npy"), X)
+    np.save(os.path.join(entry_dir, "y.npy"), y)
+
+    # Written last, so an interrupted save isn't mistaken for a cache hit
+    with open(os.path.join(entry_dir, "domains.json"), "w") as f:
+        json.dump(list(domains), f)
+
+    return X, y, domains
@@ -0,0 +1,295 @@
+import multiprocessing
+
+import numpy as np
+
+# Constants from lib/timer.c, which come from Chrome's time clamping
+C1 = np.uint64(0xFF51AFD7ED558CCD)
+C2 = np.uint64(0xC4CEB9FE1A85EC53)
+MANTISSA_MASK = np.uint64(0x000FFFFFFFFFFFFF)
+EXPONENT_BITS = np.uint64(0x3FF0000000000000)
+SECRET = np.uint64(0x7CAD93BF4A120ED1)
+
+# Set in the parent before forking the pool in simulate_grid
+_read_counts = None
+
+
+def murmur_hash_3(values):
+    values = np.array(values, dtype=np.uint64)
+    shift = np.uint64(33)
+
+    # Multiplication is meant to wrap around, as it does in C
+    with np.errstate(over="ignore"):
+        values ^= values >> shift
+        values *= C1
+        values ^= values >> shift
+        values *= C2
+        values ^= values >> shift
+
+    return values
+
+
+def to_double(values):
+    return ((values & MANTISSA_MASK) | EXPONENT_BITS).view(np.float64) - 1
+
+
+def threshold_for(clamped_time, resolution):
+    clamped_time = np.array(clamped_time, dtype=np.float64, ndmin=1)
+    time_hash = murmur_hash_3(clamped_time.view(np.uint64) ^ SECRET)
+    return clamped_time + resolution * to_double(time_hash)
+
+
+def clamp_time_resolution(time_seconds, resolution, jitter=True):
+    """Vectorized clamp_time_resolution from lib/timer.c, bit for bit."""
+    time_seconds = np.array(time_seconds, dtype=np.float64, ndmin=1)
+    clamped_time = np.floor(time_seconds / resolution) * resolution
+
+    if jitter:
+        clamped_time = np.where(
+            time_seconds >= threshold_for(clamped_time, resolution),
+            clamped_time + resolution,
+            clamped_time,
+        )
+
+    return clamped_time
+
+
+def randomized_timer_steps(duration_ms, rng):
+    """getTime() from attacker/worker.js as a step function of performance.now().
+
+    The worker reads the timer so often that getTime() can be treated as
+    jumping the moment now passes time + currentBinSize. Returns (times,
+    values), where getTime() returns values[i] from times[i] on, with the
+    first call made at time 0.
+    """
+    n = int(duration_ms / 10) + 16
+
+    while True:
+        # time += randomBinSize(); currentBinSize = randomBinSize();
+        values = np.cumsum(rng.random(n) * 50 + 5)
+        bin_sizes = rng.random(n) * 50 + 5
+
+        times = np.zeros(n)
+        times[1:] = np.maximum.accumulate(values[:-1] + bin_sizes[:-1])
+
+        if times[-1] > duration_ms:
+            return times, values
+
+        n *= 2
+
+
+class _Timer:
+    """The timer a simulated counter loop reads, for a batch of traces.
+
+    value(t) is what the timer returns at raw time t, and reach(datum, period,
+    t) returns the first raw time from t on at which the timer minus datum is
+    at least period, along with what the timer returns then. Times are in ms
+    from the start of each trace. start is the value the loop subtracts to get
+    an index into the trace.
+    """
+
+    def __init__(self, n, duration_ms, timer, resolution, jitter, rng):
+        self.timer = timer
+        self.resolution = resolution
+        self.jitter = jitter
+
+        if timer == "clamp":
+            # Jitter depends on the absolute time, so give each trace a
+            # different, plausible wall clock time to start at
+            self.epochs = 1.6e9 + rng.random(n) * 1e8
+            self.start = self.value(np.arange(n), np.zeros(n))
+        elif timer == "randomized":
+            steps = [randomized_timer_steps(duration_ms, rng) for _ in range(n)]
+            width = max(len(times) for times, _ in steps)
+
+            # Pad rows with their last step and offset each one past the end
+            # of the row before, so that a single sorted search covers them all
+            times = np.stack([np.pad(x, (0, width - len(x)), "edge") for x, _ in steps])
+            values = np.stack(
+                [np.pad(x, (0, width - len(x)), "edge") for _, x in steps]
+            )
+
+            self.row_offsets = np.arange(n) * (max(times.max(), values.max()) + 1)
+            self.flat_times = (times + self.row_offsets[:, None]).ravel()
+            self.flat_values = (values + self.row_offsets[:, None]).ravel()
+            self.start = np.zeros(n)
+        else:
+            self.start = np.zeros(n)
+
+    def value(self, rows, t):
+        if self.timer == "clamp":
+            seconds = self.epochs[rows] + t / 1000
+            return clamp_time_resolution(seconds, self.resolution, self.jitter) * 1000
+        elif self.timer == "randomized":
+            i = np.searchsorted(
+                self.flat_times, t + self.row_offsets[rows], side="right"
+            )
+            return self.flat_values[i - 1] - self.row_offsets[rows]
+
+        return np.array(t, dtype=np.float64)
+
+    def reach(self, rows, datum, period, t):
+        v = datum + period
+
+        if self.timer == "clamp":
+            r = self.resolution
+            m = np.ceil(v / 1000 / r)
+            candidates = []
+
+            # The steps the timer takes around v, in the order it takes them.
+            # With jitter, it jumps to (m - 1) * r + r partway through bin
+            # m - 1, then reads m * r from the start of bin m. Those differ in
+            # the last bit, which can decide whether the loop's check passes.
+            for k in [m - 1, m, m + 1, m + 2]:
+                if self.jitter:
+                    candidates.append(
+                        (threshold_for((k - 1) * r, r), ((k - 1) * r + r) * 1000)
+                    )
+
+                candidates.append((k * r, k * r * 1000))
+
+            seconds, values = [np.stack(x) for x in zip(*candidates)]
+            first = np.argmax(values - datum >= period, axis=0)
+            columns = np.arange(len(rows))
+
+            end = (seconds[first, columns] - self.epochs[rows]) * 1000
+            reached = values[first, columns]
+        elif self.timer == "randomized":
+            i = np.searchsorted(self.flat_values, v + self.row_offsets[rows])
+            end = self.flat_times[i] - self.row_offsets[rows]
+
+            # Several steps can happen at once, so take the last one
+            reached = self.value(rows, end)
+        else:
+            end, reached = v, v
+
+        return np.maximum(end, t), reached
+
+
+def simulate_counter(
+    read_counts,
+    bin_us,
+    length,
+    timer=None,
+    resolution=None,
+    jitter=False,
+    period_ms=5,
+    seed=None,
+):
+    """Turn raw timer read counts into the counter traces a given timer gives.
+
+    read_counts is an (n, bins) array of lib.record_read_counts results.
+    timer is None for the unclamped counter attacker, "clamp" for lib/timer.c
+    as used with --timer_resolution and --enable_timer_jitter, or
+    "randomized" for ours_with_timer_countermeasure in worker.js. The counter
+    loop is replayed for every trace at once, assuming readings are spread
+    evenly within each bin and that the countermeasure doesn't change how
+    long a timer read takes (it does, a little).
+
+    Returns (n, length) int32 traces, with -1 wherever no count started,
+    except for randomized, where gaps are filled in as worker.js does.
+    """
+    read_counts = np.atleast_2d(read_counts)
+    n, n_bins = read_counts.shape
+    duration_ms = n_bins * bin_us / 1000
+    rng = np.random.default_rng(seed)
+
+    reads = np.zeros((n, n_bins + 1), dtype=np.int64)
+    np.cumsum(read_counts, axis=1, out=reads[:, 1:])
+
+    def reads_before(rows, t):
+        pos = t * 1000 / bin_us
+        k = np.clip(np.floor(pos).astype(np.int64), 0, n_bins - 1)
+        frac = np.clip(pos - k, 0, 1)
+        before = reads[rows, k]
+        return before + frac * (reads[rows, k + 1] - before)
+
+    clock = _Timer(n, duration_ms, timer, resolution, jitter, rng)
+    out = np.full((n, length), -1, dtype=np.int32)
+    t = np.zeros(n)
+    rows = np.arange(n)
+
+    # What the timer read at t. This is carried over from reach() rather than
+    # recomputed, since converting times back and forth loses precision.
+    now = clock.value(rows, t)
+
+    while len(rows) > 0:
+        datum_time = now[rows]
+        idx = np.floor(datum_time - clock.start[rows]).astype(np.int64)
+
+        keep = idx < length
+        rows, datum_time, idx = rows[keep], datum_time[keep], idx[keep]
+
+        end, now[rows] = clock.reach(rows, datum_time, period_ms, t[rows])
+        counts = reads_before(rows, end) - reads_before(rows, t[rows])
+
+        out[rows, idx] = np.round(counts)
+        t[rows] = end
+
+    if timer == "randomized":
+        # finish() in worker.js fills each gap with the last count, or 0
+        last = np.where(out == -1, -1, np.arange(length))
+        np.maximum.accumulate(last, axis=1, out=last)
+        out = np.where(
+            last == -1, 0, np.take_along_axis(out, np.maximum(last, 0), axis=1)
+        )
+
+    return out
+
+
+def _simulate_batch(args):
+    setting_i, start, stop, bin_us, length, setting, seed = args
+    traces = simulate_counter(
+        _read_counts[start:stop], bin_us, length, seed=seed, **setting
+    )
+    return setting_i, start, traces
+
+
+def simulate_grid(
+    read_counts,
+    bin_us,
+    length,
+    settings,
+    processes=None,
+    seed=None,
+    batch_size=16,
+    progress=None,
+):
+    """Run simulate_counter for every setting, in parallel.
+
+    settings is a list of keyword argument dicts for simulate_counter, e.g.
+    {"timer": "clamp", "resolution": 0.001, "jitter": True}. The traces are
+    split into batches which are simulated by a pool of processes; each batch
+    gets its own seed derived from seed, so results don't depend on the number
+    of processes. Returns one (n, length) int32 array per setting.
+    """
+    global _read_counts
+
+    n = len(read_counts)
+    starts = range(0, n, batch_size)
+
+    # A batch gets the same seed under every setting, so that e.g. the start
+    # times used for jitter are shared and settings are compared like for like
+    batch_seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [
+        (i, start, min(start + batch_size, n), bin_us, length, setting, batch_seed)
+        for i, setting in enumerate(settings)
+        for start, batch_seed in zip(starts, batch_seeds)
+    ]
+
+    out = [np.empty((n, length), dtype=np.int32) for _ in settings]
+    _read_counts = read_counts
+
+    try:
+        # Fork, so that the workers share read_counts with us
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            results = pool.imap_unordered(_simulate_batch, tasks)
+
+            if progress is not None:
+                results = progress(results, total=len(tasks))
+
+            for setting_i, start, traces in results:
+                out[setting_i][start : start + len(traces)] = traces
+    finally:
+        _read_counts = None
+
+    return out
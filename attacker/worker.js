@@ -29,7 +29,10 @@ function finish() {
     }
   }
 
-  postMessage(JSON.stringify(T));
+  // Send the trace as raw 32-bit ints, transferring the buffer rather than
+  // copying it
+  const buffer = Int32Array.from(T).buffer;
+  postMessage(buffer, [buffer]);
 }
 
 function ourLoop() {
@@ -1,3 +1,4 @@
 from .links import LinksDriver
+from .pool import BrowserPool
 from .remote import RemoteDriver
 from .safari import SafariDriver
\ No newline at end of file
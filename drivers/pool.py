@@ -0,0 +1,94 @@
+import threading
+import time
+
+
+class BrowserPool:
+    """Hands out victim browsers, optionally launching the next one early.
+
+    With prewarm enabled, prepare_next() starts launching a browser in a
+    background thread, so that the following get() can return it without
+    waiting for the browser and its driver to start. Browsers handed back with
+    retire() are also quit in the background. Either way, the time spent
+    blocked in get() is tracked so that it can be reported.
+    """
+
+    def __init__(self, create_fn, prewarm=False):
+        self.create_fn = create_fn
+        self.prewarm = prewarm
+
+        self.blocked_time = 0
+        self.startup_time = 0
+        self.num_launches = 0
+
+        self._thread = None
+        self._browser = None
+        self._error = None
+        self._retiring = []
+
+    def _launch(self):
+        start_time = time.time()
+
+        try:
+            self._browser = self.create_fn()
+        except Exception as e:
+            self._error = e
+
+        self.startup_time += time.time() - start_time
+        self.num_launches += 1
+
+    def _start_launch(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._launch, name="browser-pool")
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def prepare_next(self):
+        if self.prewarm:
+            self._start_launch()
+
+    def get(self):
+        start_time = time.time()
+
+        self._start_launch()
+        self._thread.join()
+
+        self.blocked_time += time.time() - start_time
+
+        browser, error = self._browser, self._error
+        self._thread, self._browser, self._error = None, None, None
+
+        if error is not None:
+            raise error
+
+        return browser
+
+    def retire(self, browser):
+        if not self.prewarm:
+            browser.quit()
+            return
+
+        thread = threading.Thread(target=browser.quit, name="browser-pool-quit")
+        thread.setDaemon(True)
+        thread.start()
+        self._retiring.append(thread)
+
+    def close(self):
+        for thread in self._retiring:
+            thread.join()
+
+        self._retiring = []
+
+        if self._thread is not None:
+            # A browser was launched that nobody asked for
+            self._thread.join()
+
+            if self._browser is not None:
+                self._browser.quit()
+
+            self._thread, self._browser, self._error = None, None, None
+
+    def summary(self):
+        return (
+            f"Spent {self.blocked_time:.1f}s waiting on browser startup "
+            f"({self.num_launches} launches, {self.startup_time:.1f}s total startup time)"
+        )
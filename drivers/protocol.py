@@ -0,0 +1,58 @@
+import asyncio
+import json
+import struct
+
+# Every message is a JSON object preceded by its length in bytes
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+
+def encode_message(msg):
+    body = json.dumps(msg).encode("utf-8")
+    return HEADER.pack(len(body)) + body
+
+
+def _decode_body(body):
+    return json.loads(body.decode("utf-8"))
+
+
+def _check_length(length):
+    if length > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Message of {length} bytes is too large")
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray()
+
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+
+        if not chunk:
+            return None
+
+        buf.extend(chunk)
+
+    return bytes(buf)
+
+
+def read_message(sock):
+    """Read one message from a blocking socket, or return None at EOF."""
+    header = _recv_exactly(sock, HEADER.size)
+
+    if header is None:
+        return None
+
+    (length,) = HEADER.unpack(header)
+    _check_length(length)
+    body = _recv_exactly(sock, length)
+    return None if body is None else _decode_body(body)
+
+
+async def read_message_async(reader):
+    """Read one message from an asyncio StreamReader, or return None at EOF."""
+    try:
+        (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        _check_length(length)
+        return _decode_body(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
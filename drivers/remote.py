@@ -1,9 +1,52 @@
+import itertools
 import socket
 import sys
+import threading
+import time
+
+from .protocol import encode_message, read_message
+
+
+class RemoteCommand:
+    """A command sent to the receiver, filled in as the replies come back.
+
+    Navigations get two replies: one as the receiver starts loading the page
+    and one once it's done. All times are converted to our own clock, using
+    the offset measured when connecting, so they can be lined up with traces.
+    """
+
+    def __init__(self, msg_id):
+        self.id = msg_id
+        self.started = threading.Event()
+        self.finished = threading.Event()
+
+        self.start_time = None
+        self.end_time = None
+        self.timed_out = False
+        self.error = None
+        self.lost = False
+        # Page timing events (navigationStart, loadEventEnd, ...), if any
+        self.timing = {}
+
+    def wait_started(self, timeout=None):
+        return self.started.wait(timeout)
+
+    def wait_finished(self, timeout=None):
+        return self.finished.wait(timeout)
+
 
 class RemoteDriver:
 
-    def __init__(self, receiver_ip, receiver_port):
+    def __init__(self, receiver_ip, receiver_port, ack_timeout=60):
+        self.address = f"{receiver_ip}:{receiver_port}"
+        self.ack_timeout = ack_timeout
+        self.closed = False
+        self.clock_offset = 0
+        self.last_navigation = None
+
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
         try:
@@ -11,15 +54,126 @@ class RemoteDriver:
         except:
             print("Connection to receiver failed")
             sys.exit(1)
-    
-    def _send(self, msg):
-        self.s.sendall(f"{msg}\n".encode('utf-8'))
+
+        self._reader = threading.Thread(target=self._read_replies, name="remote-driver")
+        self._reader.setDaemon(True)
+        self._reader.start()
+
+        self.sync_clock()
+
+    def _disconnected(self):
+        self.closed = True
+        return ConnectionError(f"Receiver {self.address} disconnected")
+
+    def _read_replies(self):
+        while True:
+            try:
+                msg = read_message(self.s)
+            except (OSError, ValueError):
+                msg = None
+
+            if msg is None:
+                break
+
+            with self._lock:
+                command = self._pending.get(msg["id"])
+
+            if command is None:
+                continue
+
+            t = msg["time"] - self.clock_offset
+
+            if msg["event"] == "started":
+                command.start_time = t
+                command.started.set()
+                continue
+
+            command.end_time = t
+            command.timed_out = msg.get("timed_out", False)
+            command.error = msg.get("error")
+            command.timing = {
+                k: v / 1000 - self.clock_offset
+                for k, v in (msg.get("timing") or {}).items()
+                if v
+            }
+
+            with self._lock:
+                del self._pending[command.id]
+
+            command.started.set()
+            command.finished.set()
+
+        self.closed = True
+
+        # Wake anybody still waiting on a reply
+        with self._lock:
+            for command in self._pending.values():
+                command.lost = True
+                command.started.set()
+                command.finished.set()
+
+            self._pending = {}
+
+    def _send(self, cmd, **fields):
+        if self.closed:
+            raise self._disconnected()
+
+        command = RemoteCommand(next(self._ids))
+
+        with self._lock:
+            self._pending[command.id] = command
+
+        try:
+            self.s.sendall(encode_message({"id": command.id, "cmd": cmd, **fields}))
+        except OSError:
+            raise self._disconnected()
+
+        return command
+
+    def _wait(self, command, event):
+        if not event.wait(self.ack_timeout):
+            raise TimeoutError(f"Receiver {self.address} didn't reply to {command.id}")
+
+        if command.lost:
+            raise self._disconnected()
+
+    def sync_clock(self, samples=5):
+        """Estimate the offset of the receiver's clock from the round trip
+        with the smallest delay."""
+        best_rtt = None
+
+        for _ in range(samples):
+            sent = time.time()
+            command = self._send("ping")
+            self._wait(command, command.finished)
+            received = time.time()
+
+            if best_rtt is None or received - sent < best_rtt:
+                best_rtt = received - sent
+                # end_time was converted with the old offset, so undo that
+                receiver_time = command.end_time + self.clock_offset
+                offset = receiver_time - (sent + received) / 2
+
+        self.clock_offset = offset
+        return best_rtt
 
     def get(self, url):
-        self._send(url)
-    
+        """Start loading url, returning once the receiver has begun navigating.
+
+        The returned RemoteCommand is also kept as last_navigation, and is
+        finished once the page has loaded or the page load timeout expired.
+        """
+        command = self._send("navigate", url=url)
+        self.last_navigation = command
+        self._wait(command, command.started)
+        return command
+
     def set_page_load_timeout(self, timeout):
-        self._send(f"biggerfish://set-timeout/{timeout}")
-    
+        return self._send("set_timeout", seconds=timeout)
+
     def quit(self):
-        self._send("biggerfish://restart")
\ No newline at end of file
+        try:
+            self._send("restart")
+        except ConnectionError:
+            # Nothing left to quit
+            pass
@@ -1,10 +1,10 @@
-use byteorder::{NativeEndian, ReadBytesExt};
+use byteorder::{LittleEndian, NativeEndian, ReadBytesExt, WriteBytesExt};
 use std::collections::BTreeMap;
-use std::io::Cursor;
-use std::sync::{
-    atomic::{AtomicBool, Ordering},
-    Arc,
-};
+use std::fmt::Write as FmtWrite;
+use std::io::{BufRead, BufReader, Cursor, Write};
+use std::os::unix::fs::PermissionsExt;
+use std::os::unix::net::{UnixListener, UnixStream};
+use std::path::PathBuf;
 use structopt::StructOpt;
 
 #[derive(Debug, StructOpt)]
@@ -15,6 +15,20 @@ struct Opt {
 
     #[structopt(short, long)]
     ns_threshold: Option<u64>,
+
+    /// Stay attached and record a trace each time an "arm <timeout> <ns
+    /// threshold>" command is received on this Unix socket, instead of
+    /// recording a single trace and exiting.
+    #[structopt(long, parse(from_os_str))]
+    socket: Option<PathBuf>,
+
+    /// Write the binary format described in format_binary instead of text.
+    #[structopt(long)]
+    binary: bool,
+
+    /// The core to run on and record interrupts on, i.e. the attacker's.
+    #[structopt(long, default_value = "3")]
+    core: usize,
 }
 
 const MAX_SAMPLES: usize = 1000000;
@@ -31,29 +45,13 @@ fn time() -> u64 {
     t.tv_sec as u64 * 1000_000_000 + t.tv_nsec as u64
 }
 
-fn main() {
-    core_affinity::set_for_current(core_affinity::CoreId { id: 3 });
-
-    eprintln!("pid = {}", unsafe { libc::getpid() });
-
-    let opt = Opt::from_args();
-
-    let running = Arc::new(AtomicBool::new(true));
-    let r = running.clone();
-    ctrlc::set_handler(move || {
-        r.store(false, Ordering::SeqCst);
-    })
-    .expect("Error setting Ctrl-C handler");
-
-    let mut gaps = vec![(1, 1); MAX_SAMPLES];
-    gaps.clear();
-
+fn attach(core: usize) -> bcc::BPF {
     let code = "
 #include <uapi/linux/ptrace.h>
 
 BPF_HASH(interrupts, u64, int, 1000000);
 static void record_event(int num) {
-    if (bpf_get_smp_processor_id() == 3) {
+    if (bpf_get_smp_processor_id() == TARGET_CORE) {
         int irq = num;
         u64 time = bpf_ktime_get_boot_ns();
         interrupts.update(&time, &irq);
@@ -106,8 +104,9 @@ void __sysvec_irq_move_cleanup() { record_event(110); }
 void __sysvec_error_interrupt() { record_event(111); }
 void __do_softirq() { record_event(200); }
 void irqtime_account_irq() { record_event(300); }
-";
-    let mut module = bcc::BPF::new(code).unwrap();
+"
+    .replace("TARGET_CORE", &core.to_string());
+    let mut module = bcc::BPF::new(&code).unwrap();
     bcc::Tracepoint::new()
         .handler("tracepoint__irq__irq_handler_entry")
         .subsystem("irq")
@@ -187,15 +186,32 @@ void irqtime_account_irq() { record_event(300); }
             .unwrap();
     }
 
-    let table = module.table("interrupts").expect("failed to get table");
+    module
+}
+
+struct Trace {
+    explained: f32,
+    irq_times: Vec<(u64, i32)>,
+    gap_sequence: BTreeMap<i32, Vec<u64>>,
+}
+
+fn record(
+    module: &mut bcc::BPF,
+    gaps: &mut Vec<(u64, u64)>,
+    timeout: u64,
+    ns_threshold: u64,
+) -> Trace {
+    gaps.clear();
+
+    let mut table = module.table("interrupts").expect("failed to get table");
 
     let start_time = time();
-    let end_time = start_time + opt.timeout.unwrap_or(5000) * 1000000;
+    let end_time = start_time + timeout * 1000000;
 
     let mut t = start_time;
     while t < end_time {
         let t2 = time();
-        if t2 - t > opt.ns_threshold.unwrap_or(500) {
+        if t2 - t > ns_threshold {
             gaps.push((t - start_time, t2 - t));
             t = time();
         } else {
@@ -214,6 +230,10 @@ void irqtime_account_irq() { record_event(300); }
         }
     }
 
+    // When running as a daemon, the table would otherwise keep filling up
+    // across traces until it hits its size limit
+    table.delete_all().expect("failed to clear table");
+
     irq_times.sort_by_key(|(t, _)| *t);
 
     eprintln!("{:#?}", counts);
@@ -223,7 +243,7 @@ void irqtime_account_irq() { record_event(300); }
     let total_gaps = gaps.len();
     let mut explained_gaps = 0;
 
-    for (start, length) in gaps {
+    for &(start, length) in gaps.iter() {
         let irq_index = irq_times.binary_search_by(|(t, _kind)| {
             if *t < start - 150 {
                 std::cmp::Ordering::Less
@@ -241,13 +261,178 @@ void irqtime_account_irq() { record_event(300); }
         }
     }
 
-    println!("{:.2}", explained_gaps as f32 / total_gaps as f32 * 100.0);
-    for (kind, gaps) in gap_sequence {
-        print!("{}", kind);
+    eprintln!("{}/{}", irq_times.len(), total_gaps);
+
+    Trace {
+        explained: explained_gaps as f32 / total_gaps as f32 * 100.0,
+        irq_times,
+        gap_sequence,
+    }
+}
+
+fn format_text(trace: &Trace) -> Vec<u8> {
+    let mut out = String::new();
+    writeln!(out, "{:.2}", trace.explained).unwrap();
+    for (kind, gaps) in &trace.gap_sequence {
+        write!(out, "{}", kind).unwrap();
         for g in gaps {
-            print!(" {}", g);
+            write!(out, " {}", g).unwrap();
         }
-        println!();
+        writeln!(out).unwrap();
     }
-    eprintln!("{}/{}", irq_times.len(), total_gaps);
+
+    out.into_bytes()
+}
+
+const BINARY_MAGIC: &[u8; 4] = b"BFEB";
+const BINARY_VERSION: u32 = 1;
+
+/// Raw gaps and IRQs, little-endian, so that they can be attributed offline:
+///
+///   magic        4 bytes, "BFEB"
+///   version      u32
+///   explained    f64, percentage of gaps explained by an IRQ
+///   n_gaps       u64
+///   n_irqs       u64
+///   gap_starts   u64 * n_gaps, ns since the start of the trace
+///   gap_lengths  u64 * n_gaps, ns
+///   irq_times    u64 * n_irqs, ns since the start of the trace, sorted
+///   irq_kinds    i32 * n_irqs
+fn format_binary(trace: &Trace, gaps: &[(u64, u64)]) -> Vec<u8> {
+    let n_irqs = trace.irq_times.len();
+    let mut out = Vec::with_capacity(32 + gaps.len() * 16 + n_irqs * 12);
+
+    out.extend_from_slice(BINARY_MAGIC);
+    out.write_u32::<LittleEndian>(BINARY_VERSION).unwrap();
+    out.write_f64::<LittleEndian>(trace.explained as f64)
+        .unwrap();
+    out.write_u64::<LittleEndian>(gaps.len() as u64).unwrap();
+    out.write_u64::<LittleEndian>(n_irqs as u64).unwrap();
+
+    for &(start, _) in gaps {
+        out.write_u64::<LittleEndian>(start).unwrap();
+    }
+    for &(_, length) in gaps {
+        out.write_u64::<LittleEndian>(length).unwrap();
+    }
+    for &(t, _) in &trace.irq_times {
+        out.write_u64::<LittleEndian>(t).unwrap();
+    }
+    for &(_, kind) in &trace.irq_times {
+        out.write_i32::<LittleEndian>(kind).unwrap();
+    }
+
+    out
+}
+
+fn handle_connection(
+    module: &mut bcc::BPF,
+    gaps: &mut Vec<(u64, u64)>,
+    stream: UnixStream,
+) -> bool {
+    let mut writer = stream.try_clone().expect("failed to clone stream");
+    let reader = BufReader::new(stream);
+
+    for line in reader.lines() {
+        let line = match line {
+            Ok(line) => line,
+            Err(_) => break,
+        };
+        let args: Vec<&str> = line.split_whitespace().collect();
+
+        match args.as_slice() {
+            ["arm", timeout, ns_threshold] | ["arm", timeout, ns_threshold, _] => {
+                let binary = args.get(3) == Some(&"binary");
+                let (timeout, ns_threshold) = match (timeout.parse(), ns_threshold.parse()) {
+                    (Ok(timeout), Ok(ns_threshold)) => (timeout, ns_threshold),
+                    _ => {
+                        eprintln!("bad command: {}", line);
+                        continue;
+                    }
+                };
+
+                // Each reply is its length in bytes on its own line, followed by
+                // the same output we print in one-shot mode
+                let trace = record(module, gaps, timeout, ns_threshold);
+                let out = if binary {
+                    format_binary(&trace, gaps)
+                } else {
+                    format_text(&trace)
+                };
+                if writer
+                    .write_all(format!("{}\n", out.len()).as_bytes())
+                    .and_then(|_| writer.write_all(&out))
+                    .is_err()
+                {
+                    break;
+                }
+            }
+            ["quit"] => return false,
+            _ => eprintln!("bad command: {}", line),
+        }
+    }
+
+    true
+}
+
+fn main() {
+    let opt = Opt::from_args();
+
+    core_affinity::set_for_current(core_affinity::CoreId { id: opt.core });
+
+    eprintln!("pid = {}", unsafe { libc::getpid() });
+
+    let mut gaps = Vec::with_capacity(MAX_SAMPLES);
+    let mut module = attach(opt.core);
+
+    let socket = match opt.socket {
+        Some(socket) => socket,
+        None => {
+            let trace = record(
+                &mut module,
+                &mut gaps,
+                opt.timeout.unwrap_or(5000),
+                opt.ns_threshold.unwrap_or(500),
+            );
+            let out = if opt.binary {
+                format_binary(&trace, &gaps)
+            } else {
+                format_text(&trace)
+            };
+            std::io::stdout()
+                .write_all(&out)
+                .expect("failed to write output");
+            return;
+        }
+    };
+
+    // Only bind once everything is attached, so that clients can use the
+    // socket appearing as a sign that we're ready
+    let _ = std::fs::remove_file(&socket);
+    let listener = UnixListener::bind(&socket).expect("failed to bind socket");
+
+    // We usually run under sudo, but the recording script doesn't
+    std::fs::set_permissions(&socket, std::fs::Permissions::from_mode(0o666))
+        .expect("failed to set socket permissions");
+
+    // We share the recording script's process group, so a Ctrl+C meant for it
+    // would kill us mid-trace. It stops us with "quit" once it's wrapped up.
+    unsafe {
+        libc::signal(libc::SIGINT, libc::SIG_IGN);
+    }
+
+    eprintln!("listening on {}", socket.display());
+
+    for stream in listener.incoming() {
+        match stream {
+            Ok(stream) => {
+                if !handle_connection(&mut module, &mut gaps, stream) {
+                    break;
+                }
+            }
+            Err(e) => eprintln!("connection failed: {}", e),
+        }
+    }
+
+    let _ = std::fs::remove_file(&socket);
 }
@@ -0,0 +1,28 @@
+from .benchmark import benchmark_noise_sampler, benchmark_timers, compare_benchmarks
+from .ebpf import DEFAULT_EBPF_CORE, EbpfClient, parse_ebpf_output, read_ebpf_binary
+from .isolation import (
+    ISOLATION_FILENAME,
+    IsolationProfile,
+    browser_pid,
+    irq_name,
+    parse_cores,
+    read_irq_affinities,
+    set_irq_affinity,
+)
+from .metrics import PhaseMetrics
+from .mirror import (
+    MirrorArchive,
+    MirrorServer,
+    capture_site,
+    mirror_path,
+    serve_mirror,
+)
+from .noise import NOISE_FILENAME, NoiseLog, NoiseSamplerProcess, load_noise
+from .quality import QualityReport, check_trace
+from .sampler import (
+    CounterSamplerProcess,
+    load_timer_lib,
+    record_read_counts,
+    sample_counter,
+)
+from .scheduler import SCHEDULE_FILENAME, TraceScheduler
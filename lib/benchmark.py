@@ -0,0 +1,301 @@
+import math
+import os
+import platform
+import time
+
+import numpy as np
+import psutil
+
+from .noise import NoiseSamplerProcess, close_sources, open_sources, sample_sources
+from .sampler import load_timer_lib, sample_counter
+
+# Calls per latency sample. Timing single calls would mostly measure the
+# overhead of perf_counter_ns itself.
+BATCH_SIZE = 100
+
+
+def measure_latency(fn, n=100000):
+    """Return the mean latency of fn in ns over each batch of BATCH_SIZE calls."""
+    n_batches = max(1, n // BATCH_SIZE)
+    latencies = np.empty(n_batches)
+
+    for i in range(n_batches):
+        start = time.perf_counter_ns()
+
+        for _ in range(BATCH_SIZE):
+            fn()
+
+        latencies[i] = (time.perf_counter_ns() - start) / BATCH_SIZE
+
+    return latencies
+
+
+def measure_ticks(fn, n=100000):
+    """Return the gaps between the distinct values fn returned over n calls.
+
+    For a clamped timer these are its ticks, which with jitter vary in size.
+    """
+    values = np.array([fn() for _ in range(n)])
+    changes = np.diff(values)
+    return changes[changes > 0]
+
+
+def count_per_window(fn, n_windows=200, period_ms=5):
+    """Run collect_data's Python counter loop for n_windows windows.
+
+    fn returns seconds, as get_time() in record_data.py does.
+    """
+    counts = np.empty(n_windows, dtype=np.int64)
+
+    for i in range(n_windows):
+        datum_time = fn() * 1000
+        num = 0
+
+        while fn() * 1000 - datum_time < period_ms:
+            num += 1
+
+        counts[i] = num
+
+    return counts
+
+
+def summarize(values, scale=1):
+    values = np.asarray(values, dtype=np.float64) * scale
+
+    if len(values) == 0:
+        return None
+
+    return {
+        "n": len(values),
+        "mean": values.mean(),
+        "min": values.min(),
+        "p50": np.percentile(values, 50),
+        "p95": np.percentile(values, 95),
+        "p99": np.percentile(values, 99),
+        "max": values.max(),
+    }
+
+
+def get_machine_info():
+    info = {
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "kernel": platform.release(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "cpu_model": None,
+        "clocksource": None,
+    }
+
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    info["cpu_model"] = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+
+    try:
+        with open(
+            "/sys/devices/system/clocksource/clocksource0/current_clocksource"
+        ) as f:
+            info["clocksource"] = f.read().strip()
+    except OSError:
+        pass
+
+    return info
+
+
+def get_timer_configs(c_lib, resolutions):
+    """Yield (name, timer_resolution, jitter, fn) for each timer to benchmark.
+
+    The clamped timers share the library's global configuration, so each one
+    reconfigures it before it's yielded, and the caller has to finish with
+    one config before moving on to the next.
+    """
+    yield "time.time", None, False, time.time
+
+    if c_lib is None:
+        return
+
+    yield "raw_timer", None, False, c_lib.raw_timer
+
+    for resolution in resolutions:
+        for jitter in [False, True]:
+            c_lib.configure_timer(resolution, jitter)
+            yield "timer", resolution, jitter, c_lib.timer
+
+
+def benchmark_timers(
+    resolutions=(0.0001, 0.001),
+    calls=100000,
+    n_windows=200,
+    period_ms=5,
+    native=True,
+    progress=None,
+):
+    """Measure the timers the counter attack can use.
+
+    For time.time() and, if libtimer.so has been built, the raw and clamped
+    timers in lib/timer.c, measures the call latency, the size of the ticks
+    that can be observed, and how many reads fit in each period_ms window of
+    the Python counter loop and, with native, the C one. Returns a dict that
+    can be written out as JSON.
+    """
+    try:
+        c_lib = load_timer_lib()
+    except OSError:
+        c_lib = None
+
+    results = {
+        "machine": get_machine_info(),
+        "time": time.time(),
+        "params": {
+            "calls": calls,
+            "n_windows": n_windows,
+            "period_ms": period_ms,
+        },
+        "timers": [],
+    }
+
+    configs = get_timer_configs(c_lib, resolutions)
+
+    if progress is not None:
+        configs = progress(configs, total=2 + 2 * len(resolutions))
+
+    for name, resolution, jitter, fn in configs:
+        result = {
+            "name": name,
+            "resolution": resolution,
+            "jitter": jitter,
+            "latency_ns": summarize(measure_latency(fn, calls)),
+            "tick_us": summarize(measure_ticks(fn, calls), 1e6),
+            "python_counts": summarize(count_per_window(fn, n_windows, period_ms)),
+        }
+
+        if native and name != "time.time":
+            # period_ms can be fractional, but the trace is in whole ms
+            trace = sample_counter(
+                c_lib,
+                math.ceil(n_windows * period_ms),
+                period_ms,
+                clamp=name == "timer",
+            )
+            result["native_counts"] = summarize(trace[trace != -1])
+
+        results["timers"].append(result)
+
+    return results
+
+
+def compare_benchmarks(old, new, threshold=0.1):
+    """List the metrics that got worse by more than threshold between runs.
+
+    Latencies and tick sizes are worse when they grow and counts when they
+    shrink. Only the medians are compared.
+    """
+    regressions = []
+    old_timers = {(x["name"], x["resolution"], x["jitter"]): x for x in old["timers"]}
+
+    for timer in new["timers"]:
+        key = (timer["name"], timer["resolution"], timer["jitter"])
+
+        if key not in old_timers:
+            continue
+
+        for metric, higher_is_worse in [
+            ("latency_ns", True),
+            ("tick_us", True),
+            ("python_counts", False),
+            ("native_counts", False),
+        ]:
+            before = (old_timers[key].get(metric) or {}).get("p50")
+            after = (timer.get(metric) or {}).get("p50")
+
+            if not before or after is None:
+                continue
+
+            change = after / before - 1
+
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append(
+                    {
+                        "timer": key,
+                        "metric": metric,
+                        "before": before,
+                        "after": after,
+                        "change": change,
+                    }
+                )
+
+    return regressions
+
+
+def benchmark_noise_sampler(
+    intervals=(10, 20, 50), calls=2000, n_windows=400, period_ms=5, cores=None
+):
+    """Measure what NoiseSamplerProcess costs.
+
+    Measures how long one sample takes to read, then for each sampling
+    interval, how much CPU the sampler uses during a window, how long it takes
+    to parse the window once it ends, and how many reads fit in each period_ms
+    window of the Python counter loop running in this process at the same
+    time, compared to without the sampler. Pass cores to pin the sampler, and
+    pin this process elsewhere, as record_data.py does with isolation.
+    """
+    fds = open_sources()
+    sources = list(fds)
+    read_latency = measure_latency(lambda: sample_sources(fds), calls)
+    close_sources(fds)
+
+    baseline = count_per_window(time.time, n_windows, period_ms)
+
+    results = {
+        "machine": get_machine_info(),
+        "time": time.time(),
+        "params": {
+            "calls": calls,
+            "n_windows": n_windows,
+            "period_ms": period_ms,
+            "cores": cores,
+        },
+        "sources": sources,
+        "read_latency_us": summarize(read_latency, 1e-3),
+        "baseline_counts": summarize(baseline),
+        "intervals": [],
+    }
+
+    for interval_ms in intervals:
+        sampler = NoiseSamplerProcess(interval_ms, cores=cores)
+        process = psutil.Process(sampler.pid)
+
+        start_time = time.time()
+        cpu_before = sum(process.cpu_times()[:2])
+        sampler.start(start_time)
+
+        counts = count_per_window(time.time, n_windows, period_ms)
+
+        cpu_time = sum(process.cpu_times()[:2]) - cpu_before
+        duration = time.time() - start_time
+
+        stop_time = time.perf_counter()
+        record = sampler.stop()
+        parse_time = time.perf_counter() - stop_time
+        sampler.close()
+
+        results["intervals"].append(
+            {
+                "interval_ms": interval_ms,
+                "samples": 0 if record is None else len(record["t"]),
+                "columns": 0 if record is None else len(record["columns"]),
+                "cpu_percent": cpu_time / duration * 100,
+                "parse_ms": parse_time * 1000,
+                "python_counts": summarize(counts),
+                "counts_change": np.median(counts) / np.median(baseline) - 1,
+            }
+        )
+
+    return results
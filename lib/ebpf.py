@@ -0,0 +1,158 @@
+import socket
+import subprocess
+import time
+
+import numpy as np
+
+BINARY_PATH = "ebpf/target/release/ebpf"
+SOCKET_PATH = "/tmp/biggerfish-ebpf.sock"
+
+# The core the tool records interrupts on, unless it's told otherwise
+DEFAULT_EBPF_CORE = 3
+
+BINARY_MAGIC = b"BFEB"
+BINARY_VERSION = 1
+
+# Matches the layout written by format_binary in ebpf/src/main.rs
+BINARY_HEADER = np.dtype(
+    [
+        ("magic", "S4"),
+        ("version", "<u4"),
+        ("explained", "<f8"),
+        ("n_gaps", "<u8"),
+        ("n_irqs", "<u8"),
+    ]
+)
+
+
+def parse_ebpf_output(output):
+    """Parse the eBPF tool's text output into the format saved by record_data.py.
+
+    The first element is (-1, explained percentage), followed by one
+    (kind, [(x, y), ...]) tuple per IRQ kind.
+    """
+    data = []
+
+    lines = output.splitlines()
+    data.append((-1, lines[0]))
+
+    for line in lines[1:]:
+        x = line.split()
+        kind = x[0]
+        x = list(map(lambda v: int(v), x[1:]))
+        y = []
+
+        for n in range(len(x) // 2):
+            y.append((x[n * 2], x[n * 2 + 1]))
+
+        data.append((kind, y))
+
+    return data
+
+
+def read_ebpf_binary(buffer):
+    """Parse the eBPF tool's binary output into a dict of NumPy arrays.
+
+    The arrays are views into buffer, so nothing is copied.
+    """
+    header = np.frombuffer(buffer, dtype=BINARY_HEADER, count=1)[0]
+
+    if header["magic"] != BINARY_MAGIC:
+        raise ValueError("Not eBPF binary output")
+    elif header["version"] != BINARY_VERSION:
+        raise ValueError(f"Unsupported eBPF binary version {header['version']}")
+
+    n_gaps = int(header["n_gaps"])
+    n_irqs = int(header["n_irqs"])
+    offset = BINARY_HEADER.itemsize
+
+    data = {"explained": float(header["explained"])}
+
+    for name, dtype, count in [
+        ("gap_starts", "<u8", n_gaps),
+        ("gap_lengths", "<u8", n_gaps),
+        ("irq_times", "<u8", n_irqs),
+        ("irq_kinds", "<i4", n_irqs),
+    ]:
+        data[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        offset += data[name].nbytes
+
+    return data
+
+
+class EbpfClient:
+    """Starts the eBPF tool as a daemon and asks it for traces over its socket.
+
+    The daemon compiles and attaches its probes once, so recording a trace only
+    costs a round trip on a Unix socket rather than a full startup. It runs on
+    core, and only records the interrupts that land there.
+    """
+
+    def __init__(
+        self,
+        core=DEFAULT_EBPF_CORE,
+        binary_path=BINARY_PATH,
+        socket_path=SOCKET_PATH,
+        timeout=60,
+    ):
+        self.core = core
+        self.process = subprocess.Popen(
+            ["sudo", binary_path, f"--socket={socket_path}", f"--core={core}"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        # The daemon only binds its socket once everything is attached, which
+        # can take a few seconds while BCC compiles the program
+        deadline = time.time() + timeout
+
+        while True:
+            self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+            try:
+                self.s.connect(socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                self.s.close()
+
+                if self.process.poll() is not None:
+                    raise RuntimeError("eBPF daemon exited before it was ready")
+                elif time.time() > deadline:
+                    raise RuntimeError("Timed out waiting for eBPF daemon")
+
+                time.sleep(0.1)
+
+        self.f = self.s.makefile("rb")
+
+    def record(self, timeout_ms, ns_threshold, binary=False):
+        """Record one trace and return the daemon's raw output.
+
+        Returns None if the daemon went away before sending the whole trace.
+        """
+        command = f"arm {timeout_ms} {ns_threshold}{' binary' if binary else ''}\n"
+
+        try:
+            self.s.sendall(command.encode("utf-8"))
+            line = self.f.readline()
+        except OSError:
+            return None
+
+        if not line.strip():
+            return None
+
+        length = int(line)
+        output = self.f.read(length)
+        return output if len(output) == length else None
+
+    def quit(self):
+        if self.f.closed:
+            return
+
+        try:
+            self.s.sendall(b"quit\n")
+        except OSError:
+            pass
+
+        self.f.close()
+        self.s.close()
+        self.process.wait()
@@ -0,0 +1,314 @@
+import errno
+import json
+import os
+
+import psutil
+
+ISOLATION_FILENAME = "isolation.json"
+
+
+def parse_cores(text):
+    """Parse a core list like 0,2-3 into a sorted list of cores."""
+    cores = set()
+
+    for part in text.split(","):
+        part = part.strip()
+
+        if "-" in part:
+            start, end = part.split("-")
+            cores.update(range(int(start), int(end) + 1))
+        elif part != "":
+            cores.add(int(part))
+
+    return sorted(cores)
+
+
+def cores_to_mask(cores):
+    mask = 0
+
+    for core in cores:
+        mask |= 1 << core
+
+    return mask
+
+
+def mask_to_cores(mask):
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+
+def parse_mask(text):
+    """Parse an smp_affinity mask, which comes in comma-separated 32 bit groups."""
+    return int(text.strip().replace(",", ""), 16)
+
+
+def format_mask(mask):
+    groups = []
+
+    while True:
+        groups.append(mask & 0xFFFFFFFF)
+        mask >>= 32
+
+        if mask == 0:
+            break
+
+    return ",".join(f"{x:08x}" for x in reversed(groups))
+
+
+def read_irq_affinities(proc_root="/proc"):
+    """Return {irq: smp_affinity} for every IRQ, with masks as the kernel writes them."""
+    affinities = {}
+    irq_directory = os.path.join(proc_root, "irq")
+
+    for irq in sorted(os.listdir(irq_directory), key=lambda x: x.zfill(8)):
+        path = os.path.join(irq_directory, irq, "smp_affinity")
+
+        if irq.isnumeric() and os.path.exists(path):
+            with open(path) as f:
+                affinities[irq] = f.read().strip()
+
+    return affinities
+
+
+def irq_name(irq, proc_root="/proc"):
+    """Return the handlers registered for an IRQ, e.g. "nvme0q1", or ""."""
+    irq_directory = os.path.join(proc_root, "irq", irq)
+
+    return ",".join(
+        sorted(
+            x
+            for x in os.listdir(irq_directory)
+            if os.path.isdir(os.path.join(irq_directory, x))
+        )
+    )
+
+
+def set_irq_affinity(irq, mask, proc_root="/proc"):
+    """Write an smp_affinity mask and read it back.
+
+    Returns None if the IRQ now has that affinity, or why it doesn't.
+    """
+    path = os.path.join(proc_root, "irq", irq, "smp_affinity")
+
+    try:
+        with open(path, "w") as f:
+            f.write(mask)
+
+        with open(path) as f:
+            actual = f.read().strip()
+    except OSError as e:
+        if e.errno == errno.EIO:
+            # Per-CPU and kernel-managed IRQs can't be moved from userspace
+            return "managed by the kernel"
+        elif e.errno in [errno.EACCES, errno.EPERM]:
+            return "permission denied"
+
+        return e.strerror or str(e)
+
+    if parse_mask(actual) != parse_mask(mask):
+        return f"kernel kept {actual}"
+
+    return None
+
+
+def process_tree(pid):
+    """Return pid's process and all of its descendants."""
+    try:
+        process = psutil.Process(pid)
+        return [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def browser_pid(browser):
+    """Return the PID of a Selenium browser's driver, or None if there isn't one."""
+    # SafariDriver wraps its Selenium driver
+    browser = getattr(browser, "driver", browser)
+    service = getattr(browser, "service", None)
+    process = getattr(service, "process", None)
+    return None if process is None else process.pid
+
+
+class IsolationProfile:
+    """Keeps the attacker's cores to itself.
+
+    pin() moves a process and its descendants onto the attacker's or victim's
+    cores, and apply() steers every IRQ it can away from the
+    attacker's cores, as does the kernel's default for new IRQs. IRQs keep
+    whichever of their cores aren't the attacker's, so that devices stay close
+    to the cores they were on.
+
+    The affinities that were replaced are written to path before anything is
+    changed, and restore() puts them back and deletes the file. If a job is
+    killed before it can restore them, the next apply() restores them from the
+    file first. The file is in the format save_irqbalance_config.py writes, so
+    load_irqbalance_config.py can also restore it.
+    """
+
+    def __init__(
+        self,
+        attacker_cores,
+        victim_cores,
+        steer_irqs=True,
+        path=ISOLATION_FILENAME,
+        proc_root="/proc",
+    ):
+        self.cores = {
+            "attacker": list(attacker_cores),
+            "victim": list(victim_cores),
+        }
+        self.steer_irqs = steer_irqs
+        self.path = path
+        self.proc_root = proc_root
+
+        # Where to steer IRQs that were only on the attacker's cores
+        self.fallback_mask = cores_to_mask(
+            x for x in range(psutil.cpu_count()) if x not in self.cores["attacker"]
+        )
+
+        self.pid = os.getpid()
+        self.affinity = None
+        self.saved = None
+        self.moved = []
+        self.unmoved = {}
+        self.unpinned = {}
+
+    def pin(self, role, pid):
+        """Pin pid and its descendants, and so anything they start, to role's cores."""
+        for process in process_tree(pid):
+            try:
+                process.cpu_affinity(self.cores[role])
+            except psutil.NoSuchProcess:
+                pass
+            except psutil.AccessDenied:
+                self.unpinned[process.pid] = role
+
+    def pin_self(self, role):
+        if self.affinity is None:
+            self.affinity = psutil.Process().cpu_affinity()
+
+        psutil.Process().cpu_affinity(self.cores[role])
+
+    def irq_mask(self, mask):
+        return (mask & ~cores_to_mask(self.cores["attacker"])) or self.fallback_mask
+
+    def apply(self):
+        if os.path.exists(self.path):
+            print(f"Restoring IRQ affinities left over in {self.path}")
+            self.restore()
+
+        if not self.steer_irqs:
+            return
+
+        default_path = os.path.join(self.proc_root, "irq", "default_smp_affinity")
+        self.saved = read_irq_affinities(self.proc_root)
+
+        with open(default_path) as f:
+            self.saved["default"] = f.read().strip()
+
+        tmp_path = f"{self.path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump(self.saved, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.path)
+
+        for irq, mask in self.saved.items():
+            new_mask = self.irq_mask(parse_mask(mask))
+
+            if new_mask == parse_mask(mask):
+                continue
+
+            if irq == "default":
+                try:
+                    with open(default_path, "w") as f:
+                        f.write(format_mask(new_mask))
+                except OSError as e:
+                    self.unmoved[irq] = e.strerror or str(e)
+
+                continue
+
+            error = set_irq_affinity(irq, format_mask(new_mask), self.proc_root)
+
+            if error is None:
+                self.moved.append(irq)
+            else:
+                self.unmoved[irq] = error
+
+    def restore(self):
+        """Put back the affinities apply() replaced.
+
+        Only the process that created the profile does anything, so that
+        forked workers exiting don't undo it.
+        """
+        if os.getpid() != self.pid:
+            return
+
+        if self.affinity is not None:
+            psutil.Process().cpu_affinity(self.affinity)
+            self.affinity = None
+
+        saved = self.saved
+
+        if saved is None and os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+
+        if saved is None:
+            return
+
+        current = read_irq_affinities(self.proc_root)
+        failed = []
+
+        for irq, mask in saved.items():
+            if irq == "default":
+                try:
+                    with open(
+                        os.path.join(self.proc_root, "irq", "default_smp_affinity"), "w"
+                    ) as f:
+                        f.write(mask)
+                except OSError:
+                    failed.append(irq)
+            elif irq in current and parse_mask(current[irq]) != parse_mask(mask):
+                # IRQs can come and go while we run, and those we couldn't
+                # move are still where they were
+                if set_irq_affinity(irq, mask, self.proc_root) is not None:
+                    failed.append(irq)
+
+        if len(failed) > 0:
+            print(f"Couldn't restore the affinity of IRQs {', '.join(failed)}")
+
+        self.saved = None
+        os.remove(self.path)
+
+    def summary(self):
+        summary = ", ".join(
+            f"{role} on cores {','.join(str(x) for x in cores)}"
+            for role, cores in self.cores.items()
+        )
+        summary = f"Isolation: {summary}."
+
+        if self.steer_irqs:
+            summary += f" Moved {len(self.moved)} IRQs off the attacker's cores."
+
+        if len(self.unmoved) > 0:
+            unmoved = []
+
+            for irq, error in self.unmoved.items():
+                if irq == "default":
+                    unmoved.append(f"the default for new IRQs ({error})")
+                else:
+                    name = irq_name(irq, self.proc_root)
+                    unmoved.append(
+                        f"{irq} {name} ({error})" if name else f"{irq} ({error})"
+                    )
+
+            summary += f" Couldn't move {len(unmoved)}: {', '.join(unmoved)}."
+
+        if len(self.unpinned) > 0:
+            summary += (
+                f" Couldn't pin processes {', '.join(str(x) for x in self.unpinned)}."
+            )
+
+        return summary
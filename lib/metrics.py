@@ -0,0 +1,193 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class PhaseMetrics:
+    """Times the phases of each trace cycle and reports where the time goes.
+
+    Phases timed with phase() are summed until finish_trace(), which returns
+    a record of the cycle: the time spent in each phase plus the wall time
+    since the previous cycle finished. Records passed to log() are appended
+    to a JSONL file, kept for summary(), and, if prometheus_path is given,
+    used to rewrite a Prometheus text file that node_exporter's textfile
+    collector can pick up. That file is rewritten after every record, so it
+    is built from running sums and counts, with quantiles over the last
+    `window` cycles, rather than from every record so far.
+
+    Records are built and logged separately so that worker processes can
+    send theirs to the parent to be logged.
+    """
+
+    def __init__(self, trace_length, path=None, prometheus_path=None, window=1000):
+        self.trace_length = trace_length
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.window = window
+
+        self.records = []
+        self.saved = 0
+        self.start_time = time.time()
+
+        self._sums = {}
+        self._counts = {}
+        self._recent = {}
+
+        self._phases = {}
+        self._cycle_start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._f = None
+
+    def add(self, name, seconds):
+        # Phases may be timed from the thread recording the trace too
+        with self._lock:
+            self._phases[name] = self._phases.get(name, 0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+    def finish_trace(self, domain, saved=True, **fields):
+        end_time = time.perf_counter()
+
+        with self._lock:
+            phases, self._phases = self._phases, {}
+
+        record = {
+            "time": time.time(),
+            "pid": os.getpid(),
+            "domain": domain,
+            "saved": saved,
+            "total": end_time - self._cycle_start,
+            "phases": phases,
+            **fields,
+        }
+
+        self._cycle_start = end_time
+        return record
+
+    def log(self, record):
+        self.records.append(record)
+        self.saved += record["saved"]
+
+        for name, seconds in [*record["phases"].items(), ("total", record["total"])]:
+            self._sums[name] = self._sums.get(name, 0) + seconds
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._recent.setdefault(name, collections.deque(maxlen=self.window)).append(
+                seconds
+            )
+
+        if self.path is not None:
+            if self._f is None:
+                self._f = open(self.path, "a")
+
+            self._f.write(json.dumps(record) + "\n")
+            self._f.flush()
+
+        if self.prometheus_path is not None:
+            self.write_prometheus()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def phase_durations(self):
+        durations = {}
+
+        for record in self.records:
+            for name, seconds in record["phases"].items():
+                durations.setdefault(name, []).append(seconds)
+
+        durations["total"] = [x["total"] for x in self.records]
+        return {k: np.array(v) for k, v in durations.items()}
+
+    def write_prometheus(self):
+        lines = [
+            "# HELP biggerfish_phase_seconds Time spent in each phase of a trace cycle, with quantiles over recent cycles.",
+            "# TYPE biggerfish_phase_seconds summary",
+        ]
+
+        for name in sorted(self._counts):
+            recent = np.array(self._recent[name])
+
+            for q in [0.5, 0.95]:
+                lines.append(
+                    f'biggerfish_phase_seconds{{phase="{name}",quantile="{q}"}} '
+                    f"{np.quantile(recent, q)}"
+                )
+
+            lines.append(
+                f'biggerfish_phase_seconds_sum{{phase="{name}"}} {self._sums[name]}'
+            )
+            lines.append(
+                f'biggerfish_phase_seconds_count{{phase="{name}"}} {self._counts[name]}'
+            )
+
+        lines += [
+            "# HELP biggerfish_traces_total Trace cycles finished, by whether the trace was saved.",
+            "# TYPE biggerfish_traces_total counter",
+            f'biggerfish_traces_total{{saved="true"}} {self.saved}',
+            f'biggerfish_traces_total{{saved="false"}} {len(self.records) - self.saved}',
+            "# HELP biggerfish_traces_per_minute Saved traces per minute since the start of the run.",
+            "# TYPE biggerfish_traces_per_minute gauge",
+            f"biggerfish_traces_per_minute {self.throughput()}",
+        ]
+
+        # Write to a temporary file first so the collector never sees half of it
+        tmp_path = f"{self.prometheus_path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        os.replace(tmp_path, self.prometheus_path)
+
+    def throughput(self):
+        elapsed = time.time() - self.start_time
+        return self.saved / elapsed * 60 if elapsed > 0 else 0.0
+
+    def summary(self):
+        if len(self.records) == 0:
+            return "No trace cycles were timed."
+
+        elapsed = time.time() - self.start_time
+        totals = np.array([x["total"] for x in self.records])
+        overhead = (totals.sum() - len(totals) * self.trace_length) / (
+            len(totals) * self.trace_length
+        )
+
+        lines = [
+            f"Saved {self.saved} of {len(self.records)} traces in {elapsed:.0f}s "
+            f"({self.throughput():.1f} traces/min). Each cycle took "
+            f"{overhead * 100:.0f}% longer than trace_length on average.",
+            f"{'phase':<16}{'p50 (s)':>10}{'p95 (s)':>10}{'% of trace_length':>20}",
+        ]
+
+        durations = self.phase_durations()
+
+        # Most expensive phases first, with the cycle total at the end
+        names = sorted(
+            (x for x in durations if x != "total"),
+            key=lambda x: durations[x].sum(),
+            reverse=True,
+        )
+
+        for name in names + ["total"]:
+            d = durations[name]
+            share = d.sum() / (len(self.records) * self.trace_length) * 100
+            lines.append(
+                f"{name:<16}{np.quantile(d, 0.5):>10.3f}{np.quantile(d, 0.95):>10.3f}"
+                f"{share:>19.1f}%"
+            )
+
+        return "\n".join(lines)
@@ -0,0 +1,375 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+INDEX_FILENAME = "index.json"
+BLOBS_DIRECTORY = "blobs"
+
+# Response headers replayed by the mirror. Caching ones are kept so that the
+# cache-warming run caches the same resources it would online.
+KEPT_HEADERS = ["content-type", "cache-control", "expires", "last-modified", "etag"]
+
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/96.0.4664.45 Safari/537.36"
+)
+
+TAG = re.compile(rb"<([a-zA-Z][a-zA-Z0-9]*)(\s[^>]*)?>", re.S)
+URL_ATTRIBUTE = re.compile(
+    rb"""(\b(?:src|href|poster|data-src)\s*=\s*)(["'])(.*?)\2""", re.I | re.S
+)
+SRCSET_ATTRIBUTE = re.compile(rb"""(\bsrcset\s*=\s*)(["'])(.*?)\2""", re.I | re.S)
+REL_ATTRIBUTE = re.compile(rb"""\brel\s*=\s*["']?([^"'>]*)""", re.I)
+CSS_URL = re.compile(rb"""(url\(\s*)(["']?)([^"')]*?)\2(\s*\))""", re.I)
+CSS_IMPORT = re.compile(rb"""(@import\s+)(["'])(.*?)\2""", re.I)
+
+# Subresource integrity hashes and CSP would reject rewritten resources
+INTEGRITY_ATTRIBUTE = re.compile(rb"""\s(?:integrity|nonce)\s*=\s*(["']).*?\1""", re.I)
+CSP_META = re.compile(
+    rb"""<meta[^>]+http-equiv\s*=\s*["']?content-security-policy[^>]*>""", re.I
+)
+
+# Tags whose URLs are loaded along with the page
+RESOURCE_TAGS = {b"img", b"script", b"link", b"source", b"video", b"audio", b"input"}
+RESOURCE_RELS = {b"stylesheet", b"icon", b"preload", b"modulepreload", b"prefetch"}
+
+
+def mirror_path(url):
+    """Return the path the mirror serves url at, e.g. /www.google.com/logo.png."""
+    parts = urllib.parse.urlsplit(url)
+    path = f"/{parts.netloc}{parts.path or '/'}"
+
+    if parts.query:
+        path += f"?{parts.query}"
+
+    return path
+
+
+def resolve(base_url, raw):
+    """Resolve a URL found in a page, or return None if it can't be mirrored."""
+    raw = raw.strip().decode("latin-1")
+
+    if raw == "" or raw.startswith("#"):
+        return None
+
+    url = urllib.parse.urldefrag(urllib.parse.urljoin(base_url, raw))[0]
+    return url if urllib.parse.urlsplit(url).scheme in ["http", "https"] else None
+
+
+def rewrite_css(body, base_url):
+    """Point url() and @import in a stylesheet at the mirror.
+
+    Returns (body, urls), with urls the absolute URLs that were rewritten.
+    """
+    urls = []
+
+    def replace(match):
+        url = resolve(base_url, match.group(3))
+
+        if url is None:
+            return match.group(0)
+
+        urls.append(url)
+        path = mirror_path(url).encode("latin-1")
+        return (
+            match.group(1)
+            + match.group(2)
+            + path
+            + match.group(2)
+            + (match.group(4) if match.re is CSS_URL else b"")
+        )
+
+    body = CSS_URL.sub(replace, body)
+    body = CSS_IMPORT.sub(replace, body)
+    return body, urls
+
+
+def rewrite_html(body, base_url):
+    """Point the resources a page loads at the mirror.
+
+    URLs in resource tags, srcset attributes and inline styles are rewritten,
+    integrity attributes and CSP meta tags are dropped. Links to other pages
+    are left alone. Returns (body, urls) as rewrite_css does.
+    """
+    urls = []
+
+    def replace_url(match):
+        url = resolve(base_url, match.group(3))
+
+        if url is None:
+            return match.group(0)
+
+        urls.append(url)
+        path = mirror_path(url).encode("latin-1")
+        return match.group(1) + match.group(2) + path + match.group(2)
+
+    def replace_srcset(match):
+        candidates = []
+
+        for candidate in match.group(3).split(b","):
+            parts = candidate.split()
+
+            if len(parts) > 0:
+                url = resolve(base_url, parts[0])
+
+                if url is not None:
+                    urls.append(url)
+                    parts[0] = mirror_path(url).encode("latin-1")
+
+            candidates.append(b" ".join(parts))
+
+        return match.group(1) + match.group(2) + b", ".join(candidates) + match.group(2)
+
+    def replace_tag(match):
+        name = match.group(1).lower()
+        attributes = match.group(2) or b""
+
+        if name not in RESOURCE_TAGS:
+            return match.group(0)
+
+        if name == b"link":
+            rel = REL_ATTRIBUTE.search(attributes)
+
+            if rel is None or not set(rel.group(1).lower().split()) & RESOURCE_RELS:
+                return match.group(0)
+
+        attributes = INTEGRITY_ATTRIBUTE.sub(b"", attributes)
+        attributes = URL_ATTRIBUTE.sub(replace_url, attributes)
+        attributes = SRCSET_ATTRIBUTE.sub(replace_srcset, attributes)
+        return b"<" + match.group(1) + attributes + b">"
+
+    body = CSP_META.sub(b"", body)
+    body = TAG.sub(replace_tag, body)
+
+    # Inline styles
+    body, css_urls = rewrite_css(body, base_url)
+    return body, urls + css_urls
+
+
+class MirrorArchive:
+    """Responses captured by capture_site, stored under their mirror paths.
+
+    Bodies are stored once each in blobs/, named by their SHA-1, and index.json
+    maps each mirror path to its blob, status and headers, and each captured
+    site's URL to the path of its page.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILENAME)
+        self.resources = {}
+        self.sites = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                index = json.load(f)
+
+            self.resources = index["resources"]
+            self.sites = index["sites"]
+
+        self.hosts = set(x.split("/")[1] for x in self.resources)
+
+    def add(self, path, status, headers, body):
+        digest = hashlib.sha1(body).hexdigest()
+        blob_path = os.path.join(self.directory, BLOBS_DIRECTORY, digest[:2], digest)
+
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+
+            with open(f"{blob_path}.tmp", "wb") as f:
+                f.write(body)
+
+            os.replace(f"{blob_path}.tmp", blob_path)
+
+        with self._lock:
+            self.resources[path] = {
+                "blob": digest,
+                "status": status,
+                "headers": {k: v for k, v in headers.items() if k in KEPT_HEADERS},
+            }
+            self.hosts.add(path.split("/")[1])
+
+    def add_site(self, url, path):
+        with self._lock:
+            self.sites[url] = path
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+
+        with self._lock, open(tmp_path, "w") as f:
+            json.dump({"sites": self.sites, "resources": self.resources}, f)
+
+        os.replace(tmp_path, self.path)
+
+    def read(self, entry):
+        digest = entry["blob"]
+
+        with open(
+            os.path.join(self.directory, BLOBS_DIRECTORY, digest[:2], digest), "rb"
+        ) as f:
+            return f.read()
+
+    def lookup(self, path, referer=None):
+        """Return the entry for a request path, or None.
+
+        Scripts can request root-relative URLs that capture never saw
+        rewritten, so if path doesn't start with a captured host, try it under
+        the host of the page that requested it.
+        """
+        entry = self.resources.get(path)
+
+        if entry is not None or referer is None:
+            return entry
+
+        if path.split("/")[1] in self.hosts:
+            return None
+
+        referer_path = urllib.parse.urlsplit(referer).path
+        host = referer_path.split("/")[1] if referer_path.count("/") > 1 else None
+
+        if host in self.hosts:
+            return self.resources.get(f"/{host}{path}")
+
+        return None
+
+
+def fetch(session, url, timeout):
+    """Return (status, headers, body, final url), or None if url can't be reached."""
+    try:
+        response = session.get(url, timeout=timeout)
+    except requests.RequestException:
+        return None
+
+    headers = {k.lower(): v for k, v in response.headers.items()}
+    return response.status_code, headers, response.content, response.url
+
+
+def capture_site(url, archive, max_resources=500, threads=16, timeout=15):
+    """Save url and the resources it loads into archive.
+
+    The page is fetched, its resource URLs are rewritten to mirror paths, and
+    the resources (and, for stylesheets, theirs) are fetched by a pool of
+    threads, up to max_resources in all. Resources that scripts load are only
+    captured if they appear in the page or its stylesheets. Returns the number
+    of resources saved, including the page.
+    """
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=threads)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    result = fetch(session, url, timeout)
+
+    if result is None:
+        return 0
+
+    status, headers, body, final_url = result
+    urls = []
+
+    if "html" in headers.get("content-type", ""):
+        body, urls = rewrite_html(body, final_url)
+
+    archive.add(mirror_path(url), status, headers, body)
+    archive.add_site(url, mirror_path(url))
+
+    seen = set([mirror_path(url)])
+    n = 1
+
+    def capture_resource(resource_url):
+        result = fetch(session, resource_url, timeout)
+
+        if result is None:
+            return []
+
+        status, headers, body, final_url = result
+        nested_urls = []
+
+        if "css" in headers.get("content-type", ""):
+            body, nested_urls = rewrite_css(body, final_url)
+
+        archive.add(mirror_path(resource_url), status, headers, body)
+        return nested_urls
+
+    with ThreadPoolExecutor(threads) as executor:
+        while len(urls) > 0 and n < max_resources:
+            batch = []
+
+            for resource_url in urls:
+                path = mirror_path(resource_url)
+
+                if path not in seen and n + len(batch) < max_resources:
+                    seen.add(path)
+                    batch.append(resource_url)
+
+            urls = [
+                x for nested in executor.map(capture_resource, batch) for x in nested
+            ]
+            n += len(batch)
+
+    return n
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections open, as a real server would, and don't let Nagle's
+    # algorithm hold back a body that's written after its headers
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def send_entry(self, include_body):
+        archive = self.server.archive
+        entry = archive.lookup(self.path, self.headers.get("Referer"))
+
+        if entry is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = archive.read(entry)
+        self.send_response(entry["status"])
+
+        for name, value in entry["headers"].items():
+            self.send_header(name, value)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if include_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_entry(True)
+
+    def do_HEAD(self):
+        self.send_entry(False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MirrorServer(ThreadingHTTPServer):
+    """Serves a MirrorArchive over HTTP, with a thread per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, archive, port, host="0.0.0.0"):
+        self.archive = archive
+        super().__init__((host, port), MirrorRequestHandler)
+
+
+def serve_mirror(archive, port, host="0.0.0.0"):
+    """Start serving archive from a background thread."""
+    server = MirrorServer(archive, port, host)
+    thread = threading.Thread(target=server.serve_forever, name="mirror")
+    thread.setDaemon(True)
+    thread.start()
+    return server
@@ -0,0 +1,314 @@
+import glob
+import multiprocessing
+import os
+import pickle
+import time
+
+import numpy as np
+import psutil
+
+from storage import decode_trace, encode_trace
+
+NOISE_FILENAME = "noise.pkl"
+
+# Columns that are a level rather than a count, so they're kept as they are
+# instead of as the change since the last sample
+GAUGE_PREFIXES = ["freq:", "stat:procs_"]
+
+# Enough for /proc/interrupts on most machines. Bigger files are read again
+# with a bigger buffer.
+READ_SIZE = 1 << 16
+
+STAT_FIELDS = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+
+
+def open_sources(proc_root="/proc", sys_root="/sys"):
+    """Open the files sample_sources reads, once, and return {name: fd}."""
+    paths = {
+        "interrupts": os.path.join(proc_root, "interrupts"),
+        "stat": os.path.join(proc_root, "stat"),
+        "softirqs": os.path.join(proc_root, "softirqs"),
+    }
+
+    for path in glob.glob(
+        os.path.join(sys_root, "devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq")
+    ):
+        cpu = path.split(os.sep)[-3]
+        paths[f"freq:{cpu}"] = path
+
+    return {name: os.open(path, os.O_RDONLY) for name, path in paths.items()}
+
+
+def close_sources(fds):
+    for fd in fds.values():
+        os.close(fd)
+
+
+def read_source(fd):
+    size = READ_SIZE
+
+    while True:
+        data = os.pread(fd, size, 0)
+
+        if len(data) < size:
+            return data
+
+        size *= 2
+
+
+def sample_sources(fds):
+    """Read every source into a {name: bytes} snapshot, without parsing it."""
+    return {name: read_source(fd) for name, fd in fds.items()}
+
+
+def parse_per_cpu(data, prefix, kind):
+    """Parse /proc/interrupts or /proc/softirqs into per-line and per-CPU totals."""
+    lines = data.decode("latin-1").splitlines()
+    n_cpus = len(lines[0].split())
+    cpu_totals = [0] * n_cpus
+    values = {}
+
+    for line in lines[1:]:
+        parts = line.split()
+
+        if len(parts) < 2:
+            continue
+
+        counts = []
+
+        for part in parts[1 : n_cpus + 1]:
+            if not part.isdigit():
+                break
+
+            counts.append(int(part))
+
+        values[f"{prefix}:{parts[0].rstrip(':')}"] = sum(counts)
+
+        for i, count in enumerate(counts):
+            cpu_totals[i] += count
+
+    for i, total in enumerate(cpu_totals):
+        values[f"cpu{i}:{kind}"] = total
+
+    return values
+
+
+def parse_stat(data):
+    values = {}
+
+    for line in data.decode("latin-1").splitlines():
+        parts = line.split()
+
+        if len(parts) < 2:
+            continue
+
+        if parts[0].startswith("cpu"):
+            for field, value in zip(STAT_FIELDS, parts[1:]):
+                values[f"stat:{parts[0]}:{field}"] = int(value)
+        elif parts[0] in ["ctxt", "intr", "procs_running", "procs_blocked"]:
+            values[f"stat:{parts[0]}"] = int(parts[1])
+
+    return values
+
+
+def parse_snapshot(snapshot):
+    values = {}
+
+    for name, data in snapshot.items():
+        if name == "interrupts":
+            values.update(parse_per_cpu(data, "irq", "irqs"))
+        elif name == "softirqs":
+            values.update(parse_per_cpu(data, "softirq", "softirqs"))
+        elif name == "stat":
+            values.update(parse_stat(data))
+        else:
+            values[name] = int(data)
+
+    return values
+
+
+def summarize_window(start_time, times, snapshots):
+    """Turn a window's snapshots into a noise record.
+
+    The first snapshot is the baseline. Each later one becomes a row holding
+    how much every counter went up since the one before, and every gauge's
+    level, with times in ms since the window started, so they index straight
+    into a trace with one sample per ms.
+    """
+    parsed = [parse_snapshot(x) for x in snapshots]
+    columns = list(parsed[0])
+    values = np.array(
+        [[x.get(column, 0) for column in columns] for x in parsed], dtype=np.int64
+    )
+
+    gauges = np.array(
+        [any(x.startswith(prefix) for prefix in GAUGE_PREFIXES) for x in columns]
+    )
+    rows = np.where(gauges, values[1:], np.diff(values, axis=0))
+
+    return {
+        "start_time": start_time,
+        "t": np.round(np.asarray(times[1:]) * 1000).astype(np.int64),
+        "columns": columns,
+        "values": rows,
+    }
+
+
+def _noise_main(conn, cores, interval_ms, proc_root, sys_root):
+    if cores is not None:
+        psutil.Process().cpu_affinity(cores)
+
+    fds = open_sources(proc_root, sys_root)
+    interval = interval_ms / 1000
+
+    while True:
+        command = conn.recv()
+
+        if command == "quit":
+            break
+
+        start_time = command
+        times = [time.time() - start_time]
+        snapshots = [sample_sources(fds)]
+        deadline = start_time + interval
+
+        # Sleep in poll(), so that stop() ends the window straight away
+        while not conn.poll(max(0, deadline - time.time())):
+            times.append(time.time() - start_time)
+            snapshots.append(sample_sources(fds))
+
+            # If we fell behind, skip the samples we missed rather than
+            # taking them back to back
+            deadline += interval
+
+            if deadline < time.time():
+                deadline = time.time() + interval
+
+        conn.recv()
+        conn.send(
+            summarize_window(start_time, times, snapshots)
+            if len(snapshots) > 1
+            else None
+        )
+
+    close_sources(fds)
+
+
+class NoiseSamplerProcess:
+    """Samples interrupt, CPU time, softirq and frequency counters during traces.
+
+    The counters are system-wide. As with CounterSamplerProcess, the sampler
+    is its own long-lived process, optionally pinned, so that it can be kept
+    off the attacker's cores. Its files are opened once, and a sample is only a
+    pread() of each of them. Samples are parsed after the window ends rather
+    than while the trace is being recorded.
+    """
+
+    def __init__(self, interval_ms=20, cores=None, proc_root="/proc", sys_root="/sys"):
+        ctx = multiprocessing.get_context("fork")
+
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(
+            target=_noise_main,
+            args=(child_conn, cores, interval_ms, proc_root, sys_root),
+            name="noise-sampler",
+        )
+        self._process.daemon = True
+        self._process.start()
+        self.pid = self._process.pid
+        self._recording = False
+
+    def start(self, start_time=None):
+        """Start a window at start_time, as returned by time.time().
+
+        A window that was never stopped, as when a trace failed, is dropped.
+        """
+        if self._recording:
+            self.stop()
+
+        self._conn.send(time.time() if start_time is None else start_time)
+        self._recording = True
+
+    def stop(self):
+        """End the window and return its record, or None if it was too short."""
+        if not self._recording:
+            return None
+
+        self._recording = False
+        self._conn.send("stop")
+        return self._conn.recv()
+
+    def close(self):
+        self.stop()
+        self._conn.send("quit")
+        self._process.join()
+
+
+def encode_noise(record, compression="zlib"):
+    return {
+        "t": encode_trace(record["t"], compression),
+        "columns": {
+            column: encode_trace(record["values"][:, i], compression)
+            for i, column in enumerate(record["columns"])
+        },
+    }
+
+
+def decode_noise(data):
+    return {
+        "t": decode_trace(data["t"]),
+        "columns": {k: decode_trace(v) for k, v in data["columns"].items()},
+    }
+
+
+class NoiseLog:
+    """Saves the noise recorded alongside each saved trace.
+
+    Each record is pickled onto the end of path along with the trace's domain
+    and index, i.e. how many traces of the domain were saved before it, which
+    is where it is in the domain's .pkl file or in load_columnar's results for
+    the domain. A trace that's recorded again after an overwrite gets a new
+    record, and load_noise keeps the last one for each trace.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def add(self, domain, index, record):
+        if self._f is None:
+            self._f = open(self.path, "ab")
+
+        pickle.dump(
+            {
+                "domain": domain,
+                "index": index,
+                "start_time": record["start_time"],
+                **encode_noise(record),
+            },
+            self._f,
+        )
+        self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def load_noise(path):
+    """Return {(domain, index): {"t": ..., "columns": {...}}} from a NoiseLog."""
+    noise = {}
+
+    with open(path, "rb") as f:
+        while True:
+            try:
+                data = pickle.load(f)
+            except EOFError:
+                break
+
+            record = decode_noise(data)
+            record["start_time"] = data["start_time"]
+            noise[data["domain"], data["index"]] = record
+
+    return noise
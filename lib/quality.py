@@ -0,0 +1,140 @@
+import json
+import os
+
+import numpy as np
+
+# Samples the counter loops leave unset
+GAP = -1
+
+
+def check_trace(
+    trace,
+    expected_length,
+    min_coverage=0.5,
+    max_fill=0.25,
+    max_run=100,
+    min_cv=0.005,
+    period=5,
+):
+    """Return (stats, reasons) for a numeric trace, with reasons empty if it's OK.
+
+    - length: the trace isn't expected_length samples long
+    - coverage: fewer than min_coverage of its period-sample windows have a
+      sample set, as when the loop fell behind or never started
+    - fill: more than max_fill of it is made up of runs of over max_run
+      samples that are unset or repeat the sample before, as worker.js
+      leaves when it stalls or starts late and finish() forward-fills
+    - variance: the set samples vary by less than min_cv of their mean, as
+      when the counter flat-lines because the page never loaded
+    """
+    trace = np.asarray(trace, dtype=np.float64).ravel()
+    n = len(trace)
+    is_set = trace != GAP
+
+    n_windows = n // period
+    coverage = (
+        is_set[: n_windows * period].reshape(n_windows, period).any(axis=1).mean()
+        if n_windows > 0
+        else 0.0
+    )
+
+    stale = ~is_set
+    stale[1:] |= trace[1:] == trace[:-1]
+    edges = np.diff(np.concatenate([[0], stale.astype(np.int8), [0]]))
+    runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    fill = runs[runs > max_run].sum() / n if n > 0 else 1.0
+
+    values = trace[is_set]
+    mean = abs(values.mean()) if len(values) > 0 else 0.0
+    cv = values.std() / mean if mean > 0 else 0.0
+
+    stats = {
+        "length": n,
+        "coverage": float(coverage),
+        "fill": float(fill),
+        "cv": float(cv),
+    }
+    reasons = []
+
+    if n != expected_length:
+        reasons.append("length")
+
+    if coverage < min_coverage:
+        reasons.append("coverage")
+
+    if fill > max_fill:
+        reasons.append("fill")
+
+    if cv < min_cv:
+        reasons.append("variance")
+
+    return stats, reasons
+
+
+class QualityReport:
+    """Keeps track of the traces rejected by check_trace over a job.
+
+    log() takes the records that PhaseMetrics.finish_trace returns. Rejected
+    ones carry their reasons in "rejected" and their check_trace stats in
+    "quality", and are appended to a JSONL file at path. close() writes the
+    totals for the job next to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.passed = 0
+        self.rejected = 0
+        self.reasons = {}
+        self.domains = {}
+        self._f = None
+
+    def log(self, record):
+        if record.get("rejected"):
+            if self._f is None:
+                self._f = open(self.path, "a")
+
+            self._f.write(json.dumps(record) + "\n")
+            self._f.flush()
+
+            self.rejected += 1
+            self.domains[record["domain"]] = self.domains.get(record["domain"], 0) + 1
+
+            for reason in record["rejected"]:
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        elif record["saved"]:
+            self.passed += 1
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+        with open(f"{os.path.splitext(self.path)[0]}.json", "w") as f:
+            json.dump(
+                {
+                    "passed": self.passed,
+                    "rejected": self.rejected,
+                    "reasons": self.reasons,
+                    "domains": self.domains,
+                },
+                f,
+                indent=4,
+            )
+
+    def summary(self):
+        checked = self.passed + self.rejected
+
+        if self.rejected == 0:
+            return f"Quality gate passed all {checked} traces."
+
+        reasons = ", ".join(
+            f"{k} {v}" for k, v in sorted(self.reasons.items(), key=lambda x: -x[1])
+        )
+        worst = ", ".join(
+            f"{k} ({v})"
+            for k, v in sorted(self.domains.items(), key=lambda x: -x[1])[:5]
+        )
+        return (
+            f"Quality gate rejected {self.rejected} of {checked} traces ({reasons}). "
+            f"Most rejected: {worst}. See {self.path}."
+        )
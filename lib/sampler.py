@@ -0,0 +1,140 @@
+import ctypes
+import multiprocessing
+import os
+
+import numpy as np
+import psutil
+
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "libtimer.so")
+
+
+def load_timer_lib(timer_resolution=None, enable_timer_jitter=False):
+    c_lib = ctypes.CDLL(LIB_PATH)
+    c_lib.configure_timer.argtypes = [ctypes.c_double, ctypes.c_bool]
+    c_lib.timer.restype = ctypes.c_double
+    c_lib.raw_timer.restype = ctypes.c_double
+    c_lib.sample_counter.argtypes = [
+        ctypes.POINTER(ctypes.c_int32),
+        ctypes.c_int,
+        ctypes.c_double,
+        ctypes.c_bool,
+    ]
+    c_lib.sample_counter.restype = ctypes.c_int
+    c_lib.record_read_counts.argtypes = [
+        ctypes.POINTER(ctypes.c_int32),
+        ctypes.c_int,
+        ctypes.c_double,
+    ]
+    c_lib.record_read_counts.restype = ctypes.c_int64
+
+    if timer_resolution is not None:
+        c_lib.configure_timer(timer_resolution, enable_timer_jitter)
+
+    return c_lib
+
+
+def sample_counter(c_lib, length, period_ms=5, clamp=False, out=None):
+    """Record a counter trace of length milliseconds with the native loop.
+
+    ctypes releases the GIL for the duration of the call, so other Python
+    threads (e.g. Selenium) don't show up in the counts.
+    """
+    if out is None:
+        out = np.full(length, -1, dtype=np.int32)
+    else:
+        out[:] = -1
+
+    c_lib.sample_counter(
+        out.ctypes.data_as(ctypes.POINTER(ctypes.c_int32)), length, period_ms, clamp
+    )
+    return out
+
+
+def record_read_counts(c_lib, length, bin_us=10, out=None):
+    """Count raw timer readings in each bin_us bin for length milliseconds.
+
+    The result can be turned into counter traces for any timer resolution or
+    jitter setting with analysis.simulate_counter.
+    """
+    n_bins = int(round(length * 1000 / bin_us))
+
+    if out is None:
+        out = np.zeros(n_bins, dtype=np.int32)
+    else:
+        out[:] = 0
+
+    c_lib.record_read_counts(
+        out.ctypes.data_as(ctypes.POINTER(ctypes.c_int32)), n_bins, bin_us
+    )
+    return out
+
+
+def _sampler_main(
+    conn, buffer, cores, period_ms, timer_resolution, enable_timer_jitter
+):
+    if cores is not None:
+        psutil.Process().cpu_affinity(cores)
+
+    c_lib = load_timer_lib(timer_resolution, enable_timer_jitter)
+    out = np.frombuffer(buffer, dtype=np.int32)
+
+    while True:
+        command = conn.recv()
+
+        if command == "quit":
+            break
+
+        sample_counter(
+            c_lib, len(out), period_ms, clamp=timer_resolution is not None, out=out
+        )
+        conn.send("done")
+
+
+class CounterSamplerProcess:
+    """Runs the native counter loop in its own process, optionally pinned.
+
+    The process stays alive between traces and writes each trace into a
+    shared-memory buffer, so the only per-trace cost is a message on a pipe.
+    """
+
+    def __init__(
+        self,
+        length,
+        cores=None,
+        period_ms=5,
+        timer_resolution=None,
+        enable_timer_jitter=False,
+    ):
+        ctx = multiprocessing.get_context("fork")
+
+        self._buffer = ctx.RawArray(ctypes.c_int32, length)
+        self._conn, child_conn = ctx.Pipe()
+        self._process = ctx.Process(
+            target=_sampler_main,
+            args=(
+                child_conn,
+                self._buffer,
+                cores,
+                period_ms,
+                timer_resolution,
+                enable_timer_jitter,
+            ),
+            name="counter-sampler",
+        )
+        self._process.daemon = True
+        self._process.start()
+
+    def start(self):
+        self._conn.send("record")
+
+    def result(self):
+        self._conn.recv()
+        return np.frombuffer(self._buffer, dtype=np.int32).copy()
+
+    def record(self):
+        self.start()
+        return self.result()
+
+    def close(self):
+        self._conn.send("quit")
+        self._process.join()
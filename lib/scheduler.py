@@ -0,0 +1,250 @@
+import json
+import os
+import random
+import time
+
+SCHEDULE_FILENAME = "schedule.json"
+JOURNAL_FILENAME = "schedule.journal"
+
+
+class TraceScheduler:
+    """Hands out (domain, run) work items in interleaved or random order.
+
+    Recording every run of a site back to back ties each site to a stretch of
+    time, so anything that drifts over a job (network conditions, the site
+    itself, background load) ends up looking like a feature of the site.
+    Interleaving runs across sites spreads that out.
+
+    A failed item is retried after a backoff that doubles with each attempt,
+    while other items go ahead. A site that fails max_attempts times in a row
+    is moved to the dead-letter list and its remaining items are dropped. The
+    state is written to path after every failure, and completed items are
+    appended to a journal next to it, which is folded into it every
+    compact_every items and on close(). An interrupted job picks up with the
+    same order, attempts and dead letters.
+    """
+
+    def __init__(
+        self,
+        path,
+        domains,
+        num_runs,
+        stored_runs=None,
+        order="interleaved",
+        max_attempts=3,
+        backoff=30,
+        seed=None,
+        compact_every=1000,
+    ):
+        self.path = path
+        self.journal_path = os.path.join(os.path.dirname(path), JOURNAL_FILENAME)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.compact_every = compact_every
+        self.resumed = False
+
+        self._journal = None
+        self._journal_entries = 0
+
+        params = {"domains": list(domains), "num_runs": num_runs, "order": order}
+        stored_runs = stored_runs or {}
+        state = self.load()
+
+        if state is not None and state["params"] == params:
+            self.state = state
+            self.resumed = True
+            self.replay_journal()
+            self.reconcile(num_runs, stored_runs)
+            return
+
+        pending = [
+            {"domain": domain, "run": run_i, "attempts": 0, "not_before": 0}
+            for run_i in range(num_runs)
+            for domain in domains
+            if run_i >= stored_runs.get(domain, 0)
+        ]
+
+        if order == "random":
+            random.Random(seed).shuffle(pending)
+
+        self.state = {
+            "params": params,
+            "pending": pending,
+            "completed": 0,
+            "failures": {},
+            "dead_letters": {},
+        }
+        self.save()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+
+        done = set()
+
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    domain, run_i = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash. reconcile() catches the trace if
+                    # it was saved.
+                    continue
+
+                done.add((domain, run_i))
+
+        # Items that are already gone were in the schedule before a crash
+        # stopped save() from removing the journal
+        pending = []
+
+        for item in self.pending:
+            if (item["domain"], item["run"]) in done:
+                self.state["completed"] += 1
+                self.state["failures"][item["domain"]] = 0
+            else:
+                pending.append(item)
+
+        self.state["pending"] = pending
+
+    def reconcile(self, num_runs, stored_runs):
+        # A trace that was saved just before the job was killed may not have
+        # been marked as done yet, so trust what's on disk
+        extra = {
+            domain: stored_runs.get(domain, 0) + n - num_runs
+            for domain, n in self.pending_counts().items()
+        }
+        pending = []
+
+        for item in reversed(self.pending):
+            if extra[item["domain"]] > 0:
+                extra[item["domain"]] -= 1
+                self.state["completed"] += 1
+            else:
+                pending.append(item)
+
+        self.state["pending"] = pending[::-1]
+        self.save()
+
+    def pending_counts(self):
+        counts = {}
+
+        for item in self.pending:
+            counts[item["domain"]] = counts.get(item["domain"], 0) + 1
+
+        return counts
+
+    def save(self):
+        # As with Manifest.save, never leave a partially written file behind
+        tmp_path = f"{self.path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.path)
+
+        # Everything in the journal is in the schedule now
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+        self._journal_entries = 0
+
+    def close(self):
+        if self._journal_entries > 0:
+            self.save()
+
+    @property
+    def pending(self):
+        return self.state["pending"]
+
+    @property
+    def dead_letters(self):
+        return self.state["dead_letters"]
+
+    def next(self):
+        """Return (item, wait).
+
+        item is the first pending item that's due, or None, in which case wait
+        is how many seconds until one is. Both are None and 0 once the
+        schedule is done.
+        """
+        now = time.time()
+        earliest = None
+
+        for item in self.pending:
+            if item["not_before"] <= now:
+                return item, 0
+
+            earliest = min(earliest or item["not_before"], item["not_before"])
+
+        if earliest is None:
+            return None, 0
+
+        return None, earliest - now
+
+    def succeed(self, item):
+        self.pending.remove(item)
+        self.state["completed"] += 1
+        self.state["failures"][item["domain"]] = 0
+
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a")
+
+        self._journal.write(json.dumps([item["domain"], item["run"]]) + "\n")
+        self._journal.flush()
+        self._journal_entries += 1
+
+        if self._journal_entries >= self.compact_every:
+            self.save()
+
+    def fail(self, item, error=None):
+        domain = item["domain"]
+        failures = self.state["failures"].get(domain, 0) + 1
+        self.state["failures"][domain] = failures
+        item["attempts"] += 1
+
+        if failures >= self.max_attempts:
+            dropped = [x for x in self.pending if x["domain"] == domain]
+            self.state["pending"] = [x for x in self.pending if x["domain"] != domain]
+            self.dead_letters[domain] = {
+                "error": error,
+                "failures": failures,
+                "dropped_runs": sorted(x["run"] for x in dropped),
+                "time": time.time(),
+            }
+        else:
+            item["not_before"] = time.time() + self.backoff * 2 ** (
+                item["attempts"] - 1
+            )
+
+        self.save()
+
+    def summary(self):
+        dropped = sum(len(x["dropped_runs"]) for x in self.dead_letters.values())
+        summary = (
+            f"Recorded {self.state['completed']} scheduled traces, "
+            f"{len(self.pending)} still pending."
+        )
+
+        if len(self.dead_letters) > 0:
+            summary += (
+                f" Gave up on {len(self.dead_letters)} sites ({dropped} runs): "
+                f"{', '.join(self.dead_letters)}. See {self.path}."
+            )
+
+        return summary
@@ -78,10 +78,87 @@ void configure_timer(double resolution, bool use_jitter)
     enableJitter = use_jitter;
 }
 
-double timer()
+double raw_timer()
 {
     struct timespec time;
     clock_gettime(CLOCK_REALTIME, &time);
-    double time_seconds = time.tv_sec + time.tv_nsec / 1e9;
-    return clamp_time_resolution(time_seconds);
-}
\ No newline at end of file
+    return time.tv_sec + time.tv_nsec / 1e9;
+}
+
+double timer()
+{
+    return clamp_time_resolution(raw_timer());
+}
+
+static inline double now_ms(bool clamp)
+{
+    return (clamp ? timer() : raw_timer()) * 1000;
+}
+
+/*
+ * Native version of the counter attacker in record_data.py. For length
+ * milliseconds, counts how many times we can read the timer in period_ms, and
+ * stores each count in data at the millisecond it started. Slots that never get
+ * a count are left untouched, so callers should fill data with -1 first. If
+ * clamp is set, the timer is clamped (and jittered) as configured by
+ * configure_timer. Returns the number of counts recorded.
+ */
+int sample_counter(int32_t *data, int length, double period_ms, bool clamp)
+{
+    double trace_time = now_ms(clamp);
+    int samples = 0;
+
+    while (true)
+    {
+        double datum_time = now_ms(clamp);
+        int idx = (int)floor(datum_time - trace_time);
+
+        if (idx >= length)
+            break;
+
+        int32_t num = 0;
+
+        while (now_ms(clamp) - datum_time < period_ms)
+            num++;
+
+        data[idx] = num;
+        samples++;
+    }
+
+    return samples;
+}
+
+/*
+ * Records the raw timer readings the counter attacker's loop would make, so
+ * that traces for any timer countermeasure can be derived from them offline
+ * (see analysis/timers.py). Rather than storing every reading, counts how
+ * many times the unclamped timer could be read in each bin_us-microsecond bin
+ * of the trace. counts should be zeroed first. Returns the total number of
+ * readings.
+ */
+int64_t record_read_counts(int32_t *counts, int n_bins, double bin_us)
+{
+    double start = raw_timer();
+    double bin_seconds = bin_us / 1e6;
+    double next_bin = start + bin_seconds;
+    int64_t reads = 0;
+    int idx = 0;
+
+    // Keep the loop as cheap as the counter's, so readings come as often
+    while (idx < n_bins)
+    {
+        double now = raw_timer();
+        reads++;
+
+        while (now >= next_bin && idx < n_bins)
+        {
+            idx++;
+            next_bin = start + (idx + 1) * bin_seconds;
+        }
+
+        if (idx < n_bins)
+            counts[idx]++;
+    }
+
+    return reads;
+}
@@ -7,12 +7,14 @@ if "DISPLAY" not in os.environ:
 from enum import Enum
 
 import argparse
-import ctypes
+import atexit
 import json
 import logging
 import math
+import multiprocessing
 import os
 import pickle
+import psutil
 import queue
 import shutil
 import signal
@@ -21,15 +23,49 @@ import sys
 import threading
 import time
 
-from drivers import LinksDriver, RemoteDriver, SafariDriver
+from drivers import BrowserPool, LinksDriver, RemoteDriver, SafariDriver
+from lib import (
+    CounterSamplerProcess,
+    DEFAULT_EBPF_CORE,
+    EbpfClient,
+    ISOLATION_FILENAME,
+    IsolationProfile,
+    MirrorArchive,
+    NOISE_FILENAME,
+    NoiseLog,
+    NoiseSamplerProcess,
+    PhaseMetrics,
+    QualityReport,
+    SCHEDULE_FILENAME,
+    TraceScheduler,
+    browser_pid,
+    check_trace,
+    load_timer_lib,
+    record_read_counts,
+    parse_cores,
+    parse_ebpf_output,
+    read_ebpf_binary,
+    sample_counter,
+    serve_mirror,
+)
+from analysis import AdaptiveScheduler
+from storage import (
+    ColumnarTraceStore,
+    Manifest,
+    encode_trace,
+    load_columnar,
+    load_pickles,
+    merge_shards,
+)
 
-from flask import Flask, send_from_directory
+from flask import Flask, request, send_from_directory
 from selenium import webdriver
 from selenium.common.exceptions import InvalidSessionIdException, TimeoutException
 from selenium.webdriver.chrome.options import Options
 from tqdm import tqdm
 from urllib3.exceptions import MaxRetryError, ProtocolError
 
+import numpy as np
 import pandas as pd
 
 
@@ -174,12 +210,251 @@ parser.add_argument(
     default=500,
     help="Minimum gap duration to record interrupts with eBPF tool.",
 )
+parser.add_argument(
+    "--storage",
+    type=str,
+    choices=["pickle", "columnar"],
+    default="pickle",
+    help="How to save traces. pickle writes one .pkl per domain, columnar writes a single memory-mappable store of fixed-width rows.",
+)
+parser.add_argument(
+    "--trace_codec",
+    type=str,
+    choices=["none", "zlib", "lzma"],
+    default="none",
+    help="With pickle storage, delta encode and compress each trace before saving it, with zlib or the slower but smaller lzma.",
+)
+parser.add_argument(
+    "--repair_manifest",
+    type=bool,
+    default=False,
+    help="True if we want to rebuild the resume manifest from the .pkl files in the output directory, verifying every record's checksum.",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of attacker/victim browser pairs to record with in parallel.",
+)
+parser.add_argument(
+    "--worker_cores",
+    type=str,
+    default=None,
+    help="Cores to pin each worker to, e.g. 0,1;2,3 for two workers. Defaults to splitting the available cores evenly.",
+)
+parser.add_argument(
+    "--prewarm_browsers",
+    type=bool,
+    default=False,
+    help="True if we want to launch the next victim browser in the background while the current site's cache-warming run is recorded. browser must be set to chrome, chrome_headless or firefox.",
+)
+parser.add_argument(
+    "--trace_delivery",
+    type=str,
+    choices=["push", "poll"],
+    default="push",
+    help="How javascript traces get back to us. push has the attacker page POST the raw trace to our Flask app, poll reads it with execute_script once the trace should be done.",
+)
+parser.add_argument(
+    "--counter_sampler",
+    type=str,
+    choices=["python", "native", "process", "raw"],
+    default="python",
+    help="How to run the counter attacker. python runs the loop in a Python thread, native runs it in C without holding the GIL, and process runs the native loop in a separate process. raw saves how often the unclamped timer could be read in each raw_bin_us bin instead, so that scripts/simulate_timers.py can derive traces for any timer countermeasure.",
+)
+parser.add_argument(
+    "--raw_bin_us",
+    type=float,
+    default=10,
+    help="Bin size in microseconds for counter_sampler raw.",
+)
+parser.add_argument(
+    "--counter_core",
+    type=int,
+    default=None,
+    help="Core to pin the counter sampler process to. counter_sampler must be set to process.",
+)
+parser.add_argument(
+    "--ebpf_format",
+    type=str,
+    choices=["text", "binary"],
+    default="text",
+    help="Output format of the eBPF tool. text saves the gaps attributed to each IRQ kind, binary saves raw gap and IRQ arrays as a dict of NumPy arrays.",
+)
+parser.add_argument(
+    "--receivers",
+    type=str,
+    default=None,
+    help="Comma-separated ip:port addresses of several receivers to spread the sites across, one worker per receiver. browser must be set to remote.",
+)
+parser.add_argument(
+    "--metrics_file",
+    type=str,
+    default=None,
+    help="Where to append per-trace phase timings as JSON lines. Defaults to metrics.jsonl in out_directory.",
+)
+parser.add_argument(
+    "--prometheus_file",
+    type=str,
+    default=None,
+    help="Path to a Prometheus text file to keep updated with phase timings and throughput, if desired.",
+)
+parser.add_argument(
+    "--adaptive",
+    type=bool,
+    default=False,
+    help="True if we want to record in rounds, moving runs from sites that a classifier already recognizes to sites it confuses. num_runs becomes the average number of runs per site.",
+)
+parser.add_argument(
+    "--min_runs",
+    type=int,
+    default=10,
+    help="Number of runs every site gets before adaptive collection starts moving runs around.",
+)
+parser.add_argument(
+    "--max_runs",
+    type=int,
+    default=None,
+    help="Most runs any one site can get with adaptive collection. Defaults to twice num_runs.",
+)
+parser.add_argument(
+    "--adaptive_round_size",
+    type=int,
+    default=5,
+    help="Runs to give each site that needs them in each round of adaptive collection.",
+)
+parser.add_argument(
+    "--adaptive_target",
+    type=float,
+    default=0.95,
+    help="Recall a site needs to reach before adaptive collection stops recording it.",
+)
+parser.add_argument(
+    "--skip_quality_gate",
+    type=bool,
+    default=False,
+    help="True if we want to save counter and javascript traces without checking their coverage, fill and variance first.",
+)
+parser.add_argument(
+    "--min_coverage",
+    type=float,
+    default=0.5,
+    help="Fraction of 5 ms windows a trace needs a sample in to pass the quality gate.",
+)
+parser.add_argument(
+    "--max_fill",
+    type=float,
+    default=0.25,
+    help="Largest fraction of a trace that can be made of runs of unset or repeated samples longer than 100 ms.",
+)
+parser.add_argument(
+    "--min_trace_cv",
+    type=float,
+    default=0.005,
+    help="Smallest coefficient of variation a trace can have before it counts as flat-lined.",
+)
+parser.add_argument(
+    "--max_rejections",
+    type=int,
+    default=5,
+    help="Traces of a site the quality gate can reject in a row before we give up on the site for this pass.",
+)
+parser.add_argument(
+    "--order",
+    type=str,
+    default="domain",
+    choices=["domain", "interleaved", "random"],
+    help="domain records every run of a site before moving on to the next one. interleaved records the first run of every site, then the second, and so on, and random shuffles all runs. Both retry failed runs and can be resumed exactly from their checkpoint.",
+)
+parser.add_argument(
+    "--max_attempts",
+    type=int,
+    default=3,
+    help="Failures in a row after which interleaved or random order, or adaptive collection, gives up on a site.",
+)
+parser.add_argument(
+    "--retry_backoff",
+    type=float,
+    default=30,
+    help="Seconds to wait before retrying a failed run, doubled with every further attempt.",
+)
+parser.add_argument(
+    "--mirror",
+    type=str,
+    default=None,
+    help="Directory of a mirror saved by scripts/capture_sites.py. If set, the victim loads every site from it instead of the internet.",
+)
+parser.add_argument(
+    "--mirror_port",
+    type=int,
+    default=8000,
+    help="The port to serve the mirror on.",
+)
+parser.add_argument(
+    "--mirror_host",
+    type=str,
+    default="localhost",
+    help="The address the victim browser reaches the mirror at, if it's running on another machine.",
+)
+parser.add_argument(
+    "--isolation",
+    type=str,
+    default="none",
+    choices=["none", "separate_cores", "isolate_interrupts"],
+    help="separate_cores pins the attacker, which is the eBPF tool with attacker_type ebpf, and the victim browser to their own cores. isolate_interrupts also moves every IRQ it can off the attacker's cores. Both are undone when recording ends.",
+)
+parser.add_argument(
+    "--attacker_cores",
+    type=str,
+    default=None,
+    help="Cores for the attacker with isolation, e.g. 3 or 2-3. Defaults to the last available core.",
+)
+parser.add_argument(
+    "--victim_cores",
+    type=str,
+    default=None,
+    help="Cores for the victim browser with isolation. Defaults to the available cores the attacker isn't on.",
+)
+parser.add_argument(
+    "--noise_interval_ms",
+    type=float,
+    default=0,
+    help="How often to sample interrupt, CPU time, softirq and CPU frequency counters while each trace is recorded, saved to noise.pkl in the output directory. 0 turns it off.",
+)
 opts = parser.parse_args()
 
 if opts.sites_list == "open_world" and opts.num_runs != 1:
     print("If sites_list = open_world, num_runs must equal 1.")
     sys.exit(1)
 
+if opts.adaptive:
+    if opts.max_runs is None:
+        opts.max_runs = 2 * opts.num_runs
+
+    if opts.sites_list == "open_world" or opts.workers > 1:
+        print("adaptive can't be used with open_world or multiple workers.")
+        sys.exit(1)
+
+    if opts.attacker_type not in ["counter", "javascript"]:
+        print(
+            "adaptive needs numeric traces, so attacker_type must be counter or javascript."
+        )
+        sys.exit(1)
+
+    if not opts.min_runs <= opts.num_runs <= opts.max_runs:
+        print("With adaptive, num_runs must be between min_runs and max_runs.")
+        sys.exit(1)
+
+if opts.order != "domain" and (
+    opts.sites_list == "open_world" or opts.workers > 1 or opts.adaptive
+):
+    print(f"order = {opts.order} can't be used with open_world, workers or adaptive.")
+    sys.exit(1)
+
+if opts.order != "domain" and opts.browser == Browser.SAFARI:
+    print(f"order = {opts.order} isn't supported with Safari.")
+    sys.exit(1)
+
 if (
     opts.disable_chrome_sandbox
     and opts.browser != Browser.CHROME
@@ -216,13 +491,86 @@ if opts.browser == Browser.TOR_BROWSER and (
     )
     sys.exit(1)
 
+if opts.storage == "columnar" and opts.attacker_type == "ebpf":
+    print("eBPF traces aren't fixed-width, so storage can't be columnar.")
+    sys.exit(1)
+
+if opts.trace_codec != "none" and (
+    opts.storage == "columnar" or opts.attacker_type == "ebpf"
+):
+    print("trace_codec only applies to numeric traces saved as pickles.")
+    sys.exit(1)
+
+if opts.receivers is not None:
+    if opts.browser != Browser.REMOTE or opts.attacker_type != "counter":
+        print("If receivers is set, browser must be remote and attacker_type counter.")
+        sys.exit(1)
+
+    receiver_addresses = [x.rsplit(":", 1) for x in opts.receivers.split(",")]
+    receiver_addresses = [(ip, int(port)) for ip, port in receiver_addresses]
+
+    if opts.workers != 1 and opts.workers != len(receiver_addresses):
+        print("If receivers is set, workers must equal the number of receivers.")
+        sys.exit(1)
+
+    opts.workers = len(receiver_addresses)
+
+if (
+    opts.workers > 1
+    and opts.receivers is None
+    and (
+        opts.browser not in [Browser.CHROME, Browser.CHROME_HEADLESS, Browser.FIREFOX]
+        or opts.attacker_type not in ["javascript", "counter"]
+    )
+):
+    print(
+        "If workers > 1, browser must be chrome, chrome_headless or firefox and attacker_type must be javascript or counter."
+    )
+    sys.exit(1)
+
+if opts.prewarm_browsers and opts.browser not in [
+    Browser.CHROME,
+    Browser.CHROME_HEADLESS,
+    Browser.FIREFOX,
+]:
+    print(
+        "You can't set prewarm_browsers to true unless browser is chrome, chrome_headless or firefox."
+    )
+    sys.exit(1)
+
+if opts.worker_cores is not None and len(opts.worker_cores.split(";")) != opts.workers:
+    print("worker_cores must list one set of cores per worker.")
+    sys.exit(1)
+
 if opts.enable_timer_jitter and opts.timer_resolution is None:
     print("If enable_timer_jitter is true, timer_resolution must be set.")
     sys.exit(1)
 
-if opts.timer_resolution is not None and not os.path.exists(
-    os.path.join("lib", "libtimer.so")
-):
+if opts.counter_sampler == "raw" and opts.timer_resolution is not None:
+    print(
+        "counter_sampler raw records the unclamped timer, so timer_resolution can't be set."
+    )
+    sys.exit(1)
+
+if opts.counter_core is not None and opts.counter_sampler != "process":
+    print("You can't set counter_core unless counter_sampler is process.")
+    sys.exit(1)
+
+if opts.noise_interval_ms > 0 and opts.workers > 1:
+    print(
+        "The noise sampler's counters are system-wide, so they can't be told apart between workers."
+    )
+    sys.exit(1)
+
+if opts.isolation != "none" and (opts.workers > 1 or opts.counter_core is not None):
+    print(
+        "isolation pins processes itself, so it can't be used with workers or counter_core."
+    )
+    sys.exit(1)
+
+if (
+    opts.timer_resolution is not None or opts.counter_sampler != "python"
+) and not os.path.exists(os.path.join("lib", "libtimer.so")):
     print("libtimer.so needs to be compiled. Run:")
     print("cc -fPIC -shared -o lib/libtimer.so lib/timer.c")
     sys.exit(1)
@@ -235,13 +583,44 @@ def confirm(prompt):
         sys.exit(1)
 
 
+# Raw traces are read counts per bin rather than per millisecond
+if opts.counter_sampler == "raw":
+    trace_width = int(round(opts.trace_length * 1e6 / opts.raw_bin_us))
+else:
+    trace_width = opts.trace_length * 1000
+
 remote_driver = None
+receiver_address = (opts.receiver_ip, opts.receiver_port)
+attacker_port = 1234
+
+counter_sampler_process = None
+ebpf_client = None
+
+if opts.timer_resolution is not None or opts.counter_sampler != "python":
+    c_lib = load_timer_lib(opts.timer_resolution, opts.enable_timer_jitter)
+
+
+def get_counter_sampler_process():
+    global counter_sampler_process
+
+    # Started lazily so that each worker gets its own. With workers, the
+    # process inherits the worker's core affinity.
+    if counter_sampler_process is None:
+        cores = None
 
-if opts.timer_resolution is not None:
-    c_lib = ctypes.CDLL(os.path.join(os.getcwd(), "lib", "libtimer.so"))
-    c_lib.configure_timer.argtypes = [ctypes.c_double, ctypes.c_bool]
-    c_lib.configure_timer(opts.timer_resolution, opts.enable_timer_jitter)
-    c_lib.timer.restype = ctypes.c_double
+        if isolation is not None:
+            cores = isolation.cores["attacker"]
+        elif opts.counter_core is not None:
+            cores = [opts.counter_core]
+
+        counter_sampler_process = CounterSamplerProcess(
+            opts.trace_length * 1000,
+            cores=cores,
+            timer_resolution=opts.timer_resolution,
+            enable_timer_jitter=opts.enable_timer_jitter,
+        )
+
+    return counter_sampler_process
 
 
 def get_attacker_url():
@@ -251,7 +630,7 @@ def get_attacker_url():
 
         return opts.tor_onion_address
     else:
-        return "http://localhost:1234"
+        return f"http://localhost:{attacker_port}"
 
 
 def get_driver(browser):
@@ -261,7 +640,7 @@ def get_driver(browser):
         return LinksDriver()
     elif browser == Browser.REMOTE:
         if remote_driver is None:
-            remote_driver = RemoteDriver(opts.receiver_ip, opts.receiver_port)
+            remote_driver = RemoteDriver(*receiver_address)
 
         return remote_driver
     if browser == Browser.SAFARI:
@@ -366,6 +745,144 @@ elif opts.overwrite:
 if not os.path.exists(opts.out_directory):
     os.mkdir(opts.out_directory)
 
+metrics = PhaseMetrics(
+    opts.trace_length,
+    path=opts.metrics_file or os.path.join(opts.out_directory, "metrics.jsonl"),
+    prometheus_path=opts.prometheus_file,
+)
+
+isolation = None
+
+if opts.isolation != "none":
+    available = sorted(psutil.Process().cpu_affinity())
+    attacker_cores = (
+        available[-1:]
+        if opts.attacker_cores is None
+        else parse_cores(opts.attacker_cores)
+    )
+    victim_cores = (
+        [x for x in available if x not in attacker_cores]
+        if opts.victim_cores is None
+        else parse_cores(opts.victim_cores)
+    )
+
+    if len(victim_cores) == 0 or set(attacker_cores) & set(victim_cores):
+        print("isolation needs the attacker and victim on separate cores.")
+        sys.exit(1)
+
+    if opts.attacker_type == "ebpf" and len(attacker_cores) != 1:
+        print(
+            "With attacker_type ebpf, the eBPF tool records the interrupts on one core, so attacker_cores must be a single core."
+        )
+        sys.exit(1)
+
+    isolation = IsolationProfile(
+        attacker_cores,
+        victim_cores,
+        steer_irqs=opts.isolation == "isolate_interrupts",
+        path=os.path.join(opts.out_directory, ISOLATION_FILENAME),
+    )
+
+    # Restore IRQ affinities however we exit. A SIGKILL leaves them in the
+    # output directory, to be restored by the next run.
+    atexit.register(isolation.restore)
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(1))
+    isolation.apply()
+
+    if isolation.steer_irqs and any(
+        x.info["name"] == "irqbalance" for x in psutil.process_iter(["name"])
+    ):
+        print("WARNING: irqbalance is running and may move IRQs back.")
+
+    # The Python and native counter loops run in this process. Otherwise, it
+    # only drives the browsers.
+    if opts.attacker_type == "counter" and opts.counter_sampler != "process":
+        isolation.pin_self("attacker")
+    else:
+        isolation.pin_self("victim")
+
+if opts.attacker_type == "ebpf":
+    # Attach the eBPF probes once up front, rather than for every trace. The
+    # daemon runs as root and ignores Ctrl+C, so make sure it's stopped however
+    # we exit. It's the attacker, so it records the interrupts on the core
+    # isolation keeps for the attacker.
+    ebpf_client = EbpfClient(
+        DEFAULT_EBPF_CORE if isolation is None else isolation.cores["attacker"][0]
+    )
+    atexit.register(ebpf_client.quit)
+
+    if isolation is not None:
+        isolation.pin("attacker", ebpf_client.process.pid)
+
+if isolation is not None:
+    print(isolation.summary())
+
+noise_sampler = None
+noise_log = None
+last_noise = None
+
+if opts.noise_interval_ms > 0:
+    # Kept off the attacker's cores with isolation
+    noise_sampler = NoiseSamplerProcess(
+        opts.noise_interval_ms,
+        cores=None if isolation is None else isolation.cores["victim"],
+    )
+    noise_log = NoiseLog(os.path.join(opts.out_directory, NOISE_FILENAME))
+
+
+def save_noise(domain, index):
+    if noise_log is not None and last_noise is not None:
+        noise_log.add(domain, index, last_noise)
+
+
+def pin_browser(role, browser):
+    # Remote browsers run on another machine, Links has no driver process
+    pid = browser_pid(browser)
+
+    if isolation is not None and pid is not None:
+        isolation.pin(role, pid)
+
+
+# Raw read counts are mostly small, repeated numbers, and eBPF traces aren't
+# sampled at all, so only counter and javascript traces can be checked
+quality_gate = (
+    not opts.skip_quality_gate
+    and opts.attacker_type in ["counter", "javascript"]
+    and opts.counter_sampler != "raw"
+)
+quality_report = QualityReport(os.path.join(opts.out_directory, "rejections.jsonl"))
+
+
+def log_record(record):
+    metrics.log(record)
+    quality_report.log(record)
+
+
+def check_quality(trace):
+    """Return (stats, reasons) for a trace from record_trace(), as check_trace does."""
+    if not quality_gate:
+        return None, []
+
+    min_coverage = opts.min_coverage
+    max_run = 100
+
+    if opts.timer_resolution is not None:
+        # A clamped timer only sets a sample once per tick, leaving a gap of
+        # about a tick (up to two with jitter) between set samples
+        tick_ms = opts.timer_resolution * 1000
+        min_coverage *= min(1, 5 / tick_ms)
+        max_run = max(max_run, 2 * tick_ms)
+
+    return check_trace(
+        trace[0],
+        opts.trace_length * 1000,
+        min_coverage=min_coverage,
+        max_fill=opts.max_fill,
+        max_run=max_run,
+        min_cv=opts.min_trace_cv,
+    )
+
+
 # Optionally set up SMS notifications
 using_twilio = False
 
@@ -405,12 +922,25 @@ if opts.attacker_type == "javascript":
     def static_dir(path):
         return send_from_directory("attacker", path)
 
-    flask_thread = threading.Thread(target=app.run, kwargs={"port": 1234})
+    # Raw traces POSTed by the attacker page, as (trace id, bytes) tuples
+    pushed_traces = queue.Queue()
+
+    @app.route("/trace", methods=["POST"])
+    def receive_trace():
+        pushed_traces.put((request.args.get("id"), request.get_data()))
+        return "", 204
+
+
+def start_attacker():
+    global attacker_browser
+
+    flask_thread = threading.Thread(target=app.run, kwargs={"port": attacker_port})
     flask_thread.setDaemon(True)
     flask_thread.start()
 
     if opts.browser != Browser.SAFARI:
         attacker_browser = get_driver(opts.browser)
+        pin_browser("attacker", attacker_browser)
         attacker_browser.get(get_attacker_url())
 
         attacker_browser.execute_script(
@@ -419,12 +949,31 @@ if opts.attacker_type == "javascript":
         attacker_browser.execute_script("window.using_automation_script = true")
 
 
-def create_browser():
+if opts.attacker_type == "javascript" and opts.workers == 1:
+    # With multiple workers, each one starts its own attacker on its own port
+    start_attacker()
+
+
+def launch_browser():
     browser = get_driver(opts.browser)
+    pin_browser("victim", browser)
     browser.set_page_load_timeout(opts.trace_length)
     return browser
 
 
+# Open world traces are all saved, so there's no throwaway run to hide a
+# browser launch behind.
+browser_pool = BrowserPool(
+    launch_browser,
+    prewarm=opts.prewarm_browsers and opts.sites_list != "open_world",
+)
+
+
+def create_browser():
+    with metrics.phase("launch_browser"):
+        return browser_pool.get()
+
+
 def get_time():
     if opts.timer_resolution is None:
         return time.time()
@@ -432,11 +981,39 @@ def get_time():
         return c_lib.timer()
 
 
+def wait_for_pushed_trace(trace_id):
+    deadline = time.time() + opts.trace_length + 10
+
+    while True:
+        timeout = deadline - time.time()
+
+        if timeout <= 0:
+            return None
+
+        try:
+            pushed_id, body = pushed_traces.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        # Ignore anything left over from an earlier trace that timed out
+        if pushed_id == trace_id:
+            return np.frombuffer(body, dtype="<i4").tolist()
+
+
 def collect_data(q):
     data = [-1] * (opts.trace_length * 1000)
     trace_time = get_time() * 1000
 
-    if opts.attacker_type == "counter":
+    if opts.attacker_type == "counter" and opts.counter_sampler == "native":
+        data = sample_counter(
+            c_lib, len(data), clamp=opts.timer_resolution is not None
+        ).tolist()
+    elif opts.attacker_type == "counter" and opts.counter_sampler == "process":
+        data = get_counter_sampler_process().record().tolist()
+    elif opts.attacker_type == "counter" and opts.counter_sampler == "raw":
+        # Kept as an array, since there are 100 bins per ms by default
+        data = record_read_counts(c_lib, opts.trace_length * 1000, opts.raw_bin_us)
+    elif opts.attacker_type == "counter":
         while True:
             datum_time = get_time() * 1000
             idx = math.floor(datum_time - trace_time)
@@ -451,6 +1028,26 @@ def collect_data(q):
 
             data[idx] = num
     elif opts.attacker_type == "javascript":
+        if opts.trace_delivery == "push":
+            trace_id = f"{os.getpid()}-{time.time()}"
+
+            try:
+                attacker_browser.execute_script(
+                    f'window.collectTrace("{opts.javascript_attacker_type}", "{trace_id}")'
+                )
+            except InvalidSessionIdException:
+                q.put([-1])
+                return
+
+            # The wait covers the whole trace, which is already timed as
+            # "sleep", so only count the time after the trace ends
+            window_end = time.perf_counter() + opts.trace_length
+            data = wait_for_pushed_trace(trace_id)
+            metrics.add("retrieve_trace", max(0, time.perf_counter() - window_end))
+
+            q.put([-1] if data is None else data)
+            return
+
         try:
             attacker_browser.execute_script(
                 f'window.collectTrace("{opts.javascript_attacker_type}")'
@@ -462,6 +1059,7 @@ def collect_data(q):
         time.sleep(opts.trace_length)
 
         data = []
+        retrieve_start = time.perf_counter()
 
         while len(data) == 0:
             try:
@@ -473,44 +1071,47 @@ def collect_data(q):
                 print(e)
                 q.put([-1])
                 return
+
+        metrics.add("retrieve_trace", time.perf_counter() - retrieve_start)
     elif opts.attacker_type == "ebpf":
-        child = subprocess.run(
-            [
-                "sudo",
-                "ebpf/target/release/ebpf",
-                f"--timeout={opts.trace_length * 1000}",
-                f"--ns-threshold={opts.ebpf_ns_threshold}",
-            ],
-            capture_output=True,
+        binary = opts.ebpf_format == "binary"
+        output = ebpf_client.record(
+            opts.trace_length * 1000, opts.ebpf_ns_threshold, binary=binary
         )
-        data = []
 
-        lines = child.stdout.splitlines()
-        data.append((-1, lines[0]))
+        if output is None:
+            q.put([-1])
+            return
 
-        for line in lines[1:]:
-            x = line.split()
-            kind = x[0]
-            x = list(map(lambda v: int(v), x[1:]))
-            y = []
+        data = read_ebpf_binary(output) if binary else parse_ebpf_output(output)
 
-            for n in range(len(x) // 2):
-                y.append((x[n * 2], x[n * 2 + 1]))
+    q.put(data)
 
-            data.append((kind, y))
 
-    q.put(data)
+def get_victim_url(url):
+    if mirror_archive is None:
+        return url
+
+    return f"http://{opts.mirror_host}:{opts.mirror_port}{mirror_archive.sites[url]}"
 
 
 def record_trace(url):
+    global last_noise
+
     q = queue.Queue()
     thread = threading.Thread(target=collect_data, name="record", args=[q])
+    last_noise = None
+
+    if noise_sampler is not None:
+        noise_sampler.start()
+
     thread.start()
 
     start_time = time.time()
 
     try:
-        browser.get(url)
+        with metrics.phase("navigate"):
+            browser.get(get_victim_url(url))
     except TimeoutException:
         # Called when Selenium stops loading after the length of the trace
         pass
@@ -524,10 +1125,15 @@ def record_trace(url):
     sleep_time = opts.trace_length - (time.time() - start_time)
 
     if sleep_time > 0:
-        time.sleep(sleep_time)
+        with metrics.phase("sleep"):
+            time.sleep(sleep_time)
 
-    thread.join()
-    results = [q.get()]
+    with metrics.phase("wait_for_trace"):
+        thread.join()
+        results = [q.get()]
+
+    if noise_sampler is not None:
+        last_noise = noise_sampler.stop()
 
     if len(results[0]) == 1 and results[0][0] == -1:
         return None
@@ -569,40 +1175,84 @@ else:
     domains = [f"https://{x}" if "http://" not in x else x for x in domains]
     using_custom_site = True
 
+mirror_archive = None
 
-def should_skip(domain):
-    out_f_path = os.path.join(
-        opts.out_directory,
-        f"{domain.replace('https://', '').replace('http://', '').replace('www.', '').replace(':', '_').replace('/', '_')}.pkl",
-    )
+if opts.mirror is not None:
+    mirror_archive = MirrorArchive(opts.mirror)
+    missing = [x for x in domains if x not in mirror_archive.sites]
 
-    if os.path.exists(out_f_path):
-        f = open(out_f_path, "rb")
-        num_runs = 0
+    if len(missing) > 0:
+        print(f"{len(missing)} sites aren't in {opts.mirror}, e.g. {missing[0]}.")
+        print("Capture them first with scripts/capture_sites.py.")
+        sys.exit(1)
 
-        while True:
-            try:
-                pickle.load(f)
-                num_runs += 1
-            except:
-                break
+    # Served from the main process, so that workers all load the same mirror
+    serve_mirror(mirror_archive, opts.mirror_port)
 
-        if num_runs == opts.num_runs:
-            return True
+trace_store = None
+manifest = None
 
-    return False
+if opts.storage == "columnar":
+    trace_store = ColumnarTraceStore(opts.out_directory, width=trace_width)
+    stored_counts = trace_store.counts()
+else:
+    manifest = Manifest(opts.out_directory)
 
+    if opts.repair_manifest or not os.path.exists(manifest.path):
+        repaired = manifest.repair(verify=opts.repair_manifest)
 
-def run(domain, update_fn=None):
-    out_f_path = os.path.join(
-        opts.out_directory,
-        f"{domain.replace('https://', '').replace('http://', '').replace('www.', '').replace(':', '_').replace('/', '_')}.pkl",
-    )
-    out_f = open(out_f_path, "wb")
-    i = 0
+        if len(repaired) > 0:
+            print(f"Rebuilt manifest entries for {len(repaired)} files.")
+
+
+def get_out_filename(domain):
+    return f"{domain.replace('https://', '').replace('http://', '').replace('www.', '').replace(':', '_').replace('/', '_')}.pkl"
+
+
+def get_num_stored_runs(domain):
+    if trace_store is not None:
+        return stored_counts.get(domain, 0)
+
+    return manifest.runs(get_out_filename(domain))
+
+
+def encode_traces(traces):
+    if opts.trace_codec == "none":
+        return traces
+
+    return [encode_trace(x, opts.trace_codec) for x in traces]
+
+
+def should_skip(domain):
+    return get_num_stored_runs(domain) >= opts.num_runs
+
+
+def run(domain, update_fn=None, num_runs=None, on_trace=None, warmed=False):
+    # Passing num_runs adds that many traces to what's already saved, rather
+    # than starting the domain over. warmed skips the cache-warming run, for a
+    # browser that has already loaded the site.
+    appending = num_runs is not None
+    num_runs = opts.num_runs if num_runs is None else num_runs
+
+    if trace_store is None:
+        out_filename = get_out_filename(domain)
+        out_f = open(
+            os.path.join(opts.out_directory, out_filename), "ab" if appending else "wb"
+        )
+
+        if not appending:
+            manifest.reset(out_filename, domain)
+    else:
+        # The columnar store is append-only, so hold on to this domain's traces
+        # and only commit them once all of its runs have been recorded.
+        staged_traces = []
+        expected_traces = 1 if opts.sites_list == "open_world" else num_runs
+
+    i = 1 if warmed else 0
+    rejections = 0
 
     # Add one so that we can have a first run where the site gets cached.
-    while i < opts.num_runs + 1:
+    while i < num_runs + 1:
         if not recording:
             break
 
@@ -610,40 +1260,533 @@ def run(domain, update_fn=None):
             pass
         else:
             try:
-                browser.get(opts.browser.get_new_tab_url())
+                with metrics.phase("new_tab"):
+                    browser.get(opts.browser.get_new_tab_url())
             except:
                 pass
 
+        if i == 0 and opts.sites_list != "open_world":
+            # The cache-warming run is thrown away, so it's a good time to
+            # start the next site's browser without disturbing any saved trace.
+            browser_pool.prepare_next()
+
         trace = record_trace(domain)
 
         if trace is None:
-            out_f.close()
+            log_record(metrics.finish_trace(domain, saved=False))
+
+            if trace_store is None:
+                out_f.close()
+
             return False
 
         if i > 0 or opts.sites_list == "open_world":
-            # Don't save first run -- site needs to be cached.
-            data = (trace, domain)
+            stats, reasons = check_quality(trace)
+
+            if len(reasons) > 0:
+                log_record(
+                    metrics.finish_trace(
+                        domain, saved=False, rejected=reasons, quality=stats
+                    )
+                )
+                rejections += 1
+
+                if rejections >= opts.max_rejections:
+                    print(f"Giving up on {domain} after {rejections} rejected traces")
 
-            # Save data to output file incrementally -- this allows us to save much
-            # more data than fits in RAM.
-            pickle.dump(data, out_f)
+                    if trace_store is None:
+                        out_f.close()
+
+                    return False
+
+                # Record this run again straight away
+                continue
+
+            rejections = 0
+
+            # Don't save first run -- site needs to be cached.
+            with metrics.phase("save"):
+                if trace_store is None:
+                    save_noise(domain, manifest.runs(out_filename))
+                    data = (encode_traces(trace), domain)
+
+                    # Save data to output file incrementally -- this allows us
+                    # to save much more data than fits in RAM.
+                    record = pickle.dumps(data)
+                    offset = out_f.tell()
+                    out_f.write(record)
+                    out_f.flush()
+                    manifest.add_record(
+                        out_filename, domain, offset, record, traces=data[0]
+                    )
+                else:
+                    save_noise(
+                        domain, stored_counts.get(domain, 0) + len(staged_traces)
+                    )
+                    staged_traces.extend(trace)
+
+            log_record(metrics.finish_trace(domain))
+
+            if on_trace is not None:
+                on_trace(trace[0])
 
             if update_fn is not None:
                 update_fn()
 
             if opts.sites_list == "open_world":
                 break
+        else:
+            log_record(metrics.finish_trace(domain, saved=False))
 
         i += 1
 
-    out_f.close()
+    if trace_store is None:
+        out_f.close()
+    elif len(staged_traces) == expected_traces:
+        trace_store.extend(staged_traces, domain)
+        stored_counts[domain] = stored_counts.get(domain, 0) + len(staged_traces)
+
     return True
 
 
+def get_worker_cores():
+    if opts.worker_cores is not None:
+        return [
+            [int(x) for x in cores.split(",")] for cores in opts.worker_cores.split(";")
+        ]
+
+    available = sorted(psutil.Process().cpu_affinity())
+    n = max(1, len(available) // opts.workers)
+    return [available[k * n : (k + 1) * n] or available for k in range(opts.workers)]
+
+
+def save_worker_trace(shard_directory, trace, domain):
+    if trace_store is not None:
+        trace_store.extend(trace, domain)
+    else:
+        with open(os.path.join(shard_directory, get_out_filename(domain)), "ab") as f:
+            pickle.dump((encode_traces(trace), domain), f)
+
+
+def run_worker(worker, cores, work_queue, progress_queue, saved_traces):
+    global attacker_port, browser, receiver_address, trace_store
+
+    # Pin before launching any browsers so that they inherit our affinity
+    psutil.Process().cpu_affinity(cores)
+    attacker_port = 1234 + worker
+
+    if opts.receivers is not None:
+        receiver_address = receiver_addresses[worker]
+
+        # Connect before taking any work, so that a receiver that's down
+        # doesn't hold on to an item
+        get_driver(Browser.REMOTE)
+
+    shard_directory = os.path.join(opts.out_directory, f"worker-{worker}")
+    os.makedirs(shard_directory, exist_ok=True)
+
+    if opts.storage == "columnar":
+        trace_store = ColumnarTraceStore(shard_directory, width=trace_width)
+
+    if opts.attacker_type == "javascript":
+        start_attacker()
+
+    current_domain = None
+
+    while recording:
+        if opts.sites_list == "open_world" and saved_traces.value >= 5000:
+            break
+
+        try:
+            domain, run_i, attempts = work_queue.get(timeout=1)
+        except queue.Empty:
+            break
+
+        try:
+            if domain != current_domain:
+                if browser is not None:
+                    browser.quit()
+
+                browser = create_browser()
+                current_domain = domain
+
+                if opts.sites_list != "open_world":
+                    # As in run(), record one trace first so that the site gets
+                    # cached, and throw it away.
+                    try:
+                        with metrics.phase("new_tab"):
+                            browser.get(opts.browser.get_new_tab_url())
+                    except:
+                        pass
+
+                    record_trace(domain)
+                    progress_queue.put(
+                        (worker, metrics.finish_trace(domain, saved=False))
+                    )
+
+            try:
+                with metrics.phase("new_tab"):
+                    browser.get(opts.browser.get_new_tab_url())
+            except:
+                pass
+
+            trace = record_trace(domain)
+        except ConnectionError:
+            # e.g. the receiver went away while we were switching sites
+            trace = None
+
+        if trace is None:
+            progress_queue.put((worker, metrics.finish_trace(domain, saved=False)))
+
+        if trace is None and remote_driver is not None and remote_driver.closed:
+            # Hand our work back to the workers whose receivers are still up
+            print(f"Lost receiver {remote_driver.address}, reassigning its work")
+            work_queue.put((domain, run_i, attempts))
+            browser = None
+            break
+        elif trace is None:
+            # Start over with a fresh browser and give the item another try
+            current_domain = None
+
+            if attempts < 2:
+                work_queue.put((domain, run_i, attempts + 1))
+            else:
+                print(f"Giving up on run {run_i} of {domain}")
+
+            continue
+
+        stats, reasons = check_quality(trace)
+
+        if len(reasons) > 0:
+            progress_queue.put(
+                (
+                    worker,
+                    metrics.finish_trace(
+                        domain, saved=False, rejected=reasons, quality=stats
+                    ),
+                )
+            )
+
+            if attempts < 2:
+                work_queue.put((domain, run_i, attempts + 1))
+            else:
+                print(f"Giving up on run {run_i} of {domain}")
+
+            continue
+
+        with metrics.phase("save"):
+            save_worker_trace(shard_directory, trace, domain)
+
+        with saved_traces.get_lock():
+            saved_traces.value += 1
+
+        progress_queue.put((worker, metrics.finish_trace(domain)))
+
+    if browser is not None:
+        browser.quit()
+
+    if opts.attacker_type == "javascript":
+        attacker_browser.quit()
+
+    if trace_store is not None:
+        trace_store.close()
+
+    if counter_sampler_process is not None:
+        counter_sampler_process.close()
+
+
+def run_parallel(update_fn=None):
+    ctx = multiprocessing.get_context("fork")
+    work_queue = ctx.Queue()
+    progress_queue = ctx.Queue()
+    saved_traces = ctx.Value("i", 0)
+
+    # Unlike run(), partially recorded domains pick up where they left off
+    for domain in domains:
+        for run_i in range(get_num_stored_runs(domain), opts.num_runs):
+            work_queue.put((domain, run_i, 0))
+
+    workers = [
+        ctx.Process(
+            target=run_worker,
+            args=(k, cores, work_queue, progress_queue, saved_traces),
+        )
+        for k, cores in enumerate(get_worker_cores())
+    ]
+
+    for worker in workers:
+        worker.start()
+
+    worker_traces = [0] * len(workers)
+
+    while any(worker.is_alive() for worker in workers) or not progress_queue.empty():
+        try:
+            k, record = progress_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+
+        # Workers send their timings here, so that only we write metrics
+        log_record(dict(record, worker=k))
+
+        if not record["saved"]:
+            continue
+
+        worker_traces[k] += 1
+
+        if update_fn is not None:
+            update_fn()
+
+    for worker in workers:
+        worker.join()
+
+    unfinished_items = 0
+
+    while True:
+        try:
+            work_queue.get(timeout=0.1)
+            unfinished_items += 1
+        except queue.Empty:
+            break
+
+    print()
+
+    for k, n in enumerate(worker_traces):
+        if opts.receivers is not None:
+            print(f"Worker {k} ({opts.receivers.split(',')[k]}): {n} traces")
+        else:
+            print(f"Worker {k}: {n} traces")
+
+    if unfinished_items > 0:
+        print(f"{unfinished_items} traces were left unrecorded.")
+
+    merge_shards(
+        [os.path.join(opts.out_directory, f"worker-{k}") for k in range(len(workers))],
+        opts.out_directory,
+        manifest,
+    )
+
+
+def save_trace(trace, domain):
+    save_noise(domain, get_num_stored_runs(domain))
+
+    if trace_store is not None:
+        trace_store.extend(trace, domain)
+        stored_counts[domain] = stored_counts.get(domain, 0) + len(trace)
+        return
+
+    out_filename = get_out_filename(domain)
+
+    with open(os.path.join(opts.out_directory, out_filename), "ab") as f:
+        traces = encode_traces(trace)
+        record = pickle.dumps((traces, domain))
+        offset = f.tell()
+        f.write(record)
+        f.flush()
+        manifest.add_record(out_filename, domain, offset, record, traces=traces)
+
+
+def run_scheduled(update_fn=None):
+    global browser
+
+    scheduler = TraceScheduler(
+        os.path.join(opts.out_directory, SCHEDULE_FILENAME),
+        domains,
+        opts.num_runs,
+        stored_runs={x: get_num_stored_runs(x) for x in domains},
+        order=opts.order,
+        max_attempts=opts.max_attempts,
+        backoff=opts.retry_backoff,
+    )
+
+    if scheduler.resumed:
+        print(f"Resuming from {scheduler.path}, {len(scheduler.pending)} runs to go.")
+
+    # One browser is kept for the whole job, since every item is usually a
+    # different site from the last. Sites it has already cached don't need
+    # another cache-warming run.
+    warmed_domains = set()
+
+    while recording:
+        item, wait = scheduler.next()
+
+        if item is None and wait == 0:
+            break
+        elif item is None:
+            # Everything left is backing off
+            time.sleep(min(wait, 1))
+            continue
+
+        domain = item["domain"]
+
+        if browser is None:
+            browser = create_browser()
+            warmed_domains = set()
+
+        if domain not in warmed_domains:
+            # As in run(), record one trace first so that the site gets
+            # cached, and throw it away
+            try:
+                with metrics.phase("new_tab"):
+                    browser.get(opts.browser.get_new_tab_url())
+            except:
+                pass
+
+            record_trace(domain)
+            log_record(metrics.finish_trace(domain, saved=False))
+            warmed_domains.add(domain)
+
+        try:
+            with metrics.phase("new_tab"):
+                browser.get(opts.browser.get_new_tab_url())
+        except:
+            pass
+
+        trace = record_trace(domain)
+
+        if trace is None:
+            log_record(metrics.finish_trace(domain, saved=False))
+
+            if recording:
+                scheduler.fail(item, f"run {item['run']} recorded no trace")
+
+                # Retry with a fresh browser
+                if browser is not None:
+                    browser_pool.retire(browser)
+
+                browser = None
+
+                if domain in scheduler.dead_letters:
+                    print(f"Giving up on {domain} after {opts.max_attempts} failures")
+
+            continue
+
+        stats, reasons = check_quality(trace)
+
+        if len(reasons) > 0:
+            log_record(
+                metrics.finish_trace(
+                    domain, saved=False, rejected=reasons, quality=stats
+                )
+            )
+            scheduler.fail(item, f"run {item['run']} rejected: {', '.join(reasons)}")
+
+            if domain in scheduler.dead_letters:
+                print(f"Giving up on {domain} after {opts.max_attempts} failures")
+
+            continue
+
+        with metrics.phase("save"):
+            save_trace(trace, domain)
+
+        log_record(metrics.finish_trace(domain))
+        scheduler.succeed(item)
+
+        if update_fn is not None:
+            update_fn()
+
+    if browser is not None:
+        browser_pool.retire(browser)
+        browser = None
+
+    scheduler.close()
+    print()
+    print(scheduler.summary())
+
+
+def run_adaptive(update_fn=None):
+    global browser
+
+    scheduler = AdaptiveScheduler(
+        domains,
+        opts.min_runs,
+        opts.max_runs,
+        opts.num_runs * len(domains),
+        round_size=opts.adaptive_round_size,
+        target=opts.adaptive_target,
+        max_attempts=opts.max_attempts,
+    )
+
+    # Traces from an earlier job count towards each site's runs, and the
+    # classifier learns from them before the first round
+    if trace_store is not None and sum(stored_counts.values()) > 0:
+        trace_store.close()
+        X, y, stored_domains = load_columnar(opts.out_directory)
+    elif trace_store is None and len(manifest.files) > 0:
+        X, y, stored_domains, _ = load_pickles(opts.out_directory, width=trace_width)
+    else:
+        X, y, stored_domains = [], [], []
+
+    for i, domain in enumerate(stored_domains):
+        if domain in scheduler.index:
+            scheduler.add_traces(domain, X[y == i])
+
+    scheduler.end_round()
+
+    # As in run_scheduled(), one browser is kept across rounds, so each site
+    # only needs a cache-warming run the first time it's loaded
+    warmed_domains = set()
+
+    while recording:
+        plan = scheduler.next_round()
+
+        if len(plan) == 0:
+            break
+
+        for domain, n in plan.items():
+            if not recording:
+                break
+
+            if browser is None:
+                browser = create_browser()
+                warmed_domains = set()
+
+            traces = []
+            success = run(
+                domain,
+                update_fn=update_fn,
+                num_runs=n,
+                on_trace=traces.append,
+                warmed=domain in warmed_domains,
+            )
+
+            if success:
+                warmed_domains.add(domain)
+            else:
+                # Start over with a fresh browser
+                browser_pool.retire(browser)
+                browser = None
+
+                if trace_store is not None:
+                    # The columnar store only keeps complete sets of runs
+                    traces = []
+
+            scheduler.add_traces(domain, traces)
+
+            if not success and recording and scheduler.fail(domain):
+                print(f"Giving up on {domain} after {opts.max_attempts} failures")
+
+        scheduler.end_round()
+
+    if browser is not None:
+        browser_pool.retire(browser)
+        browser = None
+
+    print()
+    print(scheduler.summary(opts.num_runs))
+
+
 browser = None
 total_traces = opts.num_runs * len(domains)
 
-with tqdm(total=total_traces) as pbar:
+# Count runs for domains that are already done, so that the progress bar
+# starts where the last job left off
+skipped_domains = set(x for x in domains if should_skip(x))
+completed_traces = opts.num_runs * len(skipped_domains)
+
+if opts.adaptive or opts.order != "domain":
+    completed_traces = min(total_traces, sum(get_num_stored_runs(x) for x in domains))
+
+with tqdm(total=total_traces, initial=completed_traces) as pbar:
     if using_twilio:
         notify_interval = opts.twilio_interval * total_traces
         last_notification = 0
@@ -662,41 +1805,77 @@ with tqdm(total=total_traces) as pbar:
             )
             last_notification = traces_collected
 
-    for i, domain in enumerate(domains):
-        if not recording:
-            break
-        elif should_skip(domain):
-            continue
+    if opts.adaptive:
+        run_adaptive(update_fn=post_trace_collection)
+    elif opts.order != "domain":
+        run_scheduled(update_fn=post_trace_collection)
+    elif opts.workers > 1:
+        run_parallel(update_fn=post_trace_collection)
+    else:
+        for i, domain in enumerate(domains):
+            if not recording:
+                break
+            elif domain in skipped_domains:
+                continue
+
+            if (
+                opts.browser == Browser.SAFARI
+                and opts.attacker_type == "javascript"
+                and browser is not None
+            ):
+                # Don't create a new browser in this case -- we will open a new
+                # window instead due to limitations in safaridriver.
+                pass
+            else:
+                browser = create_browser()
 
-        if (
-            opts.browser == Browser.SAFARI
-            and opts.attacker_type == "javascript"
-            and browser is not None
-        ):
-            # Don't create a new browser in this case -- we will open a new
-            # window instead due to limitations in safaridriver.
-            pass
-        else:
-            browser = create_browser()
+                if opts.browser == Browser.SAFARI:
+                    attacker_browser = browser
 
-            if opts.browser == Browser.SAFARI:
-                attacker_browser = browser
+            success = run(domain, update_fn=post_trace_collection)
 
-        success = run(domain, update_fn=post_trace_collection)
+            if success:
+                if opts.sites_list == "open_world" and traces_collected == 5000:
+                    break
 
-        if success:
-            if opts.sites_list == "open_world" and traces_collected == 5000:
-                break
+                pbar.n = (i + 1) * opts.num_runs
+                pbar.refresh()
 
-            pbar.n = (i + 1) * opts.num_runs
-            pbar.refresh()
+            browser_pool.retire(browser)
 
-        browser.quit()
+browser_pool.close()
+print(browser_pool.summary())
 
-if opts.attacker_type == "javascript":
+metrics.close()
+print(metrics.summary())
+
+if quality_gate:
+    quality_report.close()
+    print(quality_report.summary())
+
+if noise_sampler is not None:
+    noise_sampler.close()
+    noise_log.close()
+
+if isolation is not None:
+    isolation.restore()
+
+if trace_store is not None:
+    trace_store.close()
+
+if manifest is not None:
+    manifest.close()
+
+if counter_sampler_process is not None:
+    counter_sampler_process.close()
+
+if ebpf_client is not None:
+    ebpf_client.quit()
+
+if opts.attacker_type == "javascript" and opts.workers == 1:
     attacker_browser.quit()
 
-if opts.sites_list == "open_world":
+if opts.sites_list == "open_world" and browser is not None:
     browser.quit()
 
 if opts.browser == Browser.SAFARI:
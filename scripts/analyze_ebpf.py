@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analysis import sweep
+from storage.columnar import iter_pickle_traces
+
+parser = argparse.ArgumentParser(
+    description="Attribute timing gaps to interrupts in traces recorded with --attacker_type ebpf --ebpf_format binary."
+)
+parser.add_argument("--data_file", default="data", type=str)
+parser.add_argument(
+    "--windows",
+    default="150",
+    type=str,
+    help="Comma-separated attribution windows to try, in ns.",
+)
+parser.add_argument(
+    "--thresholds",
+    default="500",
+    type=str,
+    help="Comma-separated minimum gap lengths to try, in ns. Values below the --ebpf_ns_threshold used for recording have no effect.",
+)
+parser.add_argument(
+    "--out_file", default=None, type=str, help="Optional path to write results as JSON."
+)
+opts = parser.parse_args()
+
+if os.path.isdir(opts.data_file):
+    filepaths = sorted(
+        os.path.join(opts.data_file, x)
+        for x in os.listdir(opts.data_file)
+        if x.endswith(".pkl")
+    )
+else:
+    filepaths = [opts.data_file]
+
+traces = [
+    trace
+    for filepath in filepaths
+    for trace, _ in iter_pickle_traces(filepath)
+    if isinstance(trace, dict)
+]
+
+if len(traces) == 0:
+    print("No binary eBPF traces found. Record with --ebpf_format binary.")
+    sys.exit(1)
+
+windows = [int(x) for x in opts.windows.split(",")]
+thresholds = [int(x) for x in opts.thresholds.split(",")]
+results = sweep(traces, windows, thresholds)
+
+print(f"Number of traces: {len(traces)}")
+
+for result in results:
+    print()
+    print(
+        f"window {result['window']} ns, threshold {result['threshold']} ns: "
+        f"{result['explained'] * 100:.1f}% of {result['gaps']} gaps explained"
+    )
+
+    for kind, fraction in result["by_kind"].items():
+        print(f"  {kind:<24} {fraction * 100:.1f}%")
+
+if opts.out_file is not None:
+    with open(opts.out_file, "w") as f:
+        json.dump(results, f, indent=4)
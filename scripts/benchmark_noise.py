@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import sys
+
+import psutil
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import benchmark_noise_sampler, parse_cores
+
+parser = argparse.ArgumentParser(
+    description="Measure the overhead of the system-noise sampler record_data.py runs with --noise_interval_ms."
+)
+parser.add_argument(
+    "--intervals",
+    default="10,20,50",
+    type=str,
+    help="Comma-separated sampling intervals to benchmark, in ms.",
+)
+parser.add_argument(
+    "--windows",
+    default=400,
+    type=int,
+    help="Number of counter loop windows to record at each interval.",
+)
+parser.add_argument(
+    "--attacker_cores",
+    default=None,
+    type=str,
+    help="Cores to run the counter loop on. The sampler runs on the others. Defaults to not pinning either.",
+)
+parser.add_argument(
+    "--out_file",
+    default=None,
+    type=str,
+    help="Where to write the results as JSON. Defaults to noise_benchmark-<hostname>-<kernel>.json.",
+)
+opts = parser.parse_args()
+
+cores = None
+
+if opts.attacker_cores is not None:
+    attacker_cores = parse_cores(opts.attacker_cores)
+    cores = [x for x in range(psutil.cpu_count()) if x not in attacker_cores]
+    psutil.Process().cpu_affinity(attacker_cores)
+
+results = benchmark_noise_sampler(
+    intervals=[float(x) for x in opts.intervals.split(",")],
+    n_windows=opts.windows,
+    cores=cores,
+)
+
+machine = results["machine"]
+print(f"{machine['cpu_model']}, {machine['kernel']}, {machine['cpu_count']} cores")
+print(f"Sources: {', '.join(results['sources'])}")
+print(
+    f"One sample takes {results['read_latency_us']['p50']:.1f} us to read "
+    f"(p99 {results['read_latency_us']['p99']:.1f} us)"
+)
+print(
+    f"Counts per 5 ms window without the sampler: {results['baseline_counts']['p50']:.0f}"
+)
+print()
+print(
+    f"{'interval (ms)':<15}{'samples':>9}{'columns':>9}{'cpu':>8}"
+    f"{'parse (ms)':>12}{'counts':>9}{'change':>9}"
+)
+
+for result in results["intervals"]:
+    print(
+        f"{result['interval_ms']:<15g}{result['samples']:>9}{result['columns']:>9}"
+        f"{result['cpu_percent']:>7.2f}%{result['parse_ms']:>12.1f}"
+        f"{result['python_counts']['p50']:>9.0f}{result['counts_change'] * 100:>+8.1f}%"
+    )
+
+out_file = (
+    opts.out_file or f"noise_benchmark-{machine['hostname']}-{machine['kernel']}.json"
+)
+
+with open(out_file, "w") as f:
+    json.dump(results, f, indent=4)
+
+print()
+print(f"Wrote results to {out_file}")
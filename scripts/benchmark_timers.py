@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib.benchmark import benchmark_timers, compare_benchmarks
+from tqdm import tqdm
+
+parser = argparse.ArgumentParser(
+    description="Measure the latency, tick size and counts per window of the timers used by the counter attack."
+)
+parser.add_argument(
+    "--resolutions",
+    default="0.0001,0.001",
+    type=str,
+    help="Comma-separated resolutions to benchmark the clamped timer at, in seconds.",
+)
+parser.add_argument(
+    "--calls", default=100000, type=int, help="Timer calls per measurement."
+)
+parser.add_argument(
+    "--windows",
+    default=200,
+    type=int,
+    help="Number of counter loop windows to record for each timer.",
+)
+parser.add_argument("--period_ms", default=5, type=float)
+parser.add_argument(
+    "--skip_native",
+    default=False,
+    type=bool,
+    help="True if we don't want to run the native counter loop.",
+)
+parser.add_argument(
+    "--out_file",
+    default=None,
+    type=str,
+    help="Where to write the results as JSON. Defaults to timer_benchmark-<hostname>-<kernel>.json.",
+)
+parser.add_argument(
+    "--compare",
+    default=None,
+    type=str,
+    help="A previous results file to check for regressions against.",
+)
+parser.add_argument(
+    "--threshold",
+    default=0.1,
+    type=float,
+    help="Relative change in a median that counts as a regression.",
+)
+opts = parser.parse_args()
+
+results = benchmark_timers(
+    resolutions=[float(x) for x in opts.resolutions.split(",")],
+    calls=opts.calls,
+    n_windows=opts.windows,
+    period_ms=opts.period_ms,
+    native=not opts.skip_native,
+    progress=tqdm,
+)
+
+machine = results["machine"]
+print()
+print(
+    f"{machine['cpu_model']}, {machine['kernel']}, clocksource {machine['clocksource']}"
+)
+print()
+print(
+    f"{'timer':<24}{'latency p50 (ns)':>18}{'p99 (ns)':>10}{'tick p50 (us)':>15}"
+    f"{'python counts':>15}{'native counts':>15}"
+)
+
+for timer in results["timers"]:
+    name = timer["name"]
+
+    if timer["resolution"] is not None:
+        name += f" {timer['resolution']:g}{' jitter' if timer['jitter'] else ''}"
+
+    native_counts = (timer.get("native_counts") or {}).get("p50")
+
+    print(
+        f"{name:<24}{timer['latency_ns']['p50']:>18.1f}{timer['latency_ns']['p99']:>10.1f}"
+        f"{timer['tick_us']['p50'] if timer['tick_us'] else float('nan'):>15.3f}"
+        f"{timer['python_counts']['p50']:>15.0f}"
+        f"{native_counts if native_counts is not None else float('nan'):>15.0f}"
+    )
+
+out_file = (
+    opts.out_file or f"timer_benchmark-{machine['hostname']}-{machine['kernel']}.json"
+)
+
+with open(out_file, "w") as f:
+    json.dump(results, f, indent=4)
+
+print()
+print(f"Wrote results to {out_file}")
+
+if opts.compare is not None:
+    with open(opts.compare) as f:
+        old_results = json.load(f)
+
+    regressions = compare_benchmarks(old_results, results, opts.threshold)
+
+    print()
+
+    if len(regressions) == 0:
+        print(f"No regressions against {opts.compare}")
+
+    for regression in regressions:
+        name, resolution, jitter = regression["timer"]
+        if resolution is not None:
+            name += f" {resolution:g}{' jitter' if jitter else ''}"
+
+        print(
+            f"{name}: {regression['metric']} "
+            f"went from {regression['before']:.3f} to {regression['after']:.3f} "
+            f"({regression['change'] * 100:+.0f}%)"
+        )
+
+    if len(regressions) > 0:
+        sys.exit(1)
@@ -0,0 +1,95 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import MirrorArchive, capture_site
+
+parser = argparse.ArgumentParser(
+    description="Save sites and the resources they load, so that record_data.py can load them from a local mirror with --mirror."
+)
+parser.add_argument(
+    "--sites_list",
+    type=str,
+    default="alexa100",
+    help="The list of sites to capture, as with record_data.py.",
+)
+parser.add_argument("--out_directory", type=str, default="mirror")
+parser.add_argument(
+    "--threads",
+    type=int,
+    default=16,
+    help="Number of resources of a site to fetch at once.",
+)
+parser.add_argument(
+    "--max_resources",
+    type=int,
+    default=500,
+    help="Most resources to save for any one site, including the page itself.",
+)
+parser.add_argument(
+    "--timeout",
+    type=float,
+    default=15,
+    help="Seconds to wait for each response.",
+)
+parser.add_argument(
+    "--recapture",
+    type=bool,
+    default=False,
+    help="True if we want to capture sites that are already in the mirror again.",
+)
+opts = parser.parse_args()
+
+sites_directory = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "sites"
+)
+
+if opts.sites_list.startswith("alexa"):
+    n = int(opts.sites_list.replace("alexa", ""))
+    domains = pd.read_csv(os.path.join(sites_directory, "closed_world.csv"))[
+        "domain"
+    ].tolist()[:n]
+elif opts.sites_list == "open_world":
+    domains = pd.read_csv(os.path.join(sites_directory, "open_world.csv"))[
+        "domain"
+    ].tolist()
+else:
+    domains = opts.sites_list.split(",")
+
+# Same URLs as record_data.py, since they're what the mirror is looked up by
+domains = [f"https://{x}" if "http://" not in x else x for x in domains]
+
+os.makedirs(opts.out_directory, exist_ok=True)
+archive = MirrorArchive(opts.out_directory)
+
+if not opts.recapture:
+    domains = [x for x in domains if x not in archive.sites]
+
+failed = []
+
+for domain in tqdm(domains):
+    n = capture_site(
+        domain,
+        archive,
+        max_resources=opts.max_resources,
+        threads=opts.threads,
+        timeout=opts.timeout,
+    )
+
+    if n == 0:
+        failed.append(domain)
+    else:
+        archive.save()
+
+print(
+    f"{len(archive.sites)} sites, {len(archive.resources)} resources in {opts.out_directory}"
+)
+
+if len(failed) > 0:
+    print(f"Couldn't reach {len(failed)} sites: {', '.join(failed)}")
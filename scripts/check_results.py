@@ -1,81 +1,74 @@
 import argparse
 import numpy as np
-import pickle
 import os
+import sys
 import warnings
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
 warnings.filterwarnings("ignore")
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import top_k_accuracy_score
-from sklearn.model_selection import train_test_split
-from tqdm import trange
+from analysis import evaluate_splits, load_features
+from storage import ColumnarTraceStore, load_columnar, load_pickles
+from tqdm import tqdm
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--data_file", default="data", type=str)
 parser.add_argument("--n", default=10, type=int)
 parser.add_argument("--test_size", default=0.25, type=float)
+parser.add_argument("--workers", default=None, type=int, help="Processes to load .pkl files with. Defaults to the number of cores.")
+parser.add_argument("--width", default=None, type=int, help="Number of samples to pad or truncate each trace to. Defaults to the longest trace.")
+parser.add_argument("--seed", default=None, type=int, help="Seed for the splits and classifiers, for reproducible results.")
+parser.add_argument("--processes", default=1, type=int, help="Number of splits to evaluate in parallel.")
+parser.add_argument("--pad", default="zero", choices=["zero", "edge"], help="Pad short traces with zeros, or with their last value.")
+parser.add_argument("--bin_size", default=1, type=int, help="Average every bin_size samples into one feature.")
+parser.add_argument("--normalize", default="none", choices=["none", "zscore", "minmax"], help="How to normalize each trace.")
+parser.add_argument("--summary_stats", default=False, type=bool, help="True if we want to add summary statistics of each trace as features.")
+parser.add_argument("--pca", default=None, type=int, help="Number of principal components to reduce features to.")
+parser.add_argument("--cache_dir", default="feature_cache", type=str, help="Where to cache transformed features. Set to an empty string to disable.")
 opts = parser.parse_args()
 
 def get_data(path):
-    # Data preparation
-    traces = []
-    labels = []
-
-    if os.path.isdir(path):
-        # If directory, find all .pkl files
-        filepaths = [os.path.join(path, x) for x in os.listdir(path) if x.endswith(".pkl")]
-    elif os.path.isfile(path):
-        # If single file, just use this one
-        filepaths = [path]
-    else:
-        raise RuntimeError
-
-    for file in filepaths:
-        f = open(file, "rb")
-
-        while True:
-            try:
-                data = pickle.load(f)
-                traces_i, labels_i = data[0], data[1]
-
-                if isinstance(traces_i[0], list):
-                    traces.extend(traces_i)
-                else:
-                    traces.append(traces_i)
-
-                labels.append(labels_i)
-            except EOFError:
-                break
+    if os.path.isdir(path) and ColumnarTraceStore.exists(path):
+        return load_columnar(path)
 
-    traces = np.array(traces)
+    X, y, domains, stats = load_pickles(
+        path, width=opts.width, workers=opts.workers, pad=opts.pad
+    )
 
-    # Convert labels from domain names to ints
-    domains = list(set(labels))
-    int_mapping = {x: i for i, x in enumerate(domains)}
-    labels = [int_mapping[x] for x in labels]
-    labels = np.array(labels)
+    if stats["padded"] > 0 or stats["truncated"] > 0:
+        print(
+            f"Padded {stats['padded']} and truncated {stats['truncated']} traces to {X.shape[1]} samples"
+        )
 
-    return traces, labels, domains
+    return X, y, domains
 
 
-def get_accs(X, y, domains):
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=opts.test_size, stratify=y)
-
-    clf = RandomForestClassifier()
-    clf = clf.fit(X_train, y_train)
-
-    y_probs = clf.predict_proba(X_test)
-    top1 = top_k_accuracy_score(y_test, y_probs, k=1)
-    top5 = top_k_accuracy_score(y_test, y_probs, k=5)
-
-    return [top1, top5]
-
 print(f"Analyzing results from {opts.data_file}")
 
-X, y, domains = get_data(opts.data_file)
-accs = np.array([get_accs(X, y, domains) for _ in trange(opts.n)])
+if opts.bin_size > 1 or opts.normalize != "none" or opts.summary_stats or opts.pca is not None:
+    X, y, domains = load_features(
+        opts.data_file,
+        get_data,
+        cache_dir=opts.cache_dir or None,
+        loader_params={"width": opts.width, "pad": opts.pad},
+        bin_size=opts.bin_size,
+        normalization=None if opts.normalize == "none" else opts.normalize,
+        include_summary=opts.summary_stats,
+        pca_components=opts.pca,
+        seed=opts.seed,
+    )
+else:
+    X, y, domains = get_data(opts.data_file)
+accs = evaluate_splits(
+    X,
+    y,
+    n=opts.n,
+    test_size=opts.test_size,
+    seed=opts.seed,
+    processes=opts.processes,
+    progress=tqdm,
+)
 print()
 
 top1 = accs[:, 0].mean()
@@ -85,6 +78,9 @@ top5 = accs[:, 1].mean()
 top5_std = accs[:, 1].std()
 
 print(f"Number of traces: {len(X)}")
+print(f"Number of features: {X.shape[1]}")
 print()
 print("top1 accuracy: {:.1f}% (+/- {:.1f}%)".format(top1 * 100, top1_std * 100))
 print("top5 accuracy: {:.1f}% (+/- {:.1f}%)".format(top5 * 100, top5_std * 100))
+print()
+print("Time per split: {:.2f}s (min {:.2f}s, max {:.2f}s)".format(accs[:, 2].mean(), accs[:, 2].min(), accs[:, 2].max()))
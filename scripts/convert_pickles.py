@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from storage import convert_pickles, encode_pickles
+
+parser = argparse.ArgumentParser(
+    description="Convert .pkl traces from record_data.py into a columnar store, or into .pkl files of encoded traces."
+)
+parser.add_argument("--data_file", type=str, required=True)
+parser.add_argument("--out_directory", type=str, required=True)
+parser.add_argument(
+    "--width",
+    type=int,
+    default=None,
+    help="Number of samples per trace. Defaults to the length of the first trace.",
+)
+parser.add_argument("--dtype", type=str, default="float32")
+parser.add_argument(
+    "--trace_codec",
+    type=str,
+    choices=["zlib", "lzma"],
+    default=None,
+    help="Write .pkl files with traces encoded as with record_data.py's --trace_codec, instead of a columnar store.",
+)
+opts = parser.parse_args()
+
+if opts.trace_codec is not None:
+    n = encode_pickles(opts.data_file, opts.out_directory, opts.trace_codec)
+else:
+    n = convert_pickles(opts.data_file, opts.out_directory, opts.width, opts.dtype)
+
+print(f"Converted {n} traces to {opts.out_directory}")
@@ -1,8 +1,32 @@
-import numpy as np
+import argparse
 import os
+import sys
+
 import pandas as pd
-import urllib.request
-import zipfile
+
+parser = argparse.ArgumentParser(
+    description="Generate an open world site list from a top sites list, leaving out the closed world sites."
+)
+parser.add_argument(
+    "--top_sites",
+    default="top-1m.csv",
+    type=str,
+    help="A local rank,domain CSV without a header, e.g. Alexa or Tranco's top 1M list. Can be zipped.",
+)
+parser.add_argument(
+    "--num_sites",
+    default=6000,
+    type=int,
+    help="Number of sites to generate. record_data.py only needs 5000, so the default leaves extras in case some sites have errors.",
+)
+parser.add_argument("--out_file", default="open_world.csv", type=str)
+parser.add_argument(
+    "--chunk_size",
+    default=100000,
+    type=int,
+    help="Rows of the top sites list to read at a time.",
+)
+opts = parser.parse_args()
 
 alexa_domains = [
     "google",
@@ -104,35 +128,71 @@ alexa_domains = [
     "pinterest",
     "primevideo",
     "intuit",
-    "medium"
+    "medium",
 ]
 
-if not os.path.exists("top-1m.csv"):
-    urllib.request.urlretrieve("http://s3.amazonaws.com/alexa-static/top-1m.csv.zip", "top-1m.csv.zip")
 
-    with zipfile.ZipFile("top-1m.csv.zip") as z:
-        z.extractall()
+def get_name(domains):
+    return domains.str.split(".", n=1).str[0]
+
+
+def gen_open_world(top_sites, num_sites, chunk_size=100000):
+    """Yield open world domains from top_sites in rank order, num_sites in all.
+
+    A domain is left out if it's a closed world domain or shares its name (the
+    part before the first dot) with a closed world site or a domain already
+    taken. The list is read chunk_size rows at a time and we stop reading as
+    soon as we have enough.
+    """
+    existing_domains = [
+        f"{x.replace('!', '')}{'.com' if '.' not in x else ''}" for x in alexa_domains
+    ]
+    existing_names = set([x.replace("!", "").split(".")[0] for x in alexa_domains])
+    remaining = num_sites
+
+    chunks = pd.read_csv(
+        top_sites,
+        header=None,
+        usecols=[1],
+        names=["rank", "domain"],
+        dtype={"domain": str},
+        chunksize=chunk_size,
+    )
+
+    for chunk in chunks:
+        domains = chunk["domain"].dropna()
+        names = get_name(domains)
+
+        keep = ~domains.isin(existing_domains) & ~names.isin(existing_names)
+        domains, names = domains[keep], names[keep]
+
+        # Within a chunk, only the best ranked domain with each name is new
+        first = ~names.duplicated()
+        domains, names = domains[first], names[first]
+
+        if len(domains) >= remaining:
+            yield from domains.iloc[:remaining]
+            return
 
-existing_domains = domains = [f"{x.replace('!', '')}{'.com' if '.' not in x else ''}" for x in alexa_domains]
-existing_names = set([x.replace("!", "").split(".")[0] for x in alexa_domains])
+        existing_names.update(names)
+        remaining -= len(domains)
+        yield from domains
 
-open_world_domains = []
 
-df = pd.read_csv("top-1m.csv", header=None, names=["rank", "domain"])
+if not os.path.exists(opts.top_sites):
+    print(
+        f"{opts.top_sites} doesn't exist. Download a top sites list, e.g. from https://tranco-list.eu, and pass it with --top_sites."
+    )
+    sys.exit(1)
 
-for i in range(len(df)):
-    domain = df.iloc[i]["domain"]
+open_world_domains = list(
+    gen_open_world(opts.top_sites, opts.num_sites, opts.chunk_size)
+)
 
-    if domain in existing_domains:
-        continue
-    elif domain.split(".")[0] in existing_names:
-        continue
-    else:
-        open_world_domains.append(domain)
-        existing_names.add(domain.split(".")[0])
-    
-    # Provide extra sites (we only need 5000) in case some sites have errors
-    if len(open_world_domains) == 6000:
-        break
+if len(open_world_domains) < opts.num_sites:
+    print(
+        f"WARNING: {opts.top_sites} only had {len(open_world_domains)} eligible sites."
+    )
 
-pd.Series(open_world_domains).to_csv("open_world.csv", header=["domain"], index=False)
+pd.Series(open_world_domains).to_csv(opts.out_file, header=["domain"], index=False)
+print(f"Wrote {len(open_world_domains)} sites to {opts.out_file}")
@@ -3,8 +3,16 @@ import json
 import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import irq_name, read_irq_affinities, set_irq_affinity
+
 parser = argparse.ArgumentParser()
-parser.add_argument("--config_path", type=str)
+parser.add_argument(
+    "--config_path",
+    type=str,
+    help="Affinities to restore, from save_irqbalance_config.py or the isolation.json record_data.py leaves behind, without .json.",
+)
 parser.add_argument("--cpu", default=-1, type=int)
 opts = parser.parse_args()
 
@@ -12,22 +20,30 @@ if opts.cpu == -1 and opts.config_path is None:
     print("At least one of cpu or config_path must be set")
     sys.exit(1)
 
-def update_smp_affinity(i, val):
-    try:
-        with open(f"/proc/irq/{i}/smp_affinity", "w") as f:
-            f.write(val)
-    except Exception as e:
-        print(f"fail {i}")
-        pass
-
 if opts.cpu == -1:
     data = json.loads(open(f"{opts.config_path}.json", "r").read())
-
-    for k in data:
-        update_smp_affinity(k, data[k])
 else:
-    for path in os.listdir("/proc/irq"):
-        if not path.isnumeric():
-            continue
+    data = {k: f"{1 << opts.cpu:x}" for k in read_irq_affinities()}
+
+failed = {}
+
+for irq, mask in data.items():
+    if irq == "default":
+        try:
+            with open("/proc/irq/default_smp_affinity", "w") as f:
+                f.write(mask)
+        except OSError as e:
+            failed[irq] = e.strerror or str(e)
+    elif os.path.exists(f"/proc/irq/{irq}"):
+        error = set_irq_affinity(irq, mask)
+
+        if error is not None:
+            failed[irq] = error
+
+print(f"Set the affinity of {len(data) - len(failed)} IRQs.")
 
-        update_smp_affinity(path, str(1 << opts.cpu))
\ No newline at end of file
+for irq, error in failed.items():
+    if irq == "default":
+        print(f"Couldn't set the default for new IRQs: {error}")
+    else:
+        print(f"Couldn't set IRQ {irq} {irq_name(irq)}: {error}")
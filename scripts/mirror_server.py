@@ -0,0 +1,31 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import MirrorArchive, MirrorServer
+
+parser = argparse.ArgumentParser(
+    description="Serve a mirror saved by capture_sites.py, e.g. for a victim browser on another machine."
+)
+parser.add_argument("--mirror_directory", type=str, default="mirror")
+parser.add_argument("--port", type=int, default=8000)
+opts = parser.parse_args()
+
+archive = MirrorArchive(opts.mirror_directory)
+
+if len(archive.sites) == 0:
+    print(f"No sites in {opts.mirror_directory}.")
+    sys.exit(1)
+
+server = MirrorServer(archive, opts.port)
+print(f"Serving {len(archive.sites)} sites on port {opts.port}:")
+
+for url, path in archive.sites.items():
+    print(f"{url} -> http://localhost:{opts.port}{path}")
+
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    server.server_close()
@@ -4,54 +4,160 @@ if "DISPLAY" not in os.environ:
     os.environ["DISPLAY"] = ":0"
 
 import argparse
-import socket
+import asyncio
+import sys
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
-from urllib.parse import urlparse
+from selenium.common.exceptions import TimeoutException
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from drivers.protocol import encode_message, read_message_async
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--trace_length", type=int, default=15)
+parser.add_argument("--port", type=int, default=1234)
+parser.add_argument(
+    "--dry_run",
+    type=bool,
+    default=False,
+    help="True if we want to print URLs instead of opening them, e.g. to test several receivers on one machine.",
+)
 opts = parser.parse_args()
 
-driver = webdriver.Chrome()
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-s.bind(("0.0.0.0", 1234))
-s.listen(1)
+class DryRunDriver:
+    def get(self, url):
+        print(f"[{opts.port}] {url}")
+
+    def set_page_load_timeout(self, timeout):
+        pass
+
+    def execute_script(self, script):
+        return None
+
+    def quit(self):
+        pass
+
+
+def get_driver():
+    return DryRunDriver() if opts.dry_run else webdriver.Chrome()
+
+
+driver = get_driver()
+
+# The browser can only do one thing at a time, so every command that touches
+# it runs on this one thread, in the order it was received. Pings are answered
+# straight away, even while a page is loading.
+browser_thread = ThreadPoolExecutor(max_workers=1)
+
+
+def get_page_timing():
+    try:
+        return driver.execute_script("return performance.timing.toJSON();")
+    except Exception:
+        return None
+
+
+def navigate(msg, send_reply):
+    url = msg["url"]
+
+    if url == "biggerfish://new-tab":
+        url = "chrome://new-tab-page"
+
+    send_reply({"id": msg["id"], "event": "started", "time": time.time()})
+    reply = {"id": msg["id"], "event": "finished"}
+
+    try:
+        driver.get(url)
+    except TimeoutException:
+        reply["timed_out"] = True
+    except Exception as e:
+        reply["error"] = str(e)
+
+    reply["time"] = time.time()
+    reply["timing"] = get_page_timing()
+    return reply
+
+
+def restart(msg):
+    global driver
+
+    driver.quit()
+    driver = get_driver()
+    return {"id": msg["id"], "event": "finished", "time": time.time()}
+
+
+def set_timeout(msg):
+    driver.set_page_load_timeout(int(msg["seconds"]))
+    return {"id": msg["id"], "event": "finished", "time": time.time()}
+
+
+async def run_command(msg, writer):
+    loop = asyncio.get_running_loop()
+
+    def send_reply(reply):
+        if not writer.is_closing():
+            writer.write(encode_message(reply))
+
+    if msg["cmd"] == "ping":
+        reply = {"id": msg["id"], "event": "finished", "time": time.time()}
+    elif msg["cmd"] == "navigate":
+        reply = await loop.run_in_executor(
+            browser_thread,
+            navigate,
+            msg,
+            lambda x: loop.call_soon_threadsafe(send_reply, x),
+        )
+    elif msg["cmd"] == "set_timeout":
+        reply = await loop.run_in_executor(browser_thread, set_timeout, msg)
+    elif msg["cmd"] == "restart":
+        reply = await loop.run_in_executor(browser_thread, restart, msg)
+    else:
+        reply = {
+            "id": msg["id"],
+            "event": "finished",
+            "time": time.time(),
+            "error": f"Unknown command {msg['cmd']}",
+        }
+
+    send_reply(reply)
+    await writer.drain()
+
+
+async def handle_connection(reader, writer, done):
+    print("Connected successfully!")
+    commands = []
 
-print("Waiting for connection...")
-conn, _ = s.accept()
+    while True:
+        msg = await read_message_async(reader)
 
-print("Connected successfully!")
+        if msg is None:
+            break
 
-while True:
-    chunk = conn.recv(1024)
+        commands.append(asyncio.ensure_future(run_command(msg, writer)))
+        commands = [x for x in commands if not x.done()]
 
-    if not chunk:
-        driver.quit()
-        break
+    writer.close()
+    await asyncio.gather(*commands, return_exceptions=True)
+    await asyncio.get_running_loop().run_in_executor(browser_thread, driver.quit)
+    done.set()
 
-    msgs = chunk.decode("utf-8").split("\n")
 
-    for domain in msgs:
-        if len(domain) == 0:
-            continue
+async def main():
+    done = asyncio.Event()
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(r, w, done),
+        "0.0.0.0",
+        opts.port,
+        reuse_address=True,
+    )
 
-        data = urlparse(domain)
+    print("Waiting for connection...")
 
-        if data.scheme == "biggerfish":
-            if data.netloc == "restart":
-                driver.quit()
-                driver = webdriver.Chrome()
-            elif data.netloc == "set-timeout":
-                driver.set_page_load_timeout(int(data.path[1:]))
-            elif data.netloc == "new-tab":
-                domain = "chrome://new-tab-page"
+    async with server:
+        await done.wait()
 
-        try:
-            driver.get(domain)
-        except:
-            pass
 
-conn.close()
+asyncio.run(main())
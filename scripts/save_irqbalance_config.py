@@ -1,19 +1,17 @@
 import argparse
 import json
 import os
-import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lib import read_irq_affinities
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--out_filename", type=str, required=True)
 opts = parser.parse_args()
 
-data = {}
-
-for path in os.listdir("/proc/irq"):
-    if not path.isnumeric():
-        continue
-
-    data[path] = open(f"/proc/irq/{path}/smp_affinity").read().strip()
+data = read_irq_affinities()
 
 with open(f"{opts.out_filename}.json", "w") as f:
-    f.write(json.dumps(data, indent=4, sort_keys=True))
\ No newline at end of file
+    f.write(json.dumps(data, indent=4, sort_keys=True))
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import warnings
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+warnings.filterwarnings("ignore")
+
+from analysis import evaluate_splits, simulate_grid
+from storage import ColumnarTraceStore, load_columnar, load_pickles
+from tqdm import tqdm
+
+parser = argparse.ArgumentParser(
+    description="Derive counter traces for a grid of timer countermeasures from traces recorded with --counter_sampler raw."
+)
+parser.add_argument("--data_file", default="data", type=str)
+parser.add_argument(
+    "--bin_us",
+    default=10,
+    type=float,
+    help="The --raw_bin_us the traces were recorded with.",
+)
+parser.add_argument(
+    "--resolutions",
+    default="0.0001,0.001,0.01",
+    type=str,
+    help="Comma-separated timer resolutions to simulate, in seconds, as with --timer_resolution.",
+)
+parser.add_argument(
+    "--jitter",
+    default="both",
+    choices=["off", "on", "both"],
+    help="Whether to simulate each resolution with Chrome's jitter, without it, or both.",
+)
+parser.add_argument(
+    "--randomized_timer",
+    default=False,
+    type=bool,
+    help="True if we also want to simulate ours_with_timer_countermeasure's randomized timer.",
+)
+parser.add_argument("--seed", default=None, type=int)
+parser.add_argument(
+    "--processes",
+    default=None,
+    type=int,
+    help="Number of processes to simulate with. Defaults to the number of cores.",
+)
+parser.add_argument("--out_directory", default="simulated", type=str)
+parser.add_argument(
+    "--overwrite",
+    type=bool,
+    default=False,
+    help="True if we want to overwrite the output directory.",
+)
+parser.add_argument(
+    "--evaluate",
+    default=False,
+    type=bool,
+    help="True if we want to evaluate a classifier on every simulated dataset.",
+)
+parser.add_argument("--n", default=10, type=int)
+opts = parser.parse_args()
+
+# Columnar stores are appended to, so writing into an old output directory
+# would add a second copy of every trace
+if os.path.isdir(opts.out_directory) and len(os.listdir(opts.out_directory)) > 0:
+    if not opts.overwrite:
+        print(
+            f"Data already exists at {opts.out_directory}. Pass --overwrite True to replace it."
+        )
+        sys.exit(1)
+
+    shutil.rmtree(opts.out_directory)
+
+if os.path.isdir(opts.data_file) and ColumnarTraceStore.exists(opts.data_file):
+    read_counts, y, domains = load_columnar(opts.data_file)
+else:
+    read_counts, y, domains, _ = load_pickles(opts.data_file)
+
+length = int(round(read_counts.shape[1] * opts.bin_us / 1000))
+
+settings = [{"timer": None}]
+jitters = {"off": [False], "on": [True], "both": [False, True]}[opts.jitter]
+
+for resolution in [float(x) for x in opts.resolutions.split(",")]:
+    for jitter in jitters:
+        settings.append({"timer": "clamp", "resolution": resolution, "jitter": jitter})
+
+if opts.randomized_timer:
+    settings.append({"timer": "randomized"})
+
+
+def get_setting_name(setting):
+    if setting["timer"] == "clamp":
+        return (
+            f"clamp-{setting['resolution']:g}{'-jitter' if setting['jitter'] else ''}"
+        )
+
+    return setting["timer"] or "unclamped"
+
+
+print(f"Simulating {len(settings)} timers on {len(read_counts)} traces of {length} ms")
+
+traces = simulate_grid(
+    read_counts,
+    opts.bin_us,
+    length,
+    settings,
+    processes=opts.processes,
+    seed=opts.seed,
+    progress=tqdm,
+)
+
+os.makedirs(opts.out_directory, exist_ok=True)
+results = []
+
+for setting, X in zip(settings, traces):
+    name = get_setting_name(setting)
+    store = ColumnarTraceStore(os.path.join(opts.out_directory, name), width=length)
+
+    for i, domain in enumerate(domains):
+        store.extend(X[y == i], domain)
+
+    store.close()
+
+    result = {"name": name, **setting}
+
+    if opts.evaluate:
+        accs = evaluate_splits(
+            X.astype(np.float32), y, n=opts.n, seed=opts.seed, processes=1
+        )
+        result["top1"] = accs[:, 0].mean()
+        result["top5"] = accs[:, 1].mean()
+
+        print(f"{name:<24} top1 {result['top1']:.3f}  top5 {result['top5']:.3f}")
+
+    results.append(result)
+
+with open(os.path.join(opts.out_directory, "settings.json"), "w") as f:
+    json.dump(results, f, indent=4)
+
+print(f"Wrote {len(settings)} datasets to {opts.out_directory}")
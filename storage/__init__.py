@@ -0,0 +1,10 @@
+from .codec import decode_trace, encode_trace
+from .columnar import (
+    ColumnarTraceStore,
+    convert_pickles,
+    encode_pickles,
+    load_columnar,
+)
+from .loader import load_pickles
+from .manifest import Manifest
+from .merge import merge_shards
@@ -0,0 +1,201 @@
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+# Samples the counter loops leave unset
+GAP = -1
+
+# magic, version, kind, packing, bit width, compression, number of samples
+HEADER = struct.Struct("<4sBBBBBQ")
+MAGIC = b"BFTC"
+VERSION = 1
+
+INT, FLOAT, GAPPED_INT = 0, 1, 2
+VARINT, BITPACK, RAW = 0, 1, 2
+COMPRESSIONS = ["none", "zlib", "lzma"]
+
+
+def zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values):
+    values = values.astype(np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(
+        np.int64
+    )
+
+
+def varint_encode(values):
+    """LEB128 encode an array of uint64, 7 bits per byte."""
+    values = np.asarray(values, dtype=np.uint64)
+
+    if len(values) == 0:
+        return b""
+
+    # Only as many 7 bit groups as the largest value needs
+    n_groups = max(1, -(-int(values.max()).bit_length() // 7))
+    shifts = np.arange(0, 7 * n_groups, 7, dtype=np.uint64)
+    groups = ((values[:, None] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+
+    # Each value needs one byte, plus one for every further group that's set
+    n_bytes = 1 + ((values[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    columns = np.arange(len(shifts))
+
+    # Every byte but the last of each value has its continuation bit set
+    groups[columns < n_bytes[:, None] - 1] |= 0x80
+    used = columns < n_bytes[:, None]
+
+    return groups[used].tobytes()
+
+
+def varint_decode(data, n):
+    data = np.frombuffer(data, dtype=np.uint8)
+
+    if n == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty(n, dtype=np.int64)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # Position of each byte within its value
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    contributions = (data & 0x7F).astype(np.uint64) << (7 * positions).astype(np.uint64)
+
+    return np.add.reduceat(contributions, starts)
+
+
+def bitpack_encode(values, width):
+    values = np.asarray(values, dtype=np.uint64)
+    bits = (
+        (values[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)
+    ).astype(np.uint8)
+    return np.packbits(bits.ravel(), bitorder="little").tobytes()
+
+
+def bitpack_decode(data, n, width):
+    bits = np.unpackbits(
+        np.frombuffer(data, dtype=np.uint8), count=n * width, bitorder="little"
+    ).reshape(n, width)
+    return (bits.astype(np.uint64) << np.arange(width, dtype=np.uint64)).sum(
+        axis=1, dtype=np.uint64
+    )
+
+
+def encode_trace(trace, compression="zlib", packing=None):
+    """Encode a numeric trace as compact bytes.
+
+    Samples that were never set (-1) are kept aside as a bitmap. The rest of
+    an integer trace is delta encoded, since neighbouring samples are close,
+    zigzag encoded so that small negative deltas stay small, and packed as
+    varints or at a fixed bit width, whichever is smaller unless packing is
+    given. Anything else is stored as float32. The result is then compressed
+    with zlib or lzma, which takes care of the long runs of equal samples.
+    """
+    trace = np.asarray(trace).ravel()
+    n = len(trace)
+    compression_id = COMPRESSIONS.index(compression)
+
+    if trace.dtype.kind in "iub" or (
+        trace.dtype.kind == "f"
+        and np.all(np.isfinite(trace))
+        and np.all(trace == np.round(trace))
+    ):
+        trace = trace.astype(np.int64)
+        gaps = trace == GAP
+        prefix = b""
+
+        if gaps.any():
+            # Keep the gaps as a bitmap, so that deltas are between real samples
+            kind = GAPPED_INT
+            prefix = np.packbits(gaps, bitorder="little").tobytes()
+            trace = trace[~gaps]
+        else:
+            kind = INT
+
+        values = zigzag(np.diff(trace, prepend=0))
+        width = int(values.max()).bit_length() if len(values) > 0 else 0
+
+        encoded = {}
+
+        if packing in [None, VARINT]:
+            encoded[VARINT] = varint_encode(values)
+
+        if packing in [None, BITPACK]:
+            encoded[BITPACK] = bitpack_encode(values, width)
+
+        packing = min(encoded, key=lambda x: len(encoded[x]))
+        payload = prefix + encoded[packing]
+    else:
+        kind, packing, width = FLOAT, RAW, 0
+        payload = trace.astype("<f4").tobytes()
+
+    if compression == "zlib":
+        payload = zlib.compress(payload, 6)
+    elif compression == "lzma":
+        payload = lzma.compress(payload)
+
+    return (
+        HEADER.pack(MAGIC, VERSION, kind, packing, width, compression_id, n) + payload
+    )
+
+
+def is_encoded(data):
+    return isinstance(data, bytes) and data[: len(MAGIC)] == MAGIC
+
+
+def encoded_length(data):
+    """Return how many samples an encoded trace holds, without decoding it."""
+    return HEADER.unpack_from(data)[6]
+
+
+def decode_trace(data):
+    """Decode bytes from encode_trace into an int64 or float32 array."""
+    magic, version, kind, packing, width, compression_id, n = HEADER.unpack_from(data)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not an encoded trace")
+
+    payload = data[HEADER.size :]
+    compression = COMPRESSIONS[compression_id]
+
+    if compression == "zlib":
+        payload = zlib.decompress(payload)
+    elif compression == "lzma":
+        payload = lzma.decompress(payload)
+
+    if kind == FLOAT:
+        return np.frombuffer(payload, dtype="<f4").copy()
+
+    gaps = None
+
+    if kind == GAPPED_INT:
+        n_bitmap = (n + 7) // 8
+        gaps = np.unpackbits(
+            np.frombuffer(payload[:n_bitmap], dtype=np.uint8),
+            count=n,
+            bitorder="little",
+        ).astype(bool)
+        payload = payload[n_bitmap:]
+        n_values = n - int(gaps.sum())
+    else:
+        n_values = n
+
+    if packing == VARINT:
+        values = varint_decode(payload, n_values)
+    else:
+        values = bitpack_decode(payload, n_values, width)
+
+    values = np.cumsum(unzigzag(values))
+
+    if gaps is None:
+        return values
+
+    trace = np.full(n, GAP, dtype=np.int64)
+    trace[~gaps] = values
+    return trace
@@ -0,0 +1,268 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+from .codec import decode_trace, encode_trace, encoded_length, is_encoded
+
+META_FILENAME = "meta.json"
+TRACES_FILENAME = "traces.bin"
+LABELS_FILENAME = "labels.txt"
+
+
+class ColumnarTraceStore:
+    """Append-only store of fixed-width numeric traces.
+
+    Traces are written back-to-back as raw rows of `dtype` to traces.bin, with
+    one domain per line in labels.txt and the row layout in meta.json. Because
+    every row has the same width, the whole file can be memory-mapped as a
+    single (n, width) matrix without reading it into RAM.
+    """
+
+    def __init__(self, directory, width=None, dtype="float32"):
+        self.directory = directory
+        meta_path = os.path.join(directory, META_FILENAME)
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+            if width is not None and width != meta["width"]:
+                raise ValueError(
+                    f"Store at {directory} has width {meta['width']}, not {width}"
+                )
+
+            self.width = meta["width"]
+            self.dtype = np.dtype(meta["dtype"])
+        else:
+            if width is None:
+                raise ValueError("width must be set when creating a new store")
+
+            self.width = width
+            self.dtype = np.dtype(dtype)
+
+            os.makedirs(directory, exist_ok=True)
+
+            with open(meta_path, "w") as f:
+                json.dump({"width": self.width, "dtype": self.dtype.str}, f)
+
+        self._traces_f = None
+        self._labels_f = None
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, META_FILENAME))
+
+    def _open(self):
+        if self._traces_f is None:
+            self._truncate()
+            self._traces_f = open(os.path.join(self.directory, TRACES_FILENAME), "ab")
+            self._labels_f = open(os.path.join(self.directory, LABELS_FILENAME), "a")
+
+    def _truncate(self):
+        # Rows whose labels were never written, e.g. because we were killed in
+        # the middle of extend(), would have the labels of the next rows
+        # appended. Drop them, along with any partly written label or row.
+        labels_path = os.path.join(self.directory, LABELS_FILENAME)
+        traces_path = os.path.join(self.directory, TRACES_FILENAME)
+        n_labels = 0
+
+        if os.path.exists(labels_path):
+            with open(labels_path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+
+                if end < len(data):
+                    f.truncate(end)
+
+                n_labels = data.count(b"\n")
+
+        if os.path.exists(traces_path):
+            size = n_labels * self.width * self.dtype.itemsize
+
+            if os.path.getsize(traces_path) > size:
+                os.truncate(traces_path, size)
+
+    def _to_row(self, trace):
+        trace = np.asarray(trace, dtype=self.dtype).ravel()
+
+        if len(trace) > self.width:
+            return trace[: self.width]
+
+        row = np.zeros(self.width, dtype=self.dtype)
+        row[: len(trace)] = trace
+        return row
+
+    def append(self, trace, domain):
+        self.extend([trace], domain)
+
+    def extend(self, traces, domain):
+        if "\n" in domain:
+            raise ValueError("Domain names can't contain newlines")
+
+        self._open()
+
+        for trace in traces:
+            self._traces_f.write(self._to_row(trace).tobytes())
+
+        # Labels are written after the rows they describe, so a crash between
+        # the two writes leaves extra rows, which the next _open() drops.
+        self._traces_f.flush()
+        self._labels_f.write(f"{domain}\n" * len(traces))
+        self._labels_f.flush()
+
+    def labels(self):
+        path = os.path.join(self.directory, LABELS_FILENAME)
+
+        if not os.path.exists(path):
+            return []
+
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def counts(self):
+        counts = {}
+
+        for domain in self.labels():
+            counts[domain] = counts.get(domain, 0) + 1
+
+        return counts
+
+    def close(self):
+        if self._traces_f is not None:
+            self._traces_f.close()
+            self._labels_f.close()
+            self._traces_f = None
+            self._labels_f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_columnar(directory, mode="r"):
+    """Return (X, y, domains) for a columnar store, with X memory-mapped.
+
+    Labels are encoded against the sorted list of domains so that ids are
+    stable across runs.
+    """
+    store = ColumnarTraceStore(directory)
+    labels = store.labels()
+
+    traces_path = os.path.join(directory, TRACES_FILENAME)
+    row_bytes = store.width * store.dtype.itemsize
+    n_rows = (
+        os.path.getsize(traces_path) // row_bytes if os.path.exists(traces_path) else 0
+    )
+    n = min(n_rows, len(labels))
+
+    if n == 0:
+        X = np.zeros((0, store.width), dtype=store.dtype)
+    else:
+        X = np.memmap(traces_path, dtype=store.dtype, mode=mode, shape=(n, store.width))
+
+    domains = sorted(set(labels[:n]))
+    int_mapping = {x: i for i, x in enumerate(domains)}
+    y = np.array([int_mapping[x] for x in labels[:n]], dtype=np.int64)
+
+    return X, y, domains
+
+
+def record_traces(traces_i):
+    """Return the list of traces held by one record of a pickle file."""
+    # Each record holds a list of traces, which are lists (or dicts of arrays,
+    # for binary eBPF traces, or bytes, for encoded traces)
+    if len(traces_i) == 0 or not isinstance(
+        traces_i[0], (list, tuple, dict, np.ndarray, bytes)
+    ):
+        return [traces_i]
+
+    return traces_i
+
+
+def trace_width(trace):
+    """Return how many samples a trace holds, without decoding it."""
+    if is_encoded(trace):
+        return encoded_length(trace)
+    elif isinstance(trace, dict):
+        # eBPF traces aren't loaded into a matrix, so they have no width
+        return 0
+
+    return len(trace)
+
+
+def iter_pickle_traces(path, decode=True):
+    """Yield (trace, domain) pairs from a pickle file written by record_data.py.
+
+    Traces saved with a --trace_codec are decoded into arrays unless decode is
+    False, in which case they're yielded as the encoded bytes.
+    """
+    with open(path, "rb") as f:
+        while True:
+            try:
+                traces_i, domain = pickle.load(f)
+            except EOFError:
+                break
+
+            for trace in record_traces(traces_i):
+                if decode and is_encoded(trace):
+                    trace = decode_trace(trace)
+
+                yield trace, domain
+
+
+def convert_pickles(path, out_directory, width=None, dtype="float32"):
+    """Convert a .pkl file, or a directory of them, into a columnar store."""
+    if os.path.isdir(path):
+        filepaths = sorted(
+            os.path.join(path, x) for x in os.listdir(path) if x.endswith(".pkl")
+        )
+    else:
+        filepaths = [path]
+
+    store = None
+    n = 0
+
+    for filepath in filepaths:
+        for trace, domain in iter_pickle_traces(filepath):
+            if store is None:
+                store = ColumnarTraceStore(
+                    out_directory, width=width or len(trace), dtype=dtype
+                )
+
+            store.append(trace, domain)
+            n += 1
+
+    if store is not None:
+        store.close()
+
+    return n
+
+
+def encode_pickles(path, out_directory, compression="zlib"):
+    """Rewrite a .pkl file, or a directory of them, with encoded traces."""
+    if os.path.isdir(path):
+        filepaths = sorted(
+            os.path.join(path, x) for x in os.listdir(path) if x.endswith(".pkl")
+        )
+    else:
+        filepaths = [path]
+
+    os.makedirs(out_directory, exist_ok=True)
+    n = 0
+
+    for filepath in filepaths:
+        out_path = os.path.join(out_directory, os.path.basename(filepath))
+
+        with open(out_path, "wb") as out_f:
+            for trace, domain in iter_pickle_traces(filepath, decode=False):
+                if not isinstance(trace, (dict, bytes)):
+                    trace = encode_trace(trace, compression)
+
+                pickle.dump(([trace], domain), out_f)
+                n += 1
+
+    return n
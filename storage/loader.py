@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from .columnar import iter_pickle_traces
+from .manifest import Manifest
+
+
+def _read_pickle_file(path):
+    traces, labels = [], []
+
+    for trace, domain in iter_pickle_traces(path):
+        if isinstance(trace, dict):
+            raise ValueError(f"{path} holds eBPF traces, which aren't numeric")
+
+        traces.append(np.asarray(trace, dtype=np.float32))
+        labels.append(domain)
+
+    return traces, labels
+
+
+def _manifest_sizes(filepaths):
+    """Return each file's number of traces and longest trace, or None.
+
+    None means a manifest is missing, stale or predates counting traces.
+    """
+    counts, widths = [], []
+    manifests = {}
+
+    for filepath in filepaths:
+        directory, filename = os.path.split(filepath)
+
+        if directory not in manifests:
+            manifests[directory] = Manifest(directory)
+
+        manifest = manifests[directory]
+        entry = manifest.files.get(filename)
+
+        if entry is None or manifest.is_stale(filename) or entry.get("traces") is None:
+            return None
+
+        counts.append(entry["traces"])
+        widths.append(entry["width"])
+
+    return counts, widths
+
+
+def _fill_rows(X, i, traces, pad, stats):
+    width = X.shape[1]
+
+    for trace in traces:
+        if len(trace) >= width:
+            X[i] = trace[:width]
+            stats["truncated"] += len(trace) > width
+        else:
+            X[i, : len(trace)] = trace
+
+            if pad == "edge" and len(trace) > 0:
+                X[i, len(trace) :] = trace[-1]
+
+            stats["padded"] += 1
+
+        i += 1
+
+
+def load_pickles(path, width=None, workers=None, pad="zero"):
+    """Load .pkl traces into one preallocated float32 matrix.
+
+    Files are unpickled in parallel by a pool of `workers` processes. Traces
+    longer than `width` are truncated and shorter ones are padded, with zeros
+    or, if pad is "edge", with their last value. If width isn't given, it's the
+    length of the longest trace. Labels are encoded against the sorted list of
+    domains, so ids are stable across runs.
+
+    The matrix is sized from the manifest if it's up to date, and each file's
+    traces are copied into it as soon as they're decoded. Otherwise every file
+    is decoded first and the matrix is sized from the result.
+
+    Returns (X, y, domains, stats), where stats counts padded and truncated
+    traces.
+    """
+    if os.path.isdir(path):
+        filepaths = sorted(
+            os.path.join(path, x) for x in os.listdir(path) if x.endswith(".pkl")
+        )
+    elif os.path.isfile(path):
+        filepaths = [path]
+    else:
+        raise RuntimeError(f"No data found at {path}")
+
+    if workers == 1 or len(filepaths) <= 1:
+        pool = None
+    else:
+        # Fork, so that scripts without a __main__ guard can call us
+        pool = multiprocessing.get_context("fork").Pool(workers)
+
+    def imap(fn):
+        if pool is None:
+            return map(fn, filepaths)
+
+        return pool.imap(fn, filepaths, chunksize=4)
+
+    try:
+        sizes = _manifest_sizes(filepaths)
+
+        if sizes is None:
+            results = list(imap(_read_pickle_file))
+            counts = [len(traces) for traces, _ in results]
+            widths = [max(map(len, traces), default=0) for traces, _ in results]
+        else:
+            results = imap(_read_pickle_file)
+            counts, widths = sizes
+
+        if width is None:
+            width = max(widths, default=0)
+
+        X = np.zeros((sum(counts), width), dtype=np.float32)
+        labels = []
+        stats = {"padded": 0, "truncated": 0}
+
+        for traces, labels_i in results:
+            if len(labels) + len(traces) > len(X):
+                raise RuntimeError(
+                    f"The manifest in {path} is out of date, "
+                    "run record_data.py with --repair_manifest"
+                )
+
+            _fill_rows(X, len(labels), traces, pad, stats)
+            labels.extend(labels_i)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    domains = sorted(set(labels))
+    int_mapping = {x: i for i, x in enumerate(domains)}
+    y = np.array([int_mapping[x] for x in labels], dtype=np.int64)
+
+    return X[: len(labels)], y, domains, stats
@@ -0,0 +1,282 @@
+import json
+import os
+import pickle
+import time
+import zlib
+
+from .columnar import record_traces, trace_width
+
+MANIFEST_FILENAME = "manifest.json"
+JOURNAL_FILENAME = "manifest.journal"
+
+
+class Manifest:
+    """Index of the per-domain .pkl files in an output directory.
+
+    For each file we keep the domain, the byte offset, length and CRC32 of
+    every pickled record, the number of traces and the length of the longest,
+    and the file size and time of the last update. This lets record_data.py
+    resume and load_pickles size its matrix without unpickling every trace,
+    and lets us notice when a file has changed behind the manifest's back.
+
+    Rewriting the whole manifest takes longer the more records there are, so
+    reset() and add_record() append each change to a journal next to it
+    instead. The journal is replayed on top of the manifest when it's loaded,
+    and folded into it by save(), which happens every compact_every changes
+    and on close().
+    """
+
+    def __init__(self, directory, compact_every=1000):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.journal_path = os.path.join(directory, JOURNAL_FILENAME)
+        self.compact_every = compact_every
+        self.files = {}
+
+        self._journal = None
+        self._journal_entries = 0
+        self._journal_torn = False
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.files = json.load(f)["files"]
+            except (ValueError, KeyError):
+                # Unreadable manifest -- treat it as missing and rebuild lazily
+                self.files = {}
+
+        if os.path.exists(self.journal_path):
+            self._replay_journal()
+
+    def _replay_journal(self):
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # A change cut short by a crash. The file it was for will
+                    # look stale and be rebuilt.
+                    self._journal_torn = not line.endswith("\n")
+                    continue
+
+                self._apply(change)
+                self._journal_entries += 1
+
+    def _apply(self, change):
+        # Changes are applied again if we're killed after save() replaces the
+        # manifest but before it empties the journal, so applying one twice
+        # must be harmless. Whole entries are, and a record is only appended
+        # where the file ended.
+        filename = change["file"]
+
+        if "entry" in change:
+            self.files[filename] = change["entry"]
+            return
+
+        entry = self.files.get(filename)
+
+        if entry is None or entry["size"] != change["offset"]:
+            return
+
+        entry["domain"] = change["domain"]
+        entry["offsets"].append(change["offset"])
+        entry["lengths"].append(change["length"])
+        entry["checksums"].append(change["checksum"])
+        entry["size"] = change["offset"] + change["length"]
+        entry["updated"] = change["updated"]
+
+        # Entries from before we counted traces stay uncounted until rebuilt
+        if entry.get("traces") is not None:
+            entry["traces"] += change["traces"]
+            entry["width"] = max(entry["width"], change["width"])
+
+    def _log(self, change, save):
+        if not save:
+            return
+
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a")
+
+            if self._journal_torn:
+                self._journal.write("\n")
+                self._journal_torn = False
+
+        self._journal.write(json.dumps(change) + "\n")
+        self._journal.flush()
+        self._journal_entries += 1
+
+        if self._journal_entries >= self.compact_every:
+            self.save()
+
+    def save(self):
+        # Write to a temporary file and rename it so that readers never see a
+        # partially written manifest, even if we're killed mid-write.
+        tmp_path = f"{self.path}.tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.path)
+
+        # Everything in the journal is in the manifest now
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+        self._journal_entries = 0
+
+    def close(self):
+        if self._journal_entries > 0:
+            self.save()
+
+    def reset(self, filename, domain, save=True):
+        self.files[filename] = {
+            "domain": domain,
+            "offsets": [],
+            "lengths": [],
+            "checksums": [],
+            "traces": 0,
+            "width": 0,
+            "size": 0,
+            "updated": time.time(),
+        }
+
+        self._log({"file": filename, "entry": self.files[filename]}, save)
+
+    def add_record(self, filename, domain, offset, record, save=True, traces=None):
+        """Index a record appended to a file at offset.
+
+        traces is the list of traces that was pickled into record. If it isn't
+        given, the record is unpickled to find it.
+        """
+        entry = self.files.get(filename)
+
+        if entry is None or entry["size"] != offset:
+            self.rebuild_file(filename)
+            entry = self.files[filename]
+            self._log({"file": filename, "entry": entry}, save)
+
+            if offset in entry["offsets"]:
+                # The rebuild already picked up this record from disk
+                return
+
+        if traces is None:
+            traces, _ = pickle.loads(record)
+
+        traces = record_traces(traces)
+        change = {
+            "file": filename,
+            "domain": domain,
+            "offset": offset,
+            "length": len(record),
+            "checksum": zlib.crc32(record),
+            "traces": len(traces),
+            "width": max(map(trace_width, traces), default=0),
+            "updated": time.time(),
+        }
+        self._apply(change)
+        self._log(change, save)
+
+    def is_stale(self, filename):
+        entry = self.files.get(filename)
+        path = os.path.join(self.directory, filename)
+
+        if not os.path.exists(path):
+            return entry is not None
+
+        return entry is None or os.path.getsize(path) != entry["size"]
+
+    def runs(self, filename):
+        if self.is_stale(filename):
+            self.rebuild_file(filename)
+            self.save()
+
+        entry = self.files.get(filename)
+        return 0 if entry is None else len(entry["offsets"])
+
+    def rebuild_file(self, filename):
+        path = os.path.join(self.directory, filename)
+
+        if not os.path.exists(path):
+            self.files.pop(filename, None)
+            return
+
+        entry = {
+            "domain": None,
+            "offsets": [],
+            "lengths": [],
+            "checksums": [],
+            "traces": 0,
+            "width": 0,
+            "size": 0,
+            "updated": os.path.getmtime(path),
+        }
+
+        with open(path, "rb") as f:
+            while True:
+                offset = f.tell()
+
+                try:
+                    traces, domain = pickle.load(f)
+                except Exception:
+                    # A truncated final record is dropped, as in should_skip
+                    break
+
+                end = f.tell()
+                f.seek(offset)
+                record = f.read(end - offset)
+
+                entry["domain"] = domain
+                entry["offsets"].append(offset)
+                entry["lengths"].append(len(record))
+                entry["checksums"].append(zlib.crc32(record))
+                entry["size"] = end
+
+                traces = record_traces(traces)
+                entry["traces"] += len(traces)
+                entry["width"] = max(
+                    entry["width"], max(map(trace_width, traces), default=0)
+                )
+
+        # Only the valid prefix is indexed. If the file has trailing garbage,
+        # its size won't match and it will keep being rechecked, which is what
+        # we want until it gets rewritten.
+        self.files[filename] = entry
+
+    def verify(self, filename):
+        """Return True if every indexed record still matches its checksum."""
+        entry = self.files.get(filename)
+
+        if entry is None:
+            return False
+
+        with open(os.path.join(self.directory, filename), "rb") as f:
+            for offset, length, checksum in zip(
+                entry["offsets"], entry["lengths"], entry["checksums"]
+            ):
+                f.seek(offset)
+
+                if zlib.crc32(f.read(length)) != checksum:
+                    return False
+
+        return True
+
+    def repair(self, verify=False):
+        """Rebuild entries for files that are missing, stale or corrupt."""
+        filenames = set(x for x in os.listdir(self.directory) if x.endswith(".pkl"))
+        repaired = []
+
+        for filename in sorted(filenames | set(self.files)):
+            if self.is_stale(filename) or (
+                verify and filename in filenames and not self.verify(filename)
+            ):
+                self.rebuild_file(filename)
+                repaired.append(filename)
+
+        self.save()
+        return repaired
@@ -0,0 +1,83 @@
+import os
+import pickle
+import shutil
+
+from .columnar import ColumnarTraceStore, iter_pickle_traces, load_columnar
+
+
+def merge_shards(shard_directories, out_directory, manifest=None):
+    """Append every trace in shard_directories to the dataset in out_directory.
+
+    Shards are the per-lane output directories written by record_data.py when
+    --workers is greater than 1. Columnar shards are appended to the columnar
+    store in out_directory; otherwise, records in each shard's .pkl files are
+    appended to the .pkl file of the same name, and recorded in manifest if one
+    is passed. Shards are deleted once they have been merged.
+    """
+    n = 0
+
+    for shard_directory in shard_directories:
+        if not os.path.exists(shard_directory):
+            continue
+
+        if ColumnarTraceStore.exists(shard_directory):
+            n += _merge_columnar_shard(shard_directory, out_directory)
+        else:
+            n += _merge_pickle_shard(shard_directory, out_directory, manifest)
+
+        shutil.rmtree(shard_directory)
+
+    if manifest is not None:
+        manifest.save()
+
+    return n
+
+
+def _merge_columnar_shard(shard_directory, out_directory):
+    shard = ColumnarTraceStore(shard_directory)
+    labels = shard.labels()
+
+    if len(labels) == 0:
+        return 0
+
+    X, _, _ = load_columnar(shard_directory)
+
+    with ColumnarTraceStore(
+        out_directory, width=shard.width, dtype=shard.dtype
+    ) as store:
+        for trace, domain in zip(X, labels):
+            store.append(trace, domain)
+
+    return len(X)
+
+
+def _merge_pickle_shard(shard_directory, out_directory, manifest):
+    n = 0
+
+    for filename in sorted(os.listdir(shard_directory)):
+        if not filename.endswith(".pkl"):
+            continue
+
+        if manifest is not None and manifest.is_stale(filename):
+            manifest.rebuild_file(filename)
+
+        with open(os.path.join(out_directory, filename), "ab") as out_f:
+            for trace, domain in iter_pickle_traces(
+                os.path.join(shard_directory, filename), decode=False
+            ):
+                record = pickle.dumps(([trace], domain))
+                offset = out_f.tell()
+                out_f.write(record)
+                out_f.flush()
+
+                if manifest is not None:
+                    if filename not in manifest.files:
+                        manifest.reset(filename, domain, save=False)
+
+                    manifest.add_record(
+                        filename, domain, offset, record, save=False, traces=[trace]
+                    )
+
+                n += 1
+
+    return n
@@ -0,0 +1,36 @@
+import numpy as np
+
+from analysis import AdaptiveScheduler
+
+
+def test_gives_up_on_a_failing_site():
+    rng = np.random.RandomState(0)
+    domains = ["a", "b", "broken"]
+    scheduler = AdaptiveScheduler(
+        domains, 2, 6, 12, round_size=2, bin_size=10, max_attempts=3, seed=0
+    )
+    attempts = 0
+
+    for _ in range(50):
+        plan = scheduler.next_round()
+
+        if len(plan) == 0:
+            break
+
+        for domain, n in plan.items():
+            if domain == "broken":
+                # e.g. the site doesn't resolve, so every run fails
+                attempts += 1
+                scheduler.add_traces(domain, [])
+                scheduler.fail(domain)
+            else:
+                level = domains.index(domain) * 10
+                scheduler.add_traces(domain, level + rng.random_sample((n, 100)))
+
+        scheduler.end_round()
+    else:
+        raise AssertionError("Adaptive collection never finished")
+
+    assert attempts == 3
+    assert scheduler.given_up().tolist() == [False, False, True]
+    assert "Gave up on 1 sites: broken." in scheduler.summary(4)
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+from storage import ColumnarTraceStore, load_columnar
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Writes one trace, then is killed after writing the next trace's row but
+# before its label
+CRASH = """
+import os
+import signal
+import sys
+
+from storage import ColumnarTraceStore
+
+
+class Kill:
+    def write(self, data):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+
+store = ColumnarTraceStore(sys.argv[1], width=3)
+store.append([1, 1, 1], "a")
+store._labels_f.close()
+store._labels_f = Kill()
+store.append([9, 9, 9], "b")
+"""
+
+
+def test_crash_between_row_and_label(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "-c", CRASH, str(tmp_path)],
+        cwd=ROOT,
+    )
+    assert result.returncode == -9
+
+    with ColumnarTraceStore(tmp_path) as store:
+        store.append([2, 2, 2], "c")
+
+    X, y, domains = load_columnar(tmp_path)
+
+    assert X.tolist() == [[1, 1, 1], [2, 2, 2]]
+    assert [domains[x] for x in y] == ["a", "c"]
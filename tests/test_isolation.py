@@ -0,0 +1,178 @@
+import errno
+import json
+import os
+
+import pytest
+
+from lib import isolation
+from lib.isolation import (
+    IsolationProfile,
+    format_mask,
+    parse_cores,
+    parse_mask,
+    read_irq_affinities,
+)
+
+ALL = "ffffffff,ffffffff"
+
+
+def make_proc(root, irqs, default=ALL):
+    """Build a fake /proc/irq, with irqs as {irq: (smp_affinity, handler)}."""
+    os.makedirs(os.path.join(root, "irq"))
+
+    with open(os.path.join(root, "irq", "default_smp_affinity"), "w") as f:
+        f.write(f"{default}\n")
+
+    for irq, (mask, handler) in irqs.items():
+        os.makedirs(os.path.join(root, "irq", irq, handler))
+
+        with open(os.path.join(root, "irq", irq, "smp_affinity"), "w") as f:
+            f.write(f"{mask}\n")
+
+    return str(root)
+
+
+def read_default(proc_root):
+    with open(os.path.join(proc_root, "irq", "default_smp_affinity")) as f:
+        return f.read().strip()
+
+
+@pytest.fixture
+def proc_root(tmp_path, monkeypatch):
+    # 64 cores, so that masks need two comma-separated groups
+    monkeypatch.setattr(isolation.psutil, "cpu_count", lambda: 64)
+
+    return make_proc(
+        tmp_path / "proc",
+        {
+            "0": (ALL, "timer"),
+            "1": ("00000000,00000001", "nvme0q0"),
+            "2": ("00000000,00000006", "eth0"),
+            "33": ("00000002,00000000", "eth1"),
+        },
+    )
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "isolation.json")
+
+
+def test_parse_cores():
+    assert parse_cores("3") == [3]
+    assert parse_cores("0,2-4") == [0, 2, 3, 4]
+    assert parse_cores("4-5, 1,1") == [1, 4, 5]
+
+
+def test_masks():
+    assert format_mask(0x1) == "00000001"
+    assert format_mask((1 << 40) | 1) == "00000100,00000001"
+    assert parse_mask("00000100,00000001\n") == (1 << 40) | 1
+    assert parse_mask("ff") == 0xFF
+    assert parse_mask(format_mask((1 << 64) - 2)) == (1 << 64) - 2
+
+
+def test_apply_and_restore(proc_root, path):
+    before = read_irq_affinities(proc_root)
+    profile = IsolationProfile([0, 33], range(1, 33), path=path, proc_root=proc_root)
+    profile.apply()
+
+    after = read_irq_affinities(proc_root)
+    assert after["0"] == "fffffffd,fffffffe"
+    # Only on the attacker's cores, so moved to every other core
+    assert after["1"] == "fffffffd,fffffffe"
+    # Keeps whichever of its cores aren't the attacker's
+    assert after["2"] == "00000000,00000006"
+    assert after["33"] == "fffffffd,fffffffe"
+    assert read_default(proc_root) == "fffffffd,fffffffe"
+
+    assert sorted(profile.moved) == ["0", "1", "33"]
+    assert profile.unmoved == {}
+
+    with open(path) as f:
+        assert json.load(f) == {**before, "default": ALL}
+
+    profile.restore()
+
+    assert read_irq_affinities(proc_root) == before
+    assert read_default(proc_root) == ALL
+    assert not os.path.exists(path)
+
+    # Restoring twice, as atexit does after an explicit restore, is harmless
+    profile.restore()
+    assert read_irq_affinities(proc_root) == before
+
+
+def test_recovers_after_crash(proc_root, path):
+    before = read_irq_affinities(proc_root)
+    IsolationProfile([0], range(1, 64), path=path, proc_root=proc_root).apply()
+    assert read_irq_affinities(proc_root) != before
+
+    # The job was killed without restoring, so the next one starts by doing so
+    profile = IsolationProfile([0], range(1, 64), path=path, proc_root=proc_root)
+    profile.apply()
+
+    with open(path) as f:
+        assert json.load(f) == {**before, "default": ALL}
+
+    profile.restore()
+    assert read_irq_affinities(proc_root) == before
+
+    IsolationProfile([0], range(1, 64), path=path, proc_root=proc_root).apply()
+    IsolationProfile(
+        [0], range(1, 64), steer_irqs=False, path=path, proc_root=proc_root
+    ).apply()
+
+    assert read_irq_affinities(proc_root) == before
+    assert read_default(proc_root) == ALL
+    assert not os.path.exists(path)
+
+
+def test_reports_irqs_that_cant_move(proc_root, path, monkeypatch):
+    before = read_irq_affinities(proc_root)
+    real_open = open
+
+    def fake_open(file, mode="r", *args, **kwargs):
+        file = str(file)
+
+        if "w" in mode and file.endswith(os.path.join("1", "smp_affinity")):
+            raise OSError(errno.EIO, "Input/output error")
+
+        if "w" in mode and file.endswith(os.path.join("0", "smp_affinity")):
+            # The kernel accepts the write but keeps the old mask
+            return real_open(os.devnull, mode)
+
+        return real_open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(isolation, "open", fake_open, raising=False)
+
+    profile = IsolationProfile([0], range(1, 64), path=path, proc_root=proc_root)
+    profile.apply()
+
+    assert profile.moved == []
+    assert profile.unmoved == {
+        "0": f"kernel kept {ALL}",
+        "1": "managed by the kernel",
+    }
+
+    summary = profile.summary()
+    assert "Couldn't move 2" in summary
+    assert f"0 timer (kernel kept {ALL})" in summary
+    assert "1 nvme0q0 (managed by the kernel)" in summary
+
+    profile.restore()
+    assert read_irq_affinities(proc_root) == before
+    assert not os.path.exists(path)
+
+
+def test_only_restores_in_its_own_process(proc_root, path):
+    profile = IsolationProfile([0], range(1, 64), path=path, proc_root=proc_root)
+    profile.apply()
+    applied = read_irq_affinities(proc_root)
+
+    # As if in a forked worker
+    profile.pid = -1
+    profile.restore()
+
+    assert read_irq_affinities(proc_root) == applied
+    assert os.path.exists(path)
@@ -0,0 +1,50 @@
+import os
+import pickle
+
+import numpy as np
+
+from storage import Manifest, encode_trace, load_pickles
+
+
+def write_pickle(directory, domain, records):
+    path = os.path.join(directory, f"{domain}.pkl")
+    manifest = Manifest(directory)
+    manifest.reset(os.path.basename(path), domain)
+
+    with open(path, "wb") as f:
+        for traces in records:
+            record = pickle.dumps((traces, domain))
+            offset = f.tell()
+            f.write(record)
+            manifest.add_record(os.path.basename(path), domain, offset, record)
+
+    manifest.close()
+
+
+def test_loads_every_trace(tmp_path):
+    write_pickle(tmp_path, "a", [[[1, 2, 3]], [[4, 5]]])
+
+    # More traces than records, one of them encoded
+    write_pickle(tmp_path, "b", [[[6, 7, 8, 9], encode_trace(np.array([10, 11, 12]))]])
+
+    X, y, domains, stats = load_pickles(str(tmp_path), width=3)
+
+    assert domains == ["a", "b"]
+    assert y.tolist() == [0, 0, 1, 1]
+    assert X.tolist() == [[1, 2, 3], [4, 5, 0], [6, 7, 8], [10, 11, 12]]
+    assert stats == {"padded": 1, "truncated": 1}
+
+    X, y, _, _ = load_pickles(str(tmp_path), pad="edge")
+
+    assert X.shape == (4, 4)
+    assert X[1].tolist() == [4, 5, 5, 5]
+
+    assert Manifest(str(tmp_path)).files["b.pkl"]["traces"] == 2
+    assert Manifest(str(tmp_path)).files["b.pkl"]["width"] == 4
+
+    # Without a manifest to size the matrix from, every file is decoded first
+    os.remove(os.path.join(tmp_path, "manifest.json"))
+    X_unindexed, y_unindexed, _, _ = load_pickles(str(tmp_path), pad="edge")
+
+    assert X_unindexed.tolist() == X.tolist()
+    assert y_unindexed.tolist() == y.tolist()
@@ -0,0 +1,59 @@
+import os
+import pickle
+
+from storage import Manifest
+
+
+def write_records(manifest, directory, n, start=0):
+    with open(os.path.join(directory, "a.pkl"), "ab") as f:
+        for i in range(start, start + n):
+            record = pickle.dumps(([i] * 10, "a"))
+            offset = f.tell()
+            f.write(record)
+            f.flush()
+            manifest.add_record("a.pkl", "a", offset, record)
+
+
+def test_journal_is_replayed_and_compacted(tmp_path):
+    manifest = Manifest(tmp_path, compact_every=5)
+    manifest.reset("a.pkl", "a")
+    write_records(manifest, tmp_path, 7)
+
+    # The reset and the first four records were folded into the manifest
+    assert os.path.exists(manifest.path)
+
+    with open(manifest.journal_path) as f:
+        assert len(f.readlines()) == 3
+
+    reloaded = Manifest(tmp_path)
+    assert reloaded.files == manifest.files
+    assert reloaded.runs("a.pkl") == 7
+
+    manifest.close()
+    assert not os.path.exists(manifest.journal_path)
+    assert Manifest(tmp_path).files == manifest.files
+
+
+def test_replaying_twice_is_harmless(tmp_path):
+    manifest = Manifest(tmp_path)
+    manifest.reset("a.pkl", "a")
+    write_records(manifest, tmp_path, 3)
+
+    with open(manifest.journal_path) as f:
+        journal = f.read()
+
+    # As if we were killed after save() replaced the manifest but before it
+    # removed the journal, and again in the middle of writing a change
+    manifest.save()
+
+    with open(manifest.journal_path, "w") as f:
+        f.write(journal + '{"file": "a.p')
+
+    reloaded = Manifest(tmp_path)
+    assert reloaded.files == manifest.files
+    assert reloaded.verify("a.pkl")
+
+    # Changes made after the torn one are journaled on a line of their own
+    write_records(reloaded, tmp_path, 2, start=3)
+    assert not Manifest(tmp_path).is_stale("a.pkl")
+    assert Manifest(tmp_path).runs("a.pkl") == 5
@@ -0,0 +1,25 @@
+from lib import PhaseMetrics
+
+
+def test_prometheus_quantiles_are_over_recent_cycles(tmp_path):
+    path = tmp_path / "biggerfish.prom"
+    metrics = PhaseMetrics(1, prometheus_path=str(path), window=10)
+
+    for i in range(100):
+        metrics.log(
+            {
+                "domain": "a",
+                "saved": i % 2 == 0,
+                "total": 1.0 if i < 90 else 2.0,
+                "phases": {"navigate": 0.5},
+            }
+        )
+
+    lines = path.read_text().splitlines()
+
+    # Sums and counts cover every cycle, quantiles only the last 10
+    assert 'biggerfish_phase_seconds{phase="total",quantile="0.5"} 2.0' in lines
+    assert 'biggerfish_phase_seconds_sum{phase="total"} 110.0' in lines
+    assert 'biggerfish_phase_seconds_count{phase="navigate"} 100' in lines
+    assert 'biggerfish_traces_total{saved="true"} 50' in lines
+    assert 'biggerfish_traces_total{saved="false"} 50' in lines
@@ -0,0 +1,130 @@
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from storage import load_pickles
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SITES = ["https://www.google.com", "https://www.youtube.com", "https://www.tmall.com"]
+NUM_RUNS = 3
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_log(path):
+    with open(path) as f:
+        return f.read()
+
+
+def wait_for(fn, timeout=30):
+    deadline = time.time() + timeout
+
+    while not fn():
+        assert time.time() < deadline
+        time.sleep(0.1)
+
+
+def test_lost_receiver_is_reassigned(tmp_path):
+    ports = [free_port() for _ in range(3)]
+    logs = [tmp_path / f"receiver-{port}.log" for port in ports]
+    receivers = []
+
+    for port, log in zip(ports, logs):
+        with open(log, "w") as f:
+            receivers.append(
+                subprocess.Popen(
+                    [
+                        sys.executable,
+                        "-u",
+                        os.path.join(ROOT, "scripts", "receiver.py"),
+                        "--port",
+                        str(port),
+                        "--dry_run",
+                        "1",
+                    ],
+                    stdout=f,
+                    stderr=subprocess.STDOUT,
+                )
+            )
+
+    try:
+        for log in logs:
+            wait_for(lambda: "Waiting for connection" in read_log(log))
+
+        out_directory = tmp_path / "data"
+
+        # Say yes to record_data.py's prompts
+        answers = tmp_path / "answers"
+        answers.write_text("y\n" * 10)
+
+        with open(answers) as f:
+            job = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(ROOT, "record_data.py"),
+                    "--browser",
+                    "remote",
+                    "--receivers",
+                    ",".join(f"127.0.0.1:{port}" for port in ports),
+                    "--workers",
+                    "3",
+                    "--attacker_type",
+                    "counter",
+                    "--sites_list",
+                    ",".join(x.replace("https://", "") for x in SITES),
+                    "--num_runs",
+                    str(NUM_RUNS),
+                    "--trace_length",
+                    "1",
+                    "--skip_quality_gate",
+                    "1",
+                    "--twilio_interval",
+                    "0",
+                    "--out_directory",
+                    str(out_directory),
+                ],
+                cwd=ROOT,
+                stdin=f,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+
+        # Kill the second receiver once it's recorded a trace, so that it has
+        # work to hand back
+        wait_for(lambda: read_log(logs[1]).count("https://") >= 2, timeout=60)
+        receivers[1].kill()
+
+        output, _ = job.communicate(timeout=120)
+    finally:
+        for receiver in receivers:
+            receiver.kill()
+            receiver.wait()
+
+    assert job.returncode == 0, output
+    assert f"Lost receiver 127.0.0.1:{ports[1]}" in output
+
+    traces = {
+        int(k): int(n)
+        for k, n in re.findall(
+            r"Worker (\d) \(127\.0\.0\.1:\d+\): (\d+) traces", output
+        )
+    }
+    assert traces[1] < NUM_RUNS * len(SITES)
+    assert sum(traces.values()) == NUM_RUNS * len(SITES)
+    assert "left unrecorded" not in output
+
+    X, y, domains, _ = load_pickles(str(out_directory), width=1000)
+
+    assert domains == sorted(SITES)
+    assert np.bincount(y).tolist() == [NUM_RUNS] * len(SITES)
+    assert X.shape == (NUM_RUNS * len(SITES), 1000)
@@ -0,0 +1,60 @@
+import os
+
+from lib import TraceScheduler
+
+DOMAINS = ["a", "b", "c"]
+
+
+def make_scheduler(tmp_path, stored_runs=None, **kwargs):
+    return TraceScheduler(
+        os.path.join(tmp_path, "schedule.json"),
+        DOMAINS,
+        3,
+        stored_runs=stored_runs,
+        **kwargs,
+    )
+
+
+def test_resumes_from_journal(tmp_path):
+    scheduler = make_scheduler(tmp_path, compact_every=4)
+    stored_runs = {x: 0 for x in DOMAINS}
+
+    for _ in range(5):
+        item, _ = scheduler.next()
+        scheduler.succeed(item)
+        stored_runs[item["domain"]] += 1
+
+    # Four items were folded into the schedule and one is in the journal
+    with open(scheduler.journal_path) as f:
+        assert len(f.readlines()) == 1
+
+    # As if the job was killed without closing the scheduler
+    resumed = make_scheduler(tmp_path, stored_runs=stored_runs)
+
+    assert resumed.resumed
+    assert resumed.pending == scheduler.pending
+    assert resumed.state["completed"] == 5
+    assert not os.path.exists(resumed.journal_path)
+
+
+def test_replaying_twice_is_harmless(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+
+    for _ in range(2):
+        item, _ = scheduler.next()
+        scheduler.succeed(item)
+
+    with open(scheduler.journal_path) as f:
+        journal = f.read()
+
+    # As if we were killed after save() replaced the schedule but before it
+    # removed the journal
+    scheduler.close()
+
+    with open(scheduler.journal_path, "w") as f:
+        f.write(journal)
+
+    resumed = make_scheduler(tmp_path, stored_runs={"a": 1, "b": 1})
+
+    assert resumed.pending == scheduler.pending
+    assert resumed.state["completed"] == 2